@@ -1,5 +1,6 @@
 import heapq
 import math
+from road_graph import RoadGraph
 
 """
 Astar algorithm implementation for graph with chatgpt inspiration. 
@@ -13,6 +14,13 @@ def a_star(graph, start, goal):
     """
     This function implements the A* algorithm to find the shortest path between two nodes in a graph.
     """
+    # Search the compact graph by node ids and return the path as positions
+    if isinstance(graph, RoadGraph):
+        path = a_star_ids(graph, graph.node_ids[start], graph.node_ids[goal])
+        if path is None:
+            return None
+        return [graph.positions[node] for node in path]
+
     # Initialize the open and closed sets
     open_set = [(0, start)]  # Priority queue of (f_score, node)
     closed_set = set()
@@ -63,6 +71,69 @@ def a_star(graph, start, goal):
     return None
 
 
+def a_star_ids(graph, start, goal):
+    """
+    This function implements the A* algorithm on the node ids of a RoadGraph.
+    Returns the path as a list of node ids.
+    """
+    positions = graph.positions
+    offsets = graph.offsets
+    neighbors = graph.neighbors
+    node_count = graph.node_count
+    goal_position = positions[goal]
+
+    # Priority queue of (f_score, x, y, node), ties are broken by position like on a_star
+    open_set = [(0, *positions[start], start)]
+    closed_set = set()
+
+    # Initialize the g_scores and parents of every node
+    g_scores = [float("inf")] * len(positions)
+    g_scores[start] = 0
+    parents = {}
+
+    while open_set:
+        # Get the node with the lowest f_score from the open set
+        current_node = heapq.heappop(open_set)[3]
+
+        if current_node == goal:
+            # Reconstruct the path if the goal is reached
+            path = []
+            while current_node in parents:
+                path.insert(0, current_node)
+                current_node = parents[current_node]
+            path.insert(0, start)
+            return path
+
+        closed_set.add(current_node)
+
+        # Nodes without edges of their own have no neighbors
+        if current_node >= node_count:
+            continue
+
+        tentative_g_score = g_scores[current_node] + 1  # All edge weights are 1
+        for neighbor in neighbors[
+            offsets[current_node] : offsets[current_node + 1]
+        ].tolist():
+            if neighbor in closed_set:
+                continue  # Skip already evaluated nodes
+
+            if tentative_g_score < g_scores[neighbor]:
+                # This path to the neighbor is better than any previous one
+                parents[neighbor] = current_node
+                g_scores[neighbor] = tentative_g_score
+
+                # Calculate the f_score (f = g + h)
+                position = positions[neighbor]
+                f_score = tentative_g_score + euclidean_distance(
+                    position, goal_position
+                )
+
+                heapq.heappush(open_set, (f_score, *position, neighbor))
+
+    # If no path is found
+    return None
+
+
 def euclidean_distance(point1, point2):
     """
     This function calculates the Euclidean distance between two points.
@@ -5,54 +5,40 @@ Collaborators: Francisco Martinez Gallardo, Omar Rivera
 Date: 2023-11-30
 """
 from mesa import Agent
-from a_star import a_star
+from map_loader import DIRECTIONS, ROAD
+from collections.abc import Mapping
 import random
 
+COMPACT_CAR_BYTES = 320  # Memory budget of each CompactCar, see CompactCar
 
-class Car(Agent):
+
+class BaseCar:
     """
-    Agent that moves randomly.
-    Attributes:
-        unique_id: Agent's ID
-        goal: Agent's goal
-        time: Time when the agent started moving
-        last_move: Last position of the agent
-        first_move: Whether this is the first move of the agent
+    Rules of the cars. Car and CompactCar hold the state the rules use: unique_id, model,
+    pos, goal, time, last_move, first_move, route and route_index.
     """
 
-    def __init__(self, unique_id, model, goal):
-        """
-        Creates a new random agent.
-        Args:
-            unique_id: The agent's ID
-            model: Model reference for the agent
-        """
-        super().__init__(unique_id, model)
-        self.goal = goal
-        self.time = 0
-        self.last_move = None
-        self.first_move = True
+    __slots__ = ()
 
     def move(self):
         """
         Determines if the agent can move in the direction that was chosen
         """
-        path = a_star(
-            self.model.graph, self.pos, self.goal
-        )  # Find the closest path to the goal.
+        timers = self.model.timers
+        clock = timers.clock()
+        route = self.get_route()  # Get the closest path to the goal.
+        clock = timers.lap("routing", clock)
 
-        # If the path is None, cant get to goal something is wrong.
-        if path == None:
+        # If the route is None, cant get to goal something is wrong.
+        if route == None:
             return
-        # If the path length is higher than 2, get the next move.
-        if len(path) > 2:
-            next_move = path[1]
-        # Else the agent is in the goal destroy it.
-        else:
-            self.model.grid.remove_agent(self)
-            self.model.schedule.remove(self)
+        # If the goal is one move away or less, the agent is in the goal destroy it.
+        if len(route) - self.route_index <= 2:
+            self.model.remove_car(self)
             self.model.destroyed += 1
+            timers.lap("moves", clock)
             return
+        next_move = route[self.route_index + 1]
 
         # Check if in the next move there is a car, if so, change the next move.
         next_move = self.check_next_move_is_not_car(next_move)
@@ -63,9 +49,37 @@ class Car(Agent):
 
         # Check if the next move is a traffic light
         next_move = self.check_traffic_light(next_move)
+        clock = timers.lap("conflicts", clock)
 
         # Move the agent to next_move
         self.update_agent(next_move)
+        timers.lap("moves", clock)
+
+        # Advance on the route if the planned move was taken. If the agent took a detour
+        # the route no longer starts on its position and it is planned again next step.
+        if self.pos == route[self.route_index + 1]:
+            self.route_index += 1
+        elif self.pos == route[self.route_index] and self.model.events is not None:
+            # The agent waited, the event scheduler may skip it until what stops it changes
+            self.model.events.car_waiting(self, route[self.route_index + 1])
+
+    def get_route(self):
+        """
+        Gets the cached route of the agent, planning it again only if the agent left it.
+        The congestion routing plans every step, its costs change as the cars move.
+        """
+        if (
+            self.route is not None
+            and self.route[self.route_index] == self.pos
+            and self.model.routing != "congestion"
+        ):
+            self.model.route_cache_hits += 1
+            return self.route
+
+        self.model.route_replans += 1
+        self.route = self.model.find_path(self.pos, self.goal)
+        self.route_index = 0
+        return self.route
 
     ############################
     ## Movement functions #######
@@ -82,7 +96,7 @@ class Car(Agent):
             if self.pos != next_move:
                 self.last_move = self.pos
             self.time = self.model.step_count
-            self.model.grid.move_agent(self, next_move)
+            self.model.move_car(self, next_move)
 
     def avoid_collision(self, next_move):
         """
@@ -96,11 +110,15 @@ class Car(Agent):
             0
         ]  # Get the unchanged position
         front_agent = self.model.get_pos_agent(
-            unchanged_positions, Car
+            unchanged_positions, BaseCar
         )  # Check if there is a car in the unchanged position
         if front_agent:
             # Check if the front agent moved diagonally and if it did, do not move to avoid collision
-            if front_agent.time == self.model.step_count and (
+            # (a car that waited on every move so far has no last move)
+            if (
+                self.model.car_time(front_agent) == self.model.step_count
+                and front_agent.last_move is not None
+            ) and (
                 front_agent.last_move[0] == next_move[0]
                 or front_agent.last_move[1] == next_move[1]
             ):
@@ -113,15 +131,13 @@ class Car(Agent):
         Si es así, busca una ruta alternativa o se detiene.
         """
         # Check if the next move is a car
-        agent = self.model.get_pos_agent(next_move, Car)
-        if agent:
+        if self.model.has_car(next_move):
             # Try to move to the other side of the road to avoid collision
             other_moves = self.model.graph[self.pos]
             for move in other_moves:
                 if move != next_move and move not in self.model.destinations:
                     # Check again that the next move is not a car
-                    agent = self.model.get_pos_agent(move, Car)
-                    if not agent:
+                    if not self.model.has_car(move):
                         return move
             return self.pos
 
@@ -142,14 +158,14 @@ class Car(Agent):
                 # Check the right side
                 right = (self.pos[0] + 1, self.pos[1])
 
-                agent = self.model.get_pos_agent(right, Car)
+                agent = self.model.get_pos_agent(right, BaseCar)
                 if not agent:
                     self.model.grid.move_agent(agent, self.pos)
                     return True
                 # Check the left side
                 left = (self.pos[0] - 1, self.pos[1])
 
-                agent = self.model.get_pos_agent(left, Car)
+                agent = self.model.get_pos_agent(left, BaseCar)
                 if not agent:
                     self.model.grid.move_agent(agent, self.pos)
                     return True
@@ -157,14 +173,14 @@ class Car(Agent):
                 # Check the up side
                 up = (self.pos[0], self.pos[1] + 1)
 
-                agent = self.model.get_pos_agent(up, Car)
+                agent = self.model.get_pos_agent(up, BaseCar)
                 if not agent:
                     self.model.grid.move_agent(agent, self.pos)
                     return True
                 # Check the down side
                 down = (self.pos[0], self.pos[1] - 1)
 
-                agent = self.model.get_pos_agent(down, Car)
+                agent = self.model.get_pos_agent(down, BaseCar)
                 if not agent:
                     self.model.grid.move_agent(agent, self.pos)
                     return True
@@ -185,6 +201,31 @@ class Car(Agent):
             return True
         return False
 
+    def waiting_on(self, next_move):
+        """
+        Gets what keeps the agent on its cell when the next move of its route is next_move,
+        following check_next_move_is_not_car and check_traffic_light: (cells, traffic light),
+        the cells it checked for cars and the red traffic light it stops on, if any.
+        Returns None if the agent can move or only waits for avoid_collision, which depends on
+        the moves of the current step.
+        """
+        model = self.model
+        cells = [next_move]
+        if model.has_car(next_move):
+            next_move = None
+            for move in model.graph[self.pos]:
+                if move != cells[0] and move not in model.destination_index:
+                    cells.append(move)
+                    if not model.has_car(move):
+                        next_move = move
+                        break
+            if next_move is None:
+                return cells, None
+        traffic_light = model.traffic_light_agents.get(next_move)
+        if traffic_light is None or traffic_light.state:
+            return None
+        return cells, traffic_light
+
     ############################
     ## Trafic light functions###
     ############################
@@ -196,7 +237,7 @@ class Car(Agent):
         if agent:
             if agent.state:
                 # If it is green, move
-                self.model.grid.move_agent(self, next_move)
+                self.model.move_car(self, next_move)
                 return next_move
             else:
                 return self.pos
@@ -210,6 +251,141 @@ class Car(Agent):
         self.move()
 
 
+class Car(BaseCar, Agent):
+    """
+    Agent that moves randomly.
+    Attributes:
+        unique_id: Agent's ID
+        goal: Agent's goal
+        time: Time when the agent started moving
+        last_move: Last position of the agent
+        first_move: Whether this is the first move of the agent
+        route: Cached path from the agent to its goal
+        route_index: Index of the agent position on the route
+    """
+
+    def __init__(self, unique_id, model, goal):
+        """
+        Creates a new random agent.
+        Args:
+            unique_id: The agent's ID
+            model: Model reference for the agent
+        """
+        super().__init__(unique_id, model)
+        self.goal = goal
+        self.time = 0
+        self.last_move = None
+        self.first_move = True
+        self.route = None
+        self.route_index = 0
+
+
+class CompactCar(BaseCar):
+    """
+    Car with the same rules as Car and a smaller memory footprint. It has no instance dict,
+    its state is kept on __slots__, and the cell, goal and last move are small ints: the cell
+    is x * model.height + y and the goal the index of the destination on model.destinations.
+    pos, goal and last_move are properties, so the grid, the scheduler and the serializers
+    use it like a Car. Mesa only needs unique_id, pos and step from an agent.
+    Budget, CPython 3.11 64 bit with field routing: COMPACT_CAR_BYTES per car, counting the
+    car, its ints, its route and its entries on the scheduler and the grid. It measures about
+    260 to 300 bytes depending on the map (a Car about 1000 to 1500), so the budget leaves
+    less than 10% of headroom over the worst maps. With field routing the route is not
+    cached, the next cell comes from the next hop field. tests/test_agent.py enforces the
+    budget on that interpreter and the size of each slot on any one, benchmark.py reports it.
+    Attributes:
+        unique_id: Car ID
+        model: Model reference for the car
+        cell: Encoded position, -1 when the car is not on the grid
+        goal_index: Index of the goal on model.destinations
+        time: Time when the car started moving
+        last_cell: Encoded last position, -1 if the car has none
+        first_move: Whether this is the first move of the car
+        route: Cached path from the car to its goal
+        route_index: Index of the car position on the route
+    """
+
+    __slots__ = (
+        "unique_id",
+        "model",
+        "cell",
+        "goal_index",
+        "time",
+        "last_cell",
+        "first_move",
+        "route",
+        "route_index",
+    )
+
+    def __init__(self, unique_id, model, goal):
+        self.unique_id = unique_id
+        self.model = model
+        self.cell = -1
+        self.goal_index = model.destination_index[goal]
+        self.time = 0
+        self.last_cell = -1
+        self.first_move = True
+        self.route = None
+        self.route_index = 0
+
+    def encode(self, position):
+        """Encodes a position as a small int, -1 for None."""
+        if position is None:
+            return -1
+        return position[0] * self.model.height + position[1]
+
+    def decode(self, cell):
+        """Decodes a small int into a position, None for -1."""
+        if cell == -1:
+            return None
+        return divmod(cell, self.model.height)
+
+    @property
+    def pos(self):
+        return self.decode(self.cell)
+
+    @pos.setter
+    def pos(self, position):
+        self.cell = self.encode(position)
+
+    @property
+    def last_move(self):
+        return self.decode(self.last_cell)
+
+    @last_move.setter
+    def last_move(self, position):
+        self.last_cell = self.encode(position)
+
+    @property
+    def goal(self):
+        return self.model.destinations[self.goal_index]
+
+    def get_route(self):
+        """
+        Gets the route of the car. With the "field" routing nothing is cached, the next hop
+        field of the goal gives the next move from any cell, and the route is cut to what
+        move reads: [position, next move, goal], or only [position] when the goal is one
+        move away or less. The other routings cache the route like Car.
+        """
+        model = self.model
+        if model.routing != "field":
+            return super().get_route()
+        model.route_replans += 1
+        next_hop, distance = model.route_fields.field(self.goal_index)
+        node = model.graph.node_id(self.pos)
+        moves = distance[node]
+        self.route_index = 0
+        if moves == -1:
+            return None
+        if moves <= 1:
+            return [self.pos]
+        return [
+            self.pos,
+            model.graph.positions[next_hop[node]],
+            self.goal,
+        ]
+
+
 class Traffic_Light(Agent):
     """
     Traffic light. Where the traffic lights are in the grid.
@@ -237,81 +413,15 @@ class Traffic_Light(Agent):
         """
         # Find id on self.model.traffic_lights_ids
         time_threshold_for_change = 5  # cambiar las luces cada 5 pasos
+        clock = self.model.timers.clock()
 
-        # Change the state of the traffic light
-        if self.model.schedule.steps % time_threshold_for_change == 0:
-            self.state = not self.state
-
-    # For future implementation add smart traffic lights
-    """
-    def check_cooldown(self, set_id, other_id):
-
-        Verifica si el semáforo está en cooldown.
-
-        return (
-            self.model.traffic_lights_sets[set_id]["cooldown"]
-            and self.model.traffic_lights_sets[other_id]["cooldown"]
-        )
-
-    def count_amount_of_cars(self, set_id, direction):
-
-        Cuenta la cantidad de coches en la dirección del semáforo.
-
-        # Find the road in the direction of the traffic light
-        positions = self.model.traffic_lights_sets[set_id]["traffic_light"]
-        car_count = 0
-
-        # Move according to the direction of the traffic light
-        positions = self.move_positions(positions, direction)
-        while self.check_positions_are_valid(positions):
-            positions = self.move_positions(positions, direction)
-            car_count += 1
-        return car_count
-
-    def move_positions(self, positions, direction):
-        if direction == "Up":
-            positions = [(pos[0], pos[1] - 1) for pos in positions]
-        elif direction == "Down":
-            positions = [(pos[0], pos[1] + 1) for pos in positions]
-        elif direction == "Left":
-            positions = [(pos[0] + 1, pos[1]) for pos in positions]
-        elif direction == "Right":
-            positions = [(pos[0] - 1, pos[1]) for pos in positions]
-        return positions
-
-    def check_positions_are_valid(self, positions):
-
-        This function checks if the positions are valid
-
-        for pos in positions:
-            if not self.check_position_on_bounds(pos):
-                return False
-            if not self.check_if_car_in_position(pos):
-                return False
-        return True
-
-    def check_position_on_bounds(self, pos):
-
-        This function checks if the position is on the bounds of the grid
-
+        # Change the state of the traffic light, unless a controller switches the lights
         if (
-            pos[0] >= 0
-            or pos[0] <= self.model.grid.width - 1
-            or pos[1] >= 0
-            or pos[1] <= self.model.grid.height - 1
+            self.model.light_controller is None
+            and self.model.schedule.steps % time_threshold_for_change == 0
         ):
-            return True
-        return False
-
-    def check_if_car_in_position(self, pos):
-
-        This function checks if there is a car in the position
-
-        agent = self.model.get_pos_agent(pos, Car)
-        if agent:
-            return True
-        return False
-    """
+            self.state = not self.state
+        self.model.timers.lap("lights", clock)
 
 
 #####################################
@@ -343,6 +453,67 @@ class Obstacle(Agent):
         pass
 
 
+class StaticAgents(Mapping):
+    """
+    Adapter for the code that expects Road, Obstacle or Destination agents. Those cells never
+    act, so the model keeps them on static layers (model.city_map) and this mapping shows the
+    cells of one kind as agents, position -> agent. The agent of a cell is created on its
+    first access and kept, so every lookup of a cell gives the same object, like the agents
+    the model used to create. They are not on the grid or the schedule.
+    Attributes:
+        model: CityModel of the cells
+        kind: Kind of the cells, see map_loader.py
+        agent_class: Road, Obstacle or Destination
+        agents: Agent of each cell looked up so far
+    """
+
+    ID_PREFIXES = {"Road": "r", "Obstacle": "ob", "Destination": "d"}
+
+    def __init__(self, model, kind, agent_class):
+        self.model = model
+        self.kind = kind
+        self.agent_class = agent_class
+        self.agents = {}
+
+    def __contains__(self, position):
+        x, y = position
+        model = self.model
+        return (
+            0 <= x < model.width
+            and 0 <= y < model.height
+            and model.city_map.cells[x, y] == self.kind
+        )
+
+    def __getitem__(self, position):
+        agent = self.agents.get(position)
+        if agent is not None:
+            return agent
+        if position not in self:
+            raise KeyError(position)
+        model = self.model
+        x, y = position
+        # Same id as the agent of the cell on the map text order
+        unique_id = (
+            f"{self.ID_PREFIXES[self.agent_class.__name__]}_"
+            f"{(model.height - y - 1) * model.width + x}"
+        )
+        if self.kind == ROAD:
+            direction = DIRECTIONS[model.city_map.directions[x, y]]
+            agent = self.agent_class(unique_id, model, direction)
+        else:
+            agent = self.agent_class(unique_id, model)
+        agent.pos = position
+        self.agents[position] = agent
+        return agent
+
+    def __iter__(self):
+        """Iterates the positions in the order of the map text."""
+        return map(tuple, self.model.city_map.positions(self.kind).tolist())
+
+    def __len__(self):
+        return int((self.model.city_map.cells == self.kind).sum())
+
+
 class Road(Agent):
     """
     Road agent. Determines where the cars can move, and in which direction.
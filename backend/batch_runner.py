@@ -0,0 +1,254 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Headless batch runner. Runs many independent simulations of the city model on a process pool
+and writes the results of all of them on a single table.
+Usage:
+    python batch_runner.py --seeds 0-9 --maps 2022_base.txt 2023_base.txt --steps 1000 --workers 4
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from multiprocessing import Pool
+from model import CityModel
+from map_cache import DEFAULT_CACHE, load_compiled_map
+from checkpoint import load_checkpoint, read_settings
+import argparse
+import csv
+import itertools
+import os
+import sys
+import time
+
+MAPS_DIRECTORY = "city_files"  # Directory of the bundled maps
+DICTIONARY_FILE = os.path.join(MAPS_DIRECTORY, "mapDictionary.json")
+RESULT_FIELDS = [
+    "seed",
+    "map",
+    "routing",
+    "engine",
+    "lights",
+    "scheduler",
+    "steps",
+    "steps_run",
+    "destroyed",
+    "cars",
+    "init_seconds",
+    "step_mean_ms",
+    "step_p95_ms",
+    "step_max_ms",
+    "total_seconds",
+]  # Columns of the results table
+
+
+def run_simulation(scenario):
+    """
+    Runs one simulation and returns its row of the results table.
+    The scenario is a dictionary with the seed, map, steps, routing, car engine, traffic
+    light control and scheduler of the simulation.
+    A scenario with a checkpoint starts from it with its seed, see checkpoint.py, and runs
+    the steps after the saved ones.
+    The simulation stops early if the model stops running.
+    """
+    start = time.perf_counter()
+    if scenario.get("checkpoint"):
+        model = load_checkpoint(
+            scenario["checkpoint"],
+            scenario.get("map_cache") or DEFAULT_CACHE,
+            seed=scenario["seed"],
+        )
+    else:
+        model = CityModel(
+            routing=scenario["routing"],
+            map_file=scenario["map"],
+            map_cache=scenario.get("map_cache"),
+            engine=scenario.get("engine", "agents"),
+            lights=scenario.get("lights", "fixed"),
+            seed=scenario["seed"],
+            scheduler=scenario.get("scheduler", "base"),
+        )
+    init_seconds = time.perf_counter() - start
+
+    step_times = []
+    while len(step_times) < scenario["steps"] and model.running:
+        step_start = time.perf_counter()
+        model.step()
+        step_times.append(time.perf_counter() - step_start)
+
+    step_times.sort()
+    return {
+        "seed": scenario["seed"],
+        "map": os.path.basename(scenario["map"]),
+        "routing": scenario["routing"],
+        "engine": scenario.get("engine", "agents"),
+        "lights": scenario.get("lights", "fixed"),
+        "scheduler": scenario.get("scheduler", "base"),
+        "steps": scenario["steps"],
+        "steps_run": len(step_times),
+        "destroyed": model.destroyed,
+        "cars": model.count_car_agents(),
+        "init_seconds": round(init_seconds, 6),
+        "step_mean_ms": round(1000 * sum(step_times) / max(len(step_times), 1), 4),
+        "step_p95_ms": round(1000 * percentile(step_times, 0.95), 4),
+        "step_max_ms": round(1000 * (step_times[-1] if step_times else 0), 4),
+        "total_seconds": round(time.perf_counter() - start, 6),
+    }
+
+
+def percentile(sorted_values, fraction):
+    """Gets a percentile of already sorted values, 0 if there are no values."""
+    if not sorted_values:
+        return 0
+    return sorted_values[
+        min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    ]
+
+
+def make_scenarios(
+    seeds,
+    maps,
+    steps,
+    routings=("field",),
+    map_cache=None,
+    engine="agents",
+    light_controls=("fixed",),
+    checkpoint=None,
+    scheduler="base",
+):
+    """
+    Makes a scenario for every combination of seed, map, step budget, routing and traffic
+    light control. map_cache is the directory of the compiled maps, see map_cache.py, and
+    engine the car engine of the models, see fleet.py. checkpoint is a checkpoint file every
+    scenario starts from, its map and settings must be the ones given. scheduler is the
+    scheduler of the models, see events.py.
+    """
+    return [
+        {
+            "seed": seed,
+            "map": map_file,
+            "steps": step_budget,
+            "routing": routing,
+            "map_cache": map_cache,
+            "engine": engine,
+            "lights": lights,
+            "checkpoint": checkpoint,
+            "scheduler": scheduler,
+        }
+        for map_file, step_budget, routing, lights, seed in itertools.product(
+            maps, steps, routings, light_controls, seeds
+        )
+    ]
+
+
+def run_batch(scenarios, workers=None):
+    """
+    Runs the scenarios on a process pool and returns their results in the same order.
+    workers=0 runs them one after the other on the current process.
+    """
+    # Compile the maps once, so the workers don't compile them at the same time
+    compiled = set()
+    for scenario in scenarios:
+        key = (scenario["map"], scenario.get("map_cache"))
+        if key[1] is not None and key not in compiled:
+            compiled.add(key)
+            load_compiled_map(scenario["map"], DICTIONARY_FILE, key[1])
+
+    if workers == 0:
+        return [run_simulation(scenario) for scenario in scenarios]
+    with Pool(workers) as pool:
+        return pool.map(run_simulation, scenarios, chunksize=1)
+
+
+def write_results(results, output):
+    """Writes the results table as csv."""
+    writer = csv.DictWriter(output, fieldnames=RESULT_FIELDS)
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def parse_seeds(values):
+    """Parses seeds given as numbers or inclusive ranges like 0-9."""
+    seeds = []
+    for value in values:
+        if "-" in value:
+            first, last = value.split("-")
+            seeds.extend(range(int(first), int(last) + 1))
+        else:
+            seeds.append(int(value))
+    return seeds
+
+
+def resolve_map(name):
+    """Gets the path of a map, names without directory are looked up on city_files."""
+    if os.path.dirname(name) or os.path.exists(name):
+        return name
+    return os.path.join(MAPS_DIRECTORY, name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run city simulations in parallel.")
+    parser.add_argument(
+        "--seeds", nargs="+", default=["0"], help="Seeds or ranges (0-9)"
+    )
+    parser.add_argument("--maps", nargs="+", default=["2023_base.txt"])
+    parser.add_argument("--steps", nargs="+", type=int, default=[1000])
+    parser.add_argument(
+        "--routing",
+        nargs="+",
+        choices=["field", "astar", "congestion"],
+        default=["field"],
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Processes, 0 to run serially"
+    )
+    parser.add_argument("--output", help="Csv file of the results, stdout by default")
+    parser.add_argument("--map-cache", help="Directory of the compiled maps")
+    parser.add_argument(
+        "--engine",
+        choices=["agents", "compact", "fleet"],
+        default="agents",
+        help="Car engine",
+    )
+    parser.add_argument(
+        "--lights", nargs="+", choices=["fixed", "actuated"], default=["fixed"]
+    )
+    parser.add_argument(
+        "--scheduler",
+        choices=["base", "events"],
+        default="base",
+        help="Scheduler of the cars",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="Checkpoint every run starts from, its settings replace the map ones",
+    )
+    args = parser.parse_args(argv)
+
+    maps = [resolve_map(name) for name in args.maps]
+    if args.checkpoint:
+        settings = read_settings(args.checkpoint)
+        maps = [settings["map_file"]]
+        args.routing = [settings["routing"]]
+        args.engine = settings["engine"]
+        args.lights = [settings["lights"]]
+        args.scheduler = settings.get("scheduler", "base")
+    scenarios = make_scenarios(
+        parse_seeds(args.seeds),
+        maps,
+        args.steps,
+        args.routing,
+        args.map_cache,
+        args.engine,
+        args.lights,
+        args.checkpoint,
+        args.scheduler,
+    )
+    results = run_batch(scenarios, args.workers)
+
+    if args.output:
+        with open(args.output, "w", newline="") as output:
+            write_results(results, output)
+    else:
+        write_results(results, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
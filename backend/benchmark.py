@@ -0,0 +1,376 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Benchmark suite of the city model. Times the construction of the model, the steps at increasing
+car counts on the car engines and schedulers, the a_star searches, the serialization of
+/getAgents and the memory of each car, on the bundled maps and on bigger synthetic maps. The
+results are written as json so two versions can be compared, and the run fails if a CompactCar
+goes over COMPACT_CAR_BYTES.
+Usage:
+    python benchmark.py --output results.json
+    python benchmark.py --output new.json --compare results.json
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from a_star import a_star
+from agent import COMPACT_CAR_BYTES
+from model import CityModel
+from map_generator import generate_grid_city, read_map, tile_map, write_map
+from snapshots import car_positions, encode_binary
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BUNDLED_MAPS = [
+    "city_files/2021_base.txt",
+    "city_files/2022_base.txt",
+    "city_files/2023_base.txt",
+]  # Maps shipped with the project
+SYNTHETIC_TILES = [2, 4]  # Tiled maps made of n x n copies of the 2023 map
+SYNTHETIC_GRIDS = [200]  # Generated n x n grid cities
+CAR_COUNTS = [0, 50, 200, 800]  # Cars on the map for the step benchmark
+FLEET_CAR_COUNTS = [
+    3200,
+    12800,
+]  # Extra car counts for the fleet engine, capped by the map
+A_STAR_PAIRS = 32  # Origin and destination pairs searched on the a_star benchmark
+MEMORY_CARS = 2000  # Cars added on the memory benchmark, capped by the map
+MEMORY_STEPS = 3  # Steps run after adding the cars, so their routes are cached
+MEMORY_MIN_CARS = 1000  # Cars needed to check the budget, fewer are dominated by noise
+
+
+############################
+#### Timing functions ######
+############################
+
+
+def time_call(function, repeat):
+    """
+    Calls the function repeat times and returns its timings in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(1000 * (time.perf_counter() - start))
+    return {
+        "repeat": repeat,
+        "min_ms": round(min(timings), 4),
+        "median_ms": round(statistics.median(timings), 4),
+        "mean_ms": round(statistics.fmean(timings), 4),
+    }
+
+
+def record(results, benchmark, map_file, timings, **params):
+    """Adds the timings of a benchmark to the results and prints them."""
+    result = {"benchmark": benchmark, "map": os.path.basename(map_file), **params}
+    result.update(timings)
+    results.append(result)
+    print(
+        f"{benchmark:<12} {result['map']:<22} {json.dumps(params):<28} "
+        f"median {timings['median_ms']:>10.3f} ms",
+        file=sys.stderr,
+    )
+
+
+############################
+#### Maps ##################
+############################
+
+
+def make_synthetic_maps(directory, base_map="city_files/2023_base.txt"):
+    """
+    Writes the synthetic maps on the directory and returns their paths.
+    """
+    lines = read_map(base_map)
+    maps = []
+    for tiles in SYNTHETIC_TILES:
+        path = os.path.join(directory, f"synthetic_{tiles}x{tiles}.txt")
+        write_map(tile_map(lines, tiles), path)
+        maps.append(path)
+    for size in SYNTHETIC_GRIDS:
+        path = os.path.join(directory, f"grid_{size}x{size}.txt")
+        write_map(generate_grid_city(size, size), path)
+        maps.append(path)
+    return maps
+
+
+def add_random_cars(model, count, rng):
+    """
+    Adds cars on random free road cells, each one going to a destination it can reach.
+    """
+    cells = [
+        position
+        for position in model.road_agents
+        if position in model.graph and not model.has_car(position)
+    ]
+    rng.shuffle(cells)
+    for position in cells[:count]:
+        if model.route_fields is not None:
+            # The distance fields tell the reachable goals without following the paths
+            node = model.graph.node_id(position)
+            goals = [
+                goal
+                for i, goal in enumerate(model.destinations)
+                if model.route_fields.field(i)[1][node] != -1
+            ]
+        else:
+            goals = [
+                goal
+                for goal in model.destinations
+                if model.find_path(position, goal) is not None
+            ]
+        if not goals:
+            continue
+        model.spawn_car(position, rng.choice(goals))
+
+
+############################
+#### Benchmarks ############
+############################
+
+
+def benchmark_init(results, map_file, repeat, map_cache):
+    """
+    Times the construction of the model, map parse plus graph build, and the construction
+    from a compiled map already on the cache.
+    """
+    record(
+        results,
+        "init",
+        map_file,
+        time_call(lambda: CityModel(map_file=map_file), repeat),
+    )
+    CityModel(map_file=map_file, map_cache=map_cache)  # Compile the map
+    record(
+        results,
+        "init_cached",
+        map_file,
+        time_call(lambda: CityModel(map_file=map_file, map_cache=map_cache), repeat),
+    )
+
+
+def benchmark_step(results, map_file, steps):
+    """
+    Times the steps of the model at increasing car counts, on every car engine and on the
+    event scheduler (events.py), whose results have a scheduler field.
+    """
+    for engine, scheduler, counts in (
+        ("agents", "base", CAR_COUNTS),
+        ("compact", "base", CAR_COUNTS),
+        ("agents", "events", CAR_COUNTS),
+        ("fleet", "base", CAR_COUNTS + FLEET_CAR_COUNTS),
+    ):
+        for count in counts:
+            model = CityModel(
+                map_file=map_file, engine=engine, seed=0, scheduler=scheduler
+            )
+            add_random_cars(model, count, random.Random(0))
+            cars = model.count_car_agents()
+            params = {"cars": cars, "engine": engine}
+            if scheduler != "base":
+                params["scheduler"] = scheduler
+            record(results, "step", map_file, time_call(model.step, steps), **params)
+            if cars < count:
+                break  # The map is full, bigger counts give the same cars
+
+
+def benchmark_a_star(results, map_file, repeat):
+    """Times a_star from the spawn cells to a sample of the destinations."""
+    model = CityModel(map_file=map_file)
+    pairs = [
+        (spawn, goal) for spawn in model.spawn_cells for goal in model.destinations
+    ]
+    pairs = random.Random(0).sample(pairs, min(A_STAR_PAIRS, len(pairs)))
+
+    def search():
+        for start, goal in pairs:
+            a_star(model.graph, start, goal)
+
+    record(results, "a_star", map_file, time_call(search, repeat), pairs=len(pairs))
+
+
+def benchmark_serialization(results, map_file, repeat):
+    """Times the /getAgents json payload and the binary snapshot of a busy model."""
+    model = CityModel(map_file=map_file, seed=0)
+    add_random_cars(model, max(CAR_COUNTS), random.Random(0))
+    cars = model.count_car_agents()
+    record(
+        results,
+        "getAgents",
+        map_file,
+        time_call(lambda: json.dumps({"positions": car_positions(model)}), repeat),
+        cars=cars,
+    )
+    record(
+        results,
+        "binary",
+        map_file,
+        time_call(lambda: encode_binary(model), repeat),
+        cars=cars,
+    )
+
+
+def measure_car_bytes(map_file, engine, count=MEMORY_CARS):
+    """
+    Measures the memory each car takes on an engine: everything allocated while adding the
+    cars and running a few steps, over the cars on the model. It counts the car, its cached
+    route and its entries on the scheduler and the grid.
+    Returns the number of cars and the bytes per car.
+    """
+    model = CityModel(map_file=map_file, engine=engine, seed=0)
+    model.step()  # Build what the model creates on its first step
+    if model.route_fields is not None:
+        for i in range(len(model.destinations)):
+            model.route_fields.field(i)  # The fields are shared by the cars
+    gc.collect()
+    tracemalloc.start()
+    add_random_cars(model, count, random.Random(0))
+    for _ in range(MEMORY_STEPS):
+        model.step()
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    cars = model.count_car_agents()
+    return cars, round(allocated / max(cars, 1))
+
+
+def benchmark_memory(results, map_file):
+    """Measures the memory of each car on the agents and compact engines."""
+    for engine in ("agents", "compact"):
+        cars, car_bytes = measure_car_bytes(map_file, engine)
+        result = {
+            "benchmark": "memory",
+            "map": os.path.basename(map_file),
+            "cars": cars,
+            "engine": engine,
+            "car_bytes": car_bytes,
+        }
+        results.append(result)
+        print(
+            f"{'memory':<12} {result['map']:<22} "
+            f"{json.dumps({'cars': cars, 'engine': engine}):<28} "
+            f"{car_bytes:>10} bytes per car",
+            file=sys.stderr,
+        )
+
+
+def run_benchmarks(maps, repeat, steps, map_cache):
+    """Runs every benchmark on every map, compiled maps are written on map_cache."""
+    results = []
+    for map_file in maps:
+        benchmark_init(results, map_file, repeat, map_cache)
+        benchmark_step(results, map_file, steps)
+        benchmark_a_star(results, map_file, repeat)
+        benchmark_serialization(results, map_file, repeat)
+        benchmark_memory(results, map_file)
+    return results
+
+
+############################
+#### Regressions ###########
+############################
+
+
+def result_key(result):
+    """Key of a result, every field but the timings and sizes."""
+    return tuple(
+        (key, value)
+        for key, value in sorted(result.items())
+        if not key.endswith(("_ms", "_bytes")) and key != "repeat"
+    )
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the best time of each result with the baseline, the minimum is the timing
+    least affected by the noise of the machine.
+    Returns the results that are slower than the baseline by more than the tolerance.
+    """
+    baseline = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result_key(result))
+        if (
+            previous
+            and "min_ms" in result
+            and result["min_ms"] > previous["min_ms"] * (1 + tolerance)
+        ):
+            regressions.append({**result, "baseline_min_ms": previous["min_ms"]})
+    return regressions
+
+
+def over_budget(results):
+    """
+    Gets the memory results of the compact engine over COMPACT_CAR_BYTES, on the maps with
+    enough cars to spread the allocations of the model that don't grow with the cars.
+    """
+    return [
+        result
+        for result in results
+        if result["benchmark"] == "memory"
+        and result["engine"] == "compact"
+        and result["cars"] >= MEMORY_MIN_CARS
+        and result["car_bytes"] > COMPACT_CAR_BYTES
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the city model.")
+    parser.add_argument(
+        "--maps", nargs="+", help="Maps to use instead of the default ones"
+    )
+    parser.add_argument(
+        "--no-synthetic", action="store_true", help="Skip synthetic maps"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--steps", type=int, default=50, help="Steps timed per car count"
+    )
+    parser.add_argument("--output", help="Json file of the results, stdout by default")
+    parser.add_argument("--compare", help="Json file of a previous run to compare with")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Slowdown allowed on --compare"
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        maps = args.maps or list(BUNDLED_MAPS)
+        if not args.no_synthetic:
+            maps += make_synthetic_maps(directory)
+        results = run_benchmarks(
+            maps, args.repeat, args.steps, os.path.join(directory, "compiled")
+        )
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+    regressions = over_budget(results)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions += compare(
+                results, json.load(baseline_file)["results"], args.tolerance
+            )
+    for regression in regressions:
+        print(f"Regression: {json.dumps(regression)}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Checkpoints of a running model. A checkpoint is a compressed .npz file with the state of the
+cars as arrays, the traffic lights, the step counters and the random generator of the model.
+Restoring builds the model from the compiled map (map_cache.py), so the map is not parsed and
+the graph is not built again, and then puts the saved state on it. A city can be warmed up once
+and many experiments started from the same checkpoint, each one with its own seed.
+Usage:
+    python checkpoint.py --map city_files/2023_base.txt --steps 500 --seed 0 --output warm.npz
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from model import CityModel
+from map_cache import DEFAULT_CACHE, map_key
+import argparse
+import json
+import numpy as np
+
+CHECKPOINT_VERSION = 1  # Layout version, other versions are rejected
+MODEL_COUNTERS = (
+    "step_count",
+    "agent_count",
+    "destroyed",
+    "running",
+    "route_cache_hits",
+    "route_replans",
+)  # Attributes of the model saved as they are
+
+
+class CheckpointError(Exception):
+    """Error restoring a checkpoint, e.g. its map changed since it was saved."""
+
+
+############################
+#### Save functions ########
+############################
+
+
+def save_checkpoint(model, path):
+    """Saves the state of a model on a .npz file."""
+    settings = model.settings
+    state = model.random.getstate()
+    meta = {
+        "version": CHECKPOINT_VERSION,
+        "settings": settings,
+        "map_key": map_key(settings["map_file"], settings["dictionary_file"]),
+        "counters": {name: getattr(model, name) for name in MODEL_COUNTERS},
+        "schedule": [model.schedule.steps, model.schedule.time],
+        "random": [state[0], state[2]],
+    }
+    arrays = car_arrays(model)
+    arrays["random_state"] = np.array(state[1], dtype=np.uint32)
+    arrays["light_states"] = np.array(
+        [traffic_light.state for traffic_light in model.traffic_lights], dtype=bool
+    )
+    controller = model.light_controller
+    if controller is not None:
+        arrays["light_green"] = controller.green
+        arrays["light_elapsed"] = controller.elapsed
+        meta["light_switches"] = controller.switches
+    router = model.router
+    if router is not None:
+        arrays["router_costs"] = np.array(router.costs, dtype=np.int32)
+        arrays["router_occupied"] = np.array(sorted(router.occupied), dtype=np.int64)
+        arrays["router_touched"] = np.array(sorted(router.touched), dtype=np.int64)
+        meta["router_updated_step"] = router.updated_step
+    np.savez_compressed(path, meta=np.array(json.dumps(meta)), **arrays)
+
+
+def car_arrays(model):
+    """
+    Gets the state of the cars as arrays, in the order they were created. The cached routes
+    of the car agents are kept as the cells left on them, route_offsets has the start of the
+    route of each car on route_cells.
+    """
+    destination_index = {
+        destination: i for i, destination in enumerate(model.destinations)
+    }
+    fleet = model.fleet
+    if fleet is not None:
+        fleet.flush()
+        coords = fleet.coords[fleet.nodes]
+        return {
+            "ids": fleet.ids,
+            "x": coords[:, 0],
+            "y": coords[:, 1],
+            "goals": fleet.goals,
+            "times": fleet.times,
+            "last_x": fleet.last_x,
+            "last_y": fleet.last_y,
+            "first_move": fleet.first_move,
+            "route_offsets": np.zeros(len(fleet.ids) + 1, dtype=np.int64),
+            "route_cells": np.zeros((0, 2), dtype=np.int32),
+        }
+
+    cars = list(model.cars.values())
+    routes = [
+        car.route[car.route_index :] if car.route is not None else [] for car in cars
+    ]
+    last_moves = [car.last_move or (-1, -1) for car in cars]
+    return {
+        "ids": np.array([car.unique_id for car in cars], dtype=np.int64),
+        "x": np.array([car.pos[0] for car in cars], dtype=np.int32),
+        "y": np.array([car.pos[1] for car in cars], dtype=np.int32),
+        "goals": np.array(
+            [destination_index[car.goal] for car in cars], dtype=np.int32
+        ),
+        "times": np.array([model.car_time(car) for car in cars], dtype=np.int32),
+        "last_x": np.array([move[0] for move in last_moves], dtype=np.int32),
+        "last_y": np.array([move[1] for move in last_moves], dtype=np.int32),
+        "first_move": np.array([car.first_move for car in cars], dtype=bool),
+        "route_offsets": np.cumsum([0] + [len(route) for route in routes]),
+        "route_cells": np.array(
+            [cell for route in routes for cell in route], dtype=np.int32
+        ).reshape(-1, 2),
+    }
+
+
+############################
+#### Restore functions #####
+############################
+
+
+def read_settings(path):
+    """Gets the arguments of the model saved on a checkpoint."""
+    with np.load(path) as data:
+        return json.loads(str(data["meta"]))["settings"]
+
+
+def load_checkpoint(path, map_cache=DEFAULT_CACHE, seed=None):
+    """
+    Builds a model with the state saved on a checkpoint.
+    map_cache is the directory of the compiled maps, the map is compiled there if needed.
+    A seed starts a new random generator instead of the saved one, so runs started from the
+    same checkpoint spawn different cars.
+    """
+    with np.load(path) as data:
+        arrays = dict(data)
+    meta = json.loads(str(arrays.pop("meta")))
+    if meta["version"] != CHECKPOINT_VERSION:
+        raise CheckpointError(f"Unknown checkpoint version {meta['version']}")
+    settings = dict(meta["settings"])
+    if map_key(settings["map_file"], settings["dictionary_file"]) != meta["map_key"]:
+        raise CheckpointError(f"The map {settings['map_file']} changed since the save")
+
+    if seed is not None:
+        settings["seed"] = seed
+    model = CityModel(map_cache=map_cache, **settings)
+    for name, value in meta["counters"].items():
+        setattr(model, name, value)
+    model.schedule.steps, model.schedule.time = meta["schedule"]
+    if seed is None:
+        version, gauss_next = meta["random"]
+        state = tuple(arrays["random_state"].tolist())
+        model.random.setstate((version, state, gauss_next))
+
+    for traffic_light, state in zip(model.traffic_lights, arrays["light_states"]):
+        traffic_light.state = bool(state)
+    controller = model.light_controller
+    if controller is not None:
+        controller.green[:] = arrays["light_green"]
+        controller.elapsed[:] = arrays["light_elapsed"]
+        controller.switches = meta["light_switches"]
+
+    restore_cars(model, arrays)
+
+    # After the cars, placing them marks their cells as touched
+    router = model.router
+    if router is not None:
+        router.costs = arrays["router_costs"].tolist()
+        router.occupied = set(arrays["router_occupied"].tolist())
+        router.touched = set(arrays["router_touched"].tolist())
+        router.updated_step = meta["router_updated_step"]
+    return model
+
+
+def restore_cars(model, arrays):
+    """Places the saved cars on a model without cars, in the order they were created."""
+    destinations = model.destinations
+    positions = list(zip(arrays["x"].tolist(), arrays["y"].tolist()))
+    goals = arrays["goals"].tolist()
+    fleet = model.fleet
+    if fleet is not None:
+        for unique_id, position, goal in zip(arrays["ids"].tolist(), positions, goals):
+            fleet.add_car(unique_id, position, destinations[goal])
+        fleet.flush()
+        for name in ("times", "last_x", "last_y", "first_move"):
+            getattr(fleet, name)[:] = arrays[name]
+        return
+
+    offsets = arrays["route_offsets"].tolist()
+    route_cells = [tuple(cell) for cell in arrays["route_cells"].tolist()]
+    for i, unique_id in enumerate(arrays["ids"].tolist()):
+        car = model.car_class(unique_id, model, destinations[goals[i]])
+        car.time = int(arrays["times"][i])
+        if arrays["last_x"][i] != -1:
+            car.last_move = (int(arrays["last_x"][i]), int(arrays["last_y"][i]))
+        car.first_move = bool(arrays["first_move"][i])
+        if offsets[i + 1] > offsets[i]:
+            car.route = route_cells[offsets[i] : offsets[i + 1]]
+        model.add_car(car, positions[i])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm up a city and save it.")
+    parser.add_argument("--map", default="city_files/2023_base.txt")
+    parser.add_argument("--steps", type=int, default=500, help="Steps of the warm up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--routing", choices=["field", "astar", "congestion"], default="field"
+    )
+    parser.add_argument(
+        "--engine", choices=["agents", "compact", "fleet"], default="agents"
+    )
+    parser.add_argument("--lights", choices=["fixed", "actuated"], default="fixed")
+    parser.add_argument("--map-cache", default=DEFAULT_CACHE)
+    parser.add_argument("--output", required=True, help="Checkpoint file (.npz)")
+    args = parser.parse_args(argv)
+
+    model = CityModel(
+        routing=args.routing,
+        map_file=args.map,
+        map_cache=args.map_cache,
+        engine=args.engine,
+        lights=args.lights,
+        seed=args.seed,
+    )
+    for _ in range(args.steps):
+        model.step()
+    save_checkpoint(model, args.output)
+
+
+if __name__ == "__main__":
+    main()
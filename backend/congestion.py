@@ -0,0 +1,275 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Congestion aware routing. Moving to a node costs more when a car is stopped on it or when it is
+a red traffic light, and every destination keeps the cost to reach it from each node. The costs
+are updated every few steps and the fields are repaired incrementally (lifelong planning, like
+D* Lite) instead of searched again, so cars route around queues and use the parallel lanes.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+import heapq
+
+INFINITY = float("inf")
+BASE_COST = 1  # Cost of moving to a free node
+STOPPED_COST = 2  # Extra cost of moving to a node with a car on the last two updates
+RED_LIGHT_COST = 2  # Extra cost of moving to a red traffic light
+UPDATE_PERIOD = 3  # Steps between updates of the costs
+REBUILD_FRACTION = 0.25  # Pending changes, over the node count, that rebuild a field
+
+
+class CostField:
+    """
+    Cost to reach a destination from every node of the graph.
+    Like D* Lite the repair is lazy: a route only settles the nodes cheaper than its start,
+    the rest stay queued until a route needs them.
+    Attributes:
+        router: CongestionRouter of the field
+        goal: Node id of the destination
+        g: Cost of the best path found from each node
+        rhs: Cost of each node from the g of its successors, the node is consistent when
+             g == rhs and only the inconsistent ones are queued
+        queue: Heap of (min(g, rhs), node) of the inconsistent nodes, may have stale entries
+        cursor: Position on the change log of the router of the next change to apply
+    """
+
+    def __init__(self, router, goal):
+        self.router = router
+        self.goal = goal
+        self.rebuild()
+
+    def rebuild(self):
+        """Runs a full Dijkstra search from the goal on the reverse graph."""
+        router = self.router
+        costs, predecessors = router.costs, router.predecessors
+        g = [INFINITY] * len(costs)
+        g[self.goal] = 0
+        queue = [(0, self.goal)]
+        while queue:
+            cost, node = heapq.heappop(queue)
+            if cost > g[node]:
+                continue
+            cost += costs[node]
+            for previous in predecessors[node]:
+                if cost < g[previous]:
+                    g[previous] = cost
+                    heapq.heappush(queue, (cost, previous))
+        self.g = g
+        self.rhs = list(g)
+        self.queue = []
+        self.cursor = router.log_end()
+        router.rebuilds += 1
+
+    def repair(self):
+        """Queues the nodes affected by the cost changes logged since the last repair."""
+        router = self.router
+        changed = set(router.changes[self.cursor - router.changes_dropped :])
+        self.cursor = router.log_end()
+        if len(changed) > REBUILD_FRACTION * len(self.g):
+            self.rebuild()
+            return
+
+        # The cost of entering a node changed, so did the rhs of the nodes that reach it
+        predecessors = router.predecessors
+        for node in changed:
+            for previous in predecessors[node]:
+                self.update_node(previous)
+
+    def update_node(self, node):
+        """Computes the rhs of a node again and queues it if it is inconsistent."""
+        if node == self.goal:
+            return
+        router = self.router
+        costs, g = router.costs, self.g
+        best = INFINITY
+        for successor in router.successors[node]:
+            cost = costs[successor] + g[successor]
+            if cost < best:
+                best = cost
+        self.rhs[node] = best
+        if g[node] != best:
+            heapq.heappush(self.queue, (min(g[node], best), node))
+
+    def settle(self, start):
+        """
+        Expands the inconsistent nodes in order of cost until the start node is consistent
+        and no queued node is cheaper than it, then its path is a cheapest one.
+        """
+        g, rhs, queue = self.g, self.rhs, self.queue
+        predecessors = self.router.predecessors
+        while queue:
+            key, node = queue[0]
+            if g[node] == rhs[node] or key != min(g[node], rhs[node]):
+                heapq.heappop(queue)  # Stale entry
+                continue
+            if g[start] == rhs[start] and key >= g[start]:
+                break
+            heapq.heappop(queue)
+            self.router.expanded += 1
+            if g[node] > rhs[node]:
+                # Cheaper than before, the nodes that reach it may improve
+                g[node] = rhs[node]
+            else:
+                # More expensive, compute it again from its successors
+                g[node] = INFINITY
+                self.update_node(node)
+            for previous in predecessors[node]:
+                self.update_node(previous)
+
+    def path(self, start):
+        """
+        Follows the cheapest successors from the start node id to the goal.
+        Returns the path as node ids, None if the goal can't be reached.
+        """
+        self.settle(start)
+        g, costs, successors = self.g, self.router.costs, self.router.successors
+        if g[start] == INFINITY:
+            return None
+        path = [start]
+        node = start
+        while node != self.goal:
+            best, best_cost = None, INFINITY
+            for successor in successors[node]:
+                cost = costs[successor] + g[successor]
+                if cost < best_cost:
+                    best, best_cost = successor, cost
+            node = best
+            path.append(node)
+        return path
+
+
+class CongestionRouter:
+    """
+    Routes of the cars with live costs. The model tells the router which cells the cars enter
+    and leave, and the costs of those cells and of the traffic lights are updated on the first
+    route once UPDATE_PERIOD steps passed, so every car of a step sees the same costs.
+    Attributes:
+        model: CityModel of the router
+        costs: Cost of moving to each node
+        successors, predecessors: Edges of each node id as lists
+        fields: CostField of each destination node id, built on the first route to it
+        changes: Log of the nodes whose cost changed, the fields keep their position on it
+        changes_dropped: Number of changes already applied by every field and dropped
+        touched: Nodes a car entered or left since the last update of the costs
+        occupied: Nodes that had a car on the last update of the costs
+        rebuilds, expanded: Full searches and nodes expanded by the repairs
+    """
+
+    def __init__(self, model):
+        self.model = model
+        graph = model.graph
+        node_total = len(graph.coords)
+        offsets = graph.offsets.tolist()
+        neighbors = graph.neighbors.tolist()
+        self.successors = [
+            neighbors[offsets[node] : offsets[node + 1]]
+            if node < graph.node_count
+            else []
+            for node in range(node_total)
+        ]
+        self.predecessors = [[] for _ in range(node_total)]
+        for node, successors in enumerate(self.successors):
+            for successor in successors:
+                self.predecessors[successor].append(node)
+
+        self.light_nodes = [
+            (graph.node_id(traffic_light.pos), traffic_light)
+            for traffic_light in model.traffic_lights
+            if graph.node_id(traffic_light.pos) is not None
+        ]
+        self.light_of_node = dict(self.light_nodes)
+        self.costs = [BASE_COST] * node_total
+        self.fields = {}
+        self.changes = []
+        self.changes_dropped = 0
+        self.touched = set()
+        self.occupied = set()
+        self.updated_step = None
+        self.rebuilds = 0
+        self.expanded = 0
+
+    def log_end(self):
+        """Gets the position on the change log after the last change."""
+        return len(self.changes) + self.changes_dropped
+
+    ############################
+    #### Cost functions ########
+    ############################
+
+    def cell_changed(self, position):
+        """Marks a cell a car entered or left, its cost changes on the next update."""
+        node = self.model.graph.node_id(position)
+        if node is not None:
+            self.touched.add(node)
+
+    def update_costs(self):
+        """
+        Updates the costs of the touched nodes, the traffic lights and the nodes that had a car
+        on the last update. A node is stopped if it had a car on the last two updates, so a car
+        that moves every step doesn't make the cells it leaves behind expensive.
+        """
+        self.updated_step = self.model.step_count
+        positions = self.model.graph.positions
+        occupancy = self.model.car_occupancy
+        nodes = self.touched | self.occupied
+        nodes.update(self.light_of_node)
+        occupied = set()
+        for node in nodes:
+            x, y = positions[node]
+            cost = BASE_COST
+            if occupancy[x, y] > 0:
+                occupied.add(node)
+                if node in self.occupied:
+                    cost += STOPPED_COST
+            traffic_light = self.light_of_node.get(node)
+            if traffic_light is not None and not traffic_light.state:
+                cost += RED_LIGHT_COST
+            if self.costs[node] != cost:
+                self.costs[node] = cost
+                self.changes.append(node)
+        self.occupied = occupied
+        self.touched = set()
+        self.drop_applied_changes()
+
+    def drop_applied_changes(self):
+        """
+        Drops the start of the change log that every field has already applied. Fields that
+        missed enough changes to be rebuilt anyway are dropped too, they are built again on
+        their next route.
+        """
+        end = self.log_end()
+        limit = REBUILD_FRACTION * len(self.costs)
+        for goal, field in list(self.fields.items()):
+            if end - field.cursor > limit:
+                del self.fields[goal]
+        applied = min((field.cursor for field in self.fields.values()), default=end)
+        applied -= self.changes_dropped
+        if applied > 0:
+            del self.changes[:applied]
+            self.changes_dropped += applied
+
+    ############################
+    #### Route functions #######
+    ############################
+
+    def find_path(self, position, goal):
+        """
+        Finds the cheapest path from the position to the goal with the costs of the step.
+        Returns None if the goal can't be reached from the position.
+        """
+        graph = self.model.graph
+        step = self.model.step_count
+        if self.updated_step is None or step - self.updated_step >= UPDATE_PERIOD:
+            self.update_costs()
+        goal_node = graph.node_id(goal)
+        start = graph.node_id(position)
+        if goal_node is None or start is None:
+            return None
+        field = self.fields.get(goal_node)
+        if field is None:
+            field = self.fields[goal_node] = CostField(self, goal_node)
+        elif field.cursor != self.log_end():
+            field.repair()
+        path = field.path(start)
+        if path is None:
+            return None
+        return [graph.positions[node] for node in path]
@@ -0,0 +1,160 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Event driven scheduler of the car agents. A car that can't leave its cell, because the cells
+it could move to have cars or because the next one is a red traffic light, repeats the same
+wait every step until one of those cells is freed or the light turns green. The scheduler lets
+the car sleep until then instead of stepping it, and a car that is woken steps on the same step
+if its turn has not passed yet, so the cars move exactly like with BaseScheduler.
+A waiting car still sets its time every step, sleeping cars get it from car_time.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from mesa.time import BaseScheduler
+from agent import BaseCar, CompactCar
+import heapq
+
+
+class EventScheduler(BaseScheduler):
+    """
+    Scheduler that steps the other agents like BaseScheduler and then the awake cars, in the
+    order they were created (their unique_id).
+    Attributes:
+        others: Agents that are not cars, stepped every step before the cars
+        awake: Cars to step on the next step by unique_id
+        queue: Heap of (unique_id, car) of the cars left to step on the current step
+        current: unique_id of the car being stepped, -1 before the cars and None between steps
+        sleeping: Watched cells and traffic light of each sleeping car
+        cell_waiters: Sleeping cars watching each cell
+        light_waiters: Sleeping cars waiting on each red traffic light
+        counter: Counter of the model a waiting car adds to when it gets its route
+        skipped: Car steps skipped since the scheduler was created
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.others = []
+        self.awake = {}
+        self.queue = []
+        self.current = None
+        self.sleeping = {}
+        self.cell_waiters = {}
+        self.light_waiters = {}
+        self.counter = None
+        self.skipped = 0
+
+    def add(self, agent):
+        super().add(agent)
+        if isinstance(agent, BaseCar):
+            self.awake[agent.unique_id] = agent
+        else:
+            self.others.append(agent)
+
+    def remove(self, agent):
+        super().remove(agent)
+        if not isinstance(agent, BaseCar):
+            self.others.remove(agent)
+        elif agent in self.sleeping:
+            self.unwatch(agent)
+        else:
+            self.awake.pop(agent.unique_id, None)
+
+    def step(self):
+        """Steps the other agents, wakes the cars on green lights and steps the awake cars."""
+        model = self.model
+        if self.counter is None:
+            # Compact cars on the field routing read their route every step, the rest hit
+            # the cached one
+            field = model.car_class is CompactCar and model.routing == "field"
+            self.counter = "route_replans" if field else "route_cache_hits"
+
+        self.current = -1
+        for agent in list(self.others):
+            agent.step()
+        for traffic_light in list(self.light_waiters):
+            if traffic_light.state:
+                for car in list(self.light_waiters[traffic_light]):
+                    self.wake(car)
+
+        cars = len(self.sleeping) + len(self.awake)
+        self.queue = list(self.awake.items())
+        self.awake = {}
+        heapq.heapify(self.queue)
+        stepped = 0
+        while self.queue:
+            self.current, car = heapq.heappop(self.queue)
+            stepped += 1
+            car.step()
+            if self.current in self._agents and car not in self.sleeping:
+                self.awake[self.current] = car
+        self.current = None
+
+        # Each skipped car would have taken its route and waited
+        setattr(model, self.counter, getattr(model, self.counter) + cars - stepped)
+        self.skipped += cars - stepped
+        self.steps += 1
+        self.time += 1
+
+    ############################
+    #### Sleep functions #######
+    ############################
+
+    def car_waiting(self, car, next_move):
+        """
+        Lets a car that stayed on its cell sleep if it waits on other cars or a red light,
+        next_move is the move of its route it didn't take.
+        """
+        if car.time != self.model.step_count:
+            return  # First move, the car sets its time from the next step on
+        waiting = car.waiting_on(next_move)
+        if waiting is None:
+            return
+        cells, traffic_light = waiting
+        self.sleeping[car] = waiting
+        for cell in cells:
+            self.cell_waiters.setdefault(cell, []).append(car)
+        if traffic_light is not None:
+            self.light_waiters.setdefault(traffic_light, []).append(car)
+
+    def cell_changed(self, position):
+        """Wakes the cars watching a cell a car entered or left."""
+        cars = self.cell_waiters.get(position)
+        if cars:
+            for car in list(cars):
+                self.wake(car)
+
+    def wake(self, car):
+        """
+        Wakes a sleeping car. It steps on the current step if its turn has not passed yet,
+        otherwise on the next one.
+        """
+        car.time = self.car_time(car)
+        self.unwatch(car)
+        if self.current is not None and car.unique_id > self.current >= 0:
+            heapq.heappush(self.queue, (car.unique_id, car))
+        else:
+            self.awake[car.unique_id] = car
+
+    def unwatch(self, car):
+        """Removes a sleeping car from the waiters of its cells and traffic light."""
+        cells, traffic_light = self.sleeping.pop(car)
+        for cell in cells:
+            waiters = self.cell_waiters[cell]
+            waiters.remove(car)
+            if not waiters:
+                del self.cell_waiters[cell]
+        if traffic_light is not None:
+            waiters = self.light_waiters[traffic_light]
+            waiters.remove(car)
+            if not waiters:
+                del self.light_waiters[traffic_light]
+
+    def car_time(self, car):
+        """
+        Gets the time a car would have with BaseScheduler. A sleeping car would have set it
+        to the step when its turn came, so it is the current step once its turn passed.
+        """
+        if car not in self.sleeping:
+            return car.time
+        if self.current is None or car.unique_id < self.current:
+            return self.model.step_count
+        return self.model.step_count - 1
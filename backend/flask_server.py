@@ -5,56 +5,158 @@ Collaborators: Octavio Hinojosa, Francisco Martinez Gallardo, Omar Rivera
 Date: 2023-11-30
 """
 # Import libraries
-from flask import Flask, request, jsonify
-from model import CityModel
-from agent import Car, Traffic_Light, Road
+from flask import Flask, Response, request, jsonify
+from sessions import SessionError, SessionPool
+from map_cache import DEFAULT_CACHE
+from trajectory import TrajectoryReader
+import argparse
 import requests
 import json
+import os
+import threading
+import time
+import uuid
 
 
-# Size of the board:
-cityModel = None  # City model
-currentStep = 0  # Current step of the model
+# Sessions of the server, each one with its own city model
+sessionPool = None  # Pool of simulation sessions, created on the first request
+poolSettings = {
+    "workers": os.cpu_count() or 1,
+    "max_sessions": 16,
+    "idle_timeout": 600,
+    "eviction": "lru",
+}  # Settings of the pool, can be changed from the command line
+DEFAULT_SESSION = "default"  # Session used by the requests without a session id
+modelSettings = {
+    "map_cache": DEFAULT_CACHE,
+}  # Arguments of every model, the compiled map cache makes /init skip the map parse
+
+replayLog = None  # Log served on replay mode (trajectory.py), None to run models
+replayFrames = {}  # Frame of the log each replay session is on
+replayLock = threading.Lock()  # Lock of replayFrames and the refresh of replayLog
 
 # Create the flask server
 app = Flask("Model Server")
 url = "http://52.1.3.19:8585/api/attempts"  # Server url for competition
 
 
+class RequestError(Exception):
+    """Error on the arguments of a request, e.g. a seed that is not a number."""
+
+
+def getSessionPool():
+    """
+    Gets the session pool, creating it the first time.
+    """
+    global sessionPool
+    if sessionPool is None:
+        sessionPool = SessionPool(**poolSettings)
+    return sessionPool
+
+
+def getSessionId():
+    """
+    Gets the session id of the request.
+    """
+    return request.args.get("session", default=DEFAULT_SESSION)
+
+
+def replayFrame(advance=False):
+    """
+    Gets the frame of the log of the replay session of the request, the frame argument
+    reads any frame. advance moves the session to its next frame instead, a log that is
+    still being recorded is read again to find it.
+    """
+    sessionId = getSessionId()
+    with replayLock:
+        if sessionId not in replayFrames:
+            raise SessionError(f"Unknown session {sessionId}")
+        if advance:
+            if replayFrames[sessionId] + 1 >= len(replayLog):
+                replayLog.refresh()
+            if replayFrames[sessionId] + 1 >= len(replayLog):
+                raise SessionError("The log has no more frames")
+            replayFrames[sessionId] += 1
+            return replayFrames[sessionId]
+        frame = request.args.get("frame", default=replayFrames[sessionId], type=int)
+        if not 0 <= frame < len(replayLog):
+            raise SessionError(f"The log has no frame {frame}")
+        return frame
+
+
+@app.errorhandler(SessionError)
+def sessionError(error):
+    return jsonify({"message": str(error)}), 409
+
+
+@app.errorhandler(RequestError)
+def requestError(error):
+    return jsonify({"message": str(error)}), 400
+
+
 # Initialize the model with the default parameters
 @app.route("/init", methods=["GET"])
 def initModel():
-    global currentStep, cityModel
     if request.method == "GET":
-        currentStep = 0  # Reset the current step
-        cityModel = CityModel()  # Initialize the model
+        if replayLog is not None:
+            # Replay sessions only keep their frame, they start on the first one
+            sessionId = getSessionId() or uuid.uuid4().hex[:12]
+            with replayLock:
+                replayFrames[sessionId] = 0
+            return jsonify(
+                {"message": "Replay session initiated.", "session": sessionId}
+            )
+        modelArgs = dict(modelSettings)
+        if "routing" in request.args:
+            modelArgs["routing"] = request.args["routing"]
+        if "timers" in request.args:
+            modelArgs["timers"] = request.args["timers"] == "1"
+        if "engine" in request.args:
+            modelArgs["engine"] = request.args["engine"]
+        if "lights" in request.args:
+            modelArgs["lights"] = request.args["lights"]
+        for name in ("seed", "regions"):
+            if name in request.args:
+                try:
+                    modelArgs[name] = int(request.args[name])
+                except ValueError:
+                    raise RequestError(f"{name} must be an integer")
+        try:
+            sessionId = getSessionPool().create(
+                getSessionId(), **modelArgs
+            )  # Initialize the model of the session, an empty session id creates a new one
+        except ValueError as error:
+            raise RequestError(str(error))  # Arguments the model doesn't accept
 
-        return jsonify({"message": "Default parameters recieved, model initiated."})
+        return jsonify(
+            {
+                "message": "Default parameters recieved, model initiated.",
+                "session": sessionId,
+            }
+        )
+
+
+# Close a session
+@app.route("/close", methods=["GET"])
+def closeModel():
+    if request.method == "GET":
+        if replayLog is not None:
+            with replayLock:
+                replayFrames.pop(getSessionId(), None)
+            return jsonify({"message": "Session closed."})
+        getSessionPool().close(getSessionId())
+        return jsonify({"message": "Session closed."})
 
 
 # Get the agents of the model
 @app.route("/getAgents", methods=["GET"])
 def getAgents():
-    global cityModel  # Get the global city model
-
     if request.method == "GET":
-        agentPositions = [
-            {"id": agent.unique_id, "x": x, "y": 0, "z": z}
-            for agents, (x, z) in cityModel.grid.coord_iter()
-            for agent in agents
-            if isinstance(agent, Car)
-        ]  # Comprehension list to get the positions of the agents
-
-        # Get the directions of the roads on that position
-        for agent in agentPositions:
-            try:  # Try to get the direction of the road
-                agent["direction"] = cityModel.get_pos_agent(
-                    (agent["x"], agent["z"]), Road
-                ).direction
-            except:  # If there is no road the car is on a traffic light
-                agent["direction"] = cityModel.get_pos_agent(
-                    (agent["x"], agent["z"]), Traffic_Light
-                ).direction
+        if replayLog is not None:
+            return jsonify({"positions": replayLog.car_positions(replayFrame())})
+        agentPositions = getSessionPool().call(
+            getSessionId(), "agents"
+        )  # Get the positions and the lane direction of the cars
 
         return jsonify(
             {"positions": agentPositions}
@@ -64,18 +166,11 @@ def getAgents():
 # Update the model of the model
 @app.route("/update", methods=["GET"])
 def updateModel():
-    global currentStep, cityModel
     if request.method == "GET":
-        cityModel.step()
-
-        if currentStep % 100 == 0 and currentStep != 0:
-            # sendRequest()  # Send data to the server
-            pass
-
-        if currentStep == 1000:
-            # Stop the server for competition
-            raise KeyboardInterrupt
-        currentStep += 1
+        if replayLog is not None:
+            currentStep = replayLog.step(replayFrame(advance=True))
+        else:
+            currentStep = getSessionPool().call(getSessionId(), "update")
         return jsonify(
             {
                 "message": f"Model updated to step {currentStep}.",
@@ -84,29 +179,115 @@ def updateModel():
         )
 
 
+# Update the model and get the cars and traffic lights in a single request
+@app.route("/step", methods=["GET"])
+def stepModel():
+    if request.method == "GET":
+        steps = request.args.get("steps", default=1, type=int)  # Steps to advance
+        snapshotFormat = request.args.get("format", default="json")
+        if steps < 1:
+            raise RequestError("steps must be at least 1")
+        if snapshotFormat not in ("json", "binary"):
+            raise RequestError(f"Unknown format {snapshotFormat}")
+        snapshot = getSessionPool().call(
+            getSessionId(), "step", steps=steps, format=snapshotFormat
+        )
+
+        # Compact binary snapshot, the layout is described on snapshots.py
+        if snapshotFormat == "binary":
+            return Response(snapshot, mimetype="application/octet-stream")
+
+        return jsonify(snapshot)
+
+
+# Stream the changes of every step as server sent events
+@app.route("/stream", methods=["GET"])
+def streamModel():
+    if request.method == "GET":
+        sessionId = getSessionId()
+        steps = request.args.get(
+            "steps", type=int
+        )  # Steps to stream, None for no limit
+        interval = request.args.get(
+            "interval", default=0.0, type=float
+        )  # Seconds between steps
+        keyframeInterval = request.args.get(
+            "keyframeInterval", default=50, type=int
+        )  # Frames between keyframes
+        # Checked before the stream starts, errors after that break the event stream
+        if keyframeInterval < 1:
+            raise RequestError("keyframeInterval must be at least 1")
+        pool = getSessionPool()
+        streamId = pool.call(
+            sessionId, "open_stream", keyframe_interval=keyframeInterval
+        )
+
+        def events():
+            try:
+                # Send a keyframe on connect, then the delta of each step
+                frame = pool.call(
+                    sessionId, "next_frame", stream_id=streamId, advance=False
+                )
+                yield f"event: {frame['type']}\ndata: {json.dumps(frame)}\n\n"
+                streamed = 0
+                while steps is None or streamed < steps:
+                    frame = pool.call(sessionId, "next_frame", stream_id=streamId)
+                    streamed += 1
+                    yield f"event: {frame['type']}\ndata: {json.dumps(frame)}\n\n"
+                    if interval:
+                        time.sleep(interval)
+            except SessionError as error:
+                yield f"event: error\ndata: {json.dumps({'message': str(error)})}\n\n"
+            finally:
+                try:
+                    pool.call(sessionId, "close_stream", stream_id=streamId)
+                except SessionError:
+                    pass  # The session was closed while streaming
+
+        return Response(events(), mimetype="text/event-stream")
+
+
+# Get the timings of the phases of the steps of the model
+@app.route("/metrics", methods=["GET"])
+def getMetrics():
+    if request.method == "GET":
+        enabled = request.args.get("enabled")  # 1 or 0 to switch the timers
+        metrics = getSessionPool().call(
+            getSessionId(),
+            "metrics",
+            enabled=None if enabled is None else enabled == "1",
+            reset=request.args.get("reset") == "1",
+        )
+        return jsonify(metrics)
+
+
 # Get the traffic lights of the model
 @app.route("/getTrafficLights", methods=["GET"])
 def getTraffic_Lights():
-    global currentStep, cityModel
     if request.method == "GET":
-        traffic_light_positions = [
-            {
-                "id": agent.unique_id,
-                "state": 1 if agent.state else 0,
-                "direction": agent.direction,
-                "x": x,
-                "y": 0,
-                "z": z,
-            }
-            for agents, (x, z) in cityModel.grid.coord_iter()
-            for agent in agents
-            if isinstance(agent, Traffic_Light)
-        ]  # Comprehension list to get the positions of the agents, their state and direction (To orient the traffic light on Unity)
-        return jsonify({"positions": traffic_light_positions})
+        if replayLog is not None:
+            frame = replayFrame()
+            return jsonify({"positions": replayLog.traffic_light_positions(frame)})
+        trafficLightPositions = getSessionPool().call(
+            getSessionId(), "traffic_lights"
+        )  # Get the positions of the traffic lights, their state and direction (To orient the traffic light on Unity)
+        return jsonify({"positions": trafficLightPositions})
+
 
+# Get the static layers of the map: kind of each cell and direction of each road
+@app.route("/getMap", methods=["GET"])
+def getMap():
+    if request.method == "GET":
+        if replayLog is not None:
+            with replayLock:
+                if getSessionId() not in replayFrames:
+                    raise SessionError(f"Unknown session {getSessionId()}")
+            return jsonify(replayLog.map_layers)
+        return jsonify(getSessionPool().call(getSessionId(), "map"))
 
-def sendRequest():
-    cars = cityModel.destroyed
+
+def sendRequest(sessionId=DEFAULT_SESSION):
+    cars = getSessionPool().call(sessionId, "summary")["destroyed"]
     # Send request to the server for competition
     data = {
         "year": 2023,
@@ -120,4 +301,57 @@ def sendRequest():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="City model server for Unity.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=poolSettings["workers"],
+        help="Worker processes, 0 to run in process",
+    )
+    parser.add_argument("--max-sessions", type=int, default=16)
+    parser.add_argument(
+        "--idle-timeout", type=float, default=600, help="Seconds to close idle sessions"
+    )
+    parser.add_argument("--eviction", choices=["lru", "reject"], default="lru")
+    parser.add_argument(
+        "--map-cache",
+        default=DEFAULT_CACHE,
+        help="Compiled map directory, empty to disable",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["agents", "compact", "fleet"],
+        default="agents",
+        help="Car engine of the models, see fleet.py",
+    )
+    parser.add_argument(
+        "--lights",
+        choices=["fixed", "actuated"],
+        default="fixed",
+        help="Traffic light control of the models, see traffic_control.py",
+    )
+    parser.add_argument(
+        "--regions",
+        type=int,
+        default=1,
+        help="Regions moved on parallel processes by the fleet engine, see partition.py",
+    )
+    parser.add_argument(
+        "--replay",
+        help="Trajectory log to serve /getAgents and /getTrafficLights from, see trajectory.py",
+    )
+    args = parser.parse_args()
+    modelSettings["map_cache"] = args.map_cache or None
+    modelSettings["engine"] = args.engine
+    modelSettings["lights"] = args.lights
+    modelSettings["regions"] = args.regions
+    if args.replay:
+        replayLog = TrajectoryReader(args.replay)
+    poolSettings.update(
+        workers=args.workers,
+        max_sessions=args.max_sessions,
+        idle_timeout=args.idle_timeout,
+        eviction=args.eviction,
+    )
+
     app.run(host="localhost", port=8585, debug=True)
@@ -0,0 +1,297 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Struct of arrays engine of the cars. The state of every car is kept on NumPy arrays and the
+whole fleet is advanced with array operations, following the same rules as the Car agent
+(check_next_move_is_not_car, avoid_collision and check_traffic_light).
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+import numpy as np
+
+NO_CAR = -1  # Value of car_at on the nodes without a car
+NO_SLOT = np.iinfo(np.int64).max  # Claim of the nodes no pending car reads
+
+
+class Fleet:
+    """
+    Cars of a model stored as arrays, one slot per car in the order they were created.
+    The agents engine steps the cars one by one in that order and every car sees the moves of
+    the cars stepped before it. The fleet gets the same result in rounds: a car only reads and
+    writes its node and the nodes its node points to, so on each round the cars whose nodes
+    are not claimed by an older pending car decide at the same time.
+    Attributes:
+        model: CityModel of the fleet
+        ids: unique_id of each car
+        nodes: Node id of the position of each car
+        goals: Index of the destination of each car on model.destinations
+        times: Step of the last move of each car
+        last_x, last_y: Last position of each car, -1 if it has none
+        first_move: Whether each car has not made its first move
+        occupancy: Number of cars on each node, the last node is a sink for missing edges
+        car_at: Slot of the car on each node, NO_CAR if there is none
+    """
+
+    def __init__(self, model):
+        self.model = model
+        graph = model.graph
+        node_total = len(graph.coords)
+        self.sink = node_total
+        self.coords = np.vstack((graph.coords, [(-1, -1)])).astype(np.int32)
+        self.positions = graph.positions
+        self.fields = model.route_fields
+        self.destination_index = {
+            destination: i for i, destination in enumerate(model.destinations)
+        }
+
+        # Neighbors of each node on the order of the graph, padded with the sink
+        degrees = np.zeros(node_total + 1, dtype=np.int64)
+        degrees[: graph.node_count] = np.diff(graph.offsets)
+        width = max(1, int(degrees.max()))
+        self.neighbors = np.full((node_total + 1, width), self.sink, dtype=np.int32)
+        rows = np.repeat(np.arange(graph.node_count), degrees[: graph.node_count])
+        columns = np.arange(len(graph.neighbors)) - np.repeat(
+            graph.offsets[:-1], degrees[: graph.node_count]
+        )
+        self.neighbors[rows, columns] = graph.neighbors
+
+        # Destinations never have cars, the sink stands for the missing edges
+        self.is_destination = np.zeros(node_total + 1, dtype=bool)
+        destination_nodes = [graph.node_id(position) for position in model.destinations]
+        self.is_destination[
+            [node for node in destination_nodes if node is not None]
+        ] = True
+        self.is_destination[self.sink] = True
+
+        # Nodes each car reads and writes: its own node and the ones it points to
+        self.cells = np.column_stack((np.arange(node_total + 1), self.neighbors))
+        self.cells[self.is_destination[self.cells]] = self.sink
+
+        # First neighbor on the same row or column of each node (avoid_collision)
+        same_line = (
+            self.coords[self.neighbors][:, :, 0] == self.coords[:, None, 0]
+        ) | (self.coords[self.neighbors][:, :, 1] == self.coords[:, None, 1])
+        same_line &= self.neighbors != self.sink
+        self.straight = np.where(
+            same_line.any(axis=1),
+            self.neighbors[np.arange(node_total + 1), same_line.argmax(axis=1)],
+            self.sink,
+        )
+
+        # Traffic light of each node
+        self.light_index = np.full(node_total + 1, -1, dtype=np.int32)
+        for i, traffic_light in enumerate(model.traffic_lights):
+            node = graph.node_id(traffic_light.pos)
+            if node is not None:
+                self.light_index[node] = i
+
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.nodes = np.zeros(0, dtype=np.int32)
+        self.goals = np.zeros(0, dtype=np.int32)
+        self.times = np.zeros(0, dtype=np.int32)
+        self.last_x = np.zeros(0, dtype=np.int32)
+        self.last_y = np.zeros(0, dtype=np.int32)
+        self.first_move = np.zeros(0, dtype=bool)
+        self.occupancy = np.zeros(node_total + 1, dtype=np.int16)
+        self.car_at = np.full(node_total + 1, NO_CAR, dtype=np.int64)
+        self.spawned = (
+            []
+        )  # (unique_id, node, goal) of the cars added since the last step
+
+        # Spawn cells as arrays, to update model.free_spawn_cells
+        spawn_cells = np.array(model.spawn_cells, dtype=np.int64).reshape(-1, 2)
+        self.spawn_x, self.spawn_y = spawn_cells[:, 0], spawn_cells[:, 1]
+
+    def __len__(self):
+        return len(self.ids) + len(self.spawned)
+
+    ############################
+    #### Car functions #########
+    ############################
+
+    def add_car(self, unique_id, position, goal):
+        """Adds a car on a position going to a destination position."""
+        node = self.model.graph.node_id(position)
+        self.spawned.append((unique_id, node, self.destination_index[goal]))
+        self.occupancy[node] += 1
+        self.model.car_occupancy[position[0], position[1]] += 1
+        self.model.update_free_spawn_cell(position)
+        if self.model.light_controller is not None:
+            self.model.light_controller.car_entered(position)
+
+    def flush(self):
+        """Moves the cars added since the last step to the arrays, after the older ones."""
+        if not self.spawned:
+            return
+        ids, nodes, goals = zip(*self.spawned)
+        count = len(self.spawned)
+        start = len(self.ids)
+        self.ids = np.concatenate((self.ids, ids))
+        self.nodes = np.concatenate((self.nodes, np.array(nodes, dtype=np.int32)))
+        self.goals = np.concatenate((self.goals, np.array(goals, dtype=np.int32)))
+        self.times = np.concatenate((self.times, np.zeros(count, dtype=np.int32)))
+        self.last_x = np.concatenate((self.last_x, np.full(count, -1, dtype=np.int32)))
+        self.last_y = np.concatenate((self.last_y, np.full(count, -1, dtype=np.int32)))
+        self.first_move = np.concatenate((self.first_move, np.ones(count, dtype=bool)))
+        self.car_at[list(nodes)] = np.arange(start, start + count)
+        self.spawned = []
+
+    def car_states(self):
+        """Gets (unique_id, position) of every car, in the order they were created."""
+        self.flush()
+        positions = self.positions
+        return list(zip(self.ids.tolist(), (positions[n] for n in self.nodes.tolist())))
+
+    ############################
+    #### Step functions ########
+    ############################
+
+    def step(self):
+        """Moves every car once, with the result of stepping them one by one in order."""
+        self.flush()
+        sources = self.nodes.copy()
+        alive = np.ones(len(self.ids), dtype=bool)
+
+        # Cars that can't reach their goal don't move (the agents get no route)
+        distances = self.fields.distances(self.goals, self.nodes)
+        pending = np.flatnonzero(distances != -1)
+        self.resolve(
+            pending,
+            distances[pending],
+            self.light_states(),
+            self.model.step_count,
+            alive,
+        )
+        self.finish_step(sources, alive)
+
+    def light_states(self):
+        """Gets whether each traffic light of the model is green."""
+        return np.array(
+            [traffic_light.state for traffic_light in self.model.traffic_lights],
+            dtype=bool,
+        )
+
+    def resolve(self, pending, distances, states, step_count, alive):
+        """
+        Moves the pending slots in rounds, each round the cars whose nodes are not claimed
+        by an older pending car. distances are the distances of the pending cars to their
+        goals and alive is cleared for the cars that arrive.
+        """
+        while len(pending):
+            cells = self.cells[self.nodes[pending]]
+            claims = np.full(len(self.occupancy), NO_SLOT, dtype=np.int64)
+            np.minimum.at(claims, cells, pending[:, None])
+            claims[self.sink] = NO_SLOT
+            ready = claims[cells].min(axis=1) == pending
+            self.decide(pending[ready], distances[ready], states, step_count, alive)
+            pending, distances = pending[~ready], distances[~ready]
+
+    def finish_step(self, sources, alive):
+        """
+        Counts the arrived cars and the moves of the step on the model, sources are the
+        nodes of the cars before the step, and drops the arrived cars.
+        """
+        model = self.model
+        model.destroyed += int(len(alive) - alive.sum())
+        if model.light_controller is not None:
+            moved = alive & (sources != self.nodes)
+            model.light_controller.cars_moved(
+                self.coords[sources[moved]], self.coords[self.nodes[moved]]
+            )
+            model.light_controller.cars_moved(self.coords[sources[~alive]], None)
+        if not alive.all():
+            self.compact(alive)
+        self.sync_model()
+
+    def decide(self, slots, distances, states, step_count, alive):
+        """
+        Moves a set of cars that don't read or write the nodes of each other.
+        """
+        occupancy, car_at = self.occupancy, self.car_at
+        nodes = self.nodes[slots]
+
+        # If the goal is one move away or less, the car is in the goal, destroy it
+        arrived = distances <= 1
+        occupancy[nodes[arrived]] -= 1
+        car_at[nodes[arrived]] = NO_CAR
+        alive[slots[arrived]] = False
+        slots, nodes = slots[~arrived], nodes[~arrived]
+        if not len(slots):
+            return
+        next_moves = self.fields.next_hops(self.goals[slots], nodes)
+
+        # Check if in the next move there is a car, if so, try the other edges
+        blocked = occupancy[next_moves] > 0
+        others = self.neighbors[nodes[blocked]]
+        free = (
+            (others != next_moves[blocked, None])
+            & ~self.is_destination[others]
+            & (occupancy[others] == 0)
+        )
+        next_moves[blocked] = np.where(
+            free.any(axis=1),
+            others[np.arange(len(others)), free.argmax(axis=1)],
+            nodes[blocked],
+        )
+
+        # Avoid collision with the car in front if it changed lanes towards the next move
+        front = car_at[self.straight[nodes]]
+        has_front = front != NO_CAR
+        front_slots = front[has_front]
+        next_coords = self.coords[next_moves[has_front]]
+        wait = (
+            (self.times[front_slots] == step_count)
+            & (self.last_x[front_slots] != -1)
+            & (
+                (self.last_x[front_slots] == next_coords[:, 0])
+                | (self.last_y[front_slots] == next_coords[:, 1])
+            )
+        )
+        waiting = np.flatnonzero(has_front)[wait]
+        next_moves[waiting] = nodes[waiting]
+
+        # Traffic lights, red ones stop the car and green ones move it even on its first move
+        lights = self.light_index[next_moves]
+        on_light = lights != -1
+        green = on_light.copy()
+        green[on_light] = states[lights[on_light]]
+        next_moves[on_light & ~green] = nodes[on_light & ~green]
+
+        first = self.first_move[slots]
+        targets = np.where(first & ~green, nodes, next_moves)
+        turned = ~first & ~green & (next_moves != nodes)
+        self.last_x[slots[turned]] = self.coords[nodes[turned], 0]
+        self.last_y[slots[turned]] = self.coords[nodes[turned], 1]
+        self.times[slots[~first]] = step_count
+        self.first_move[slots] = False
+
+        occupancy[nodes] -= 1
+        car_at[nodes] = NO_CAR
+        occupancy[targets] += 1
+        car_at[targets] = slots
+        self.nodes[slots] = targets
+
+    def compact(self, alive):
+        """Drops the destroyed cars from the arrays."""
+        for name in (
+            "ids",
+            "nodes",
+            "goals",
+            "times",
+            "last_x",
+            "last_y",
+            "first_move",
+        ):
+            setattr(self, name, getattr(self, name)[alive])
+        self.car_at[self.car_at != NO_CAR] = NO_CAR
+        self.car_at[self.nodes] = np.arange(len(self.nodes))
+
+    def sync_model(self):
+        """Updates the occupancy grid and the free spawn cells of the model."""
+        model = self.model
+        model.car_occupancy[:] = 0
+        coords = self.coords[self.nodes]
+        np.add.at(model.car_occupancy, (coords[:, 0], coords[:, 1]), 1)
+        free = model.car_occupancy[self.spawn_x, self.spawn_y] == 0
+        model.free_spawn_cells = {
+            cell for cell, is_free in zip(model.spawn_cells, free.tolist()) if is_free
+        }
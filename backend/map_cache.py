@@ -0,0 +1,197 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+On disk cache of compiled maps. A compiled map keeps the parsed layers of a map, its graph,
+spawn cells, destinations, traffic light groups and the next hop fields the models built, up to
+FIELD_CACHE_BYTES. The arrays are stored as .npy files and memory mapped on load,
+so starting a model does not parse the map or build the graph again.
+The entries are keyed by a hash of the map and dictionary files, a change on either of them
+compiles the map again.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from map_loader import CityMap, TRAFFIC_LIGHT, DESTINATION, group_adjacent
+from road_graph import RoadGraph
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+CACHE_VERSION = 2  # Changing the layout of the entries invalidates the old ones
+DEFAULT_CACHE = "city_files/compiled"  # Default directory of the compiled maps
+FIELD_CACHE_BYTES = 2 * 2**30  # Disk the next hop fields of an entry can take
+LAYERS = ("cells", "directions", "light_states")  # Arrays of the CityMap
+GRAPH_ARRAYS = ("coords", "offsets", "neighbors")  # Arrays of the RoadGraph
+
+
+def map_key(map_file, dictionary_file):
+    """Gets the key of a map, a hash of the contents of the map and dictionary files."""
+    digest = hashlib.sha256(f"city map v{CACHE_VERSION}\n".encode())
+    for path in (map_file, dictionary_file):
+        with open(path, "rb") as source:
+            contents = source.read()
+        digest.update(len(contents).to_bytes(8, "little"))
+        digest.update(contents)
+    return digest.hexdigest()[:32]
+
+
+class CompiledMap:
+    """
+    Compiled map loaded from the cache, its arrays are read only memory maps.
+    Attributes:
+        directory: Directory of the cache entry
+        city_map: CityMap with the layers of the map
+        graph: RoadGraph of the city
+        light_directions: Direction code of each traffic light, in the order of the map text
+        light_groups: Group number of each traffic light, lights that touch share a group
+        spawn_cells: Positions where the cars spawn
+        destinations: Positions of the destinations, in the order of the map text
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        width, height = meta["width"], meta["height"]
+        self.city_map = CityMap(width, height, *map(self.load, LAYERS))
+        self.graph = RoadGraph(
+            width, height, *map(self.load, GRAPH_ARRAYS), meta["node_count"]
+        )
+        self.light_directions = self.load("light_directions")
+        self.light_groups = self.load("light_groups")
+        self.spawn_cells = [tuple(cell) for cell in self.load("spawn_cells").tolist()]
+        self.destinations = [
+            tuple(position) for position in self.load("destinations").tolist()
+        ]
+
+    def load(self, name):
+        """
+        Memory maps an array of the entry. The map is viewed as a plain array, indexing
+        np.memmap items one by one is several times slower.
+        """
+        path = os.path.join(self.directory, f"{name}.npy")
+        return np.load(path, mmap_mode="r").view(np.ndarray)
+
+    def field_store(self, max_bytes=None):
+        """Gets the store of the next hop fields of the entry, see FieldStore."""
+        return FieldStore(os.path.join(self.directory, "route_fields"), max_bytes)
+
+
+class FieldStore:
+    """
+    Next hop fields of the destinations of a compiled map, saved when a model builds them
+    (see routing.py), one file per destination so only the fields the cars use are built.
+    The least recently used files are deleted once the fields take more than max_bytes.
+    Attributes:
+        directory: Directory of the field files
+        max_bytes: Disk the fields can take
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = FIELD_CACHE_BYTES if max_bytes is None else max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, index):
+        """Gets the path of the field of a destination index."""
+        return os.path.join(self.directory, f"{index}.npy")
+
+    def load(self, index):
+        """Gets the (next_hop, distance) field of a destination index, None if it is not saved."""
+        path = self.path(index)
+        try:
+            field = np.load(path, mmap_mode="r").view(np.ndarray)
+            os.utime(path)  # Used now, deleted last
+        except (FileNotFoundError, ValueError):
+            return None  # Deleted by another process or not written yet
+        return field[0], field[1]
+
+    def save(self, index, field):
+        """
+        Saves the field of a destination index. The file is written on the side and renamed
+        so readers never see half of it.
+        """
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as output:
+            np.save(output, np.stack(field))
+        os.replace(temporary, self.path(index))
+        self.prune()
+
+    def prune(self):
+        """Deletes the least recently used fields over max_bytes."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def compile_map(map_file, dictionary_file, directory):
+    """
+    Parses a map and writes its compiled entry on the directory.
+    The entry is written on a temporary directory and renamed, so processes compiling the
+    same map at the same time keep the first complete entry.
+    """
+    city_map = CityMap.from_file(map_file, dictionary_file)
+    graph, light_directions = city_map.build_graph()
+    lights = city_map.positions(TRAFFIC_LIGHT)
+    arrays = {
+        "cells": city_map.cells,
+        "directions": city_map.directions,
+        "light_states": city_map.light_states,
+        "coords": graph.coords,
+        "offsets": graph.offsets,
+        "neighbors": graph.neighbors,
+        "light_directions": light_directions,
+        "light_groups": np.array(group_adjacent(lights.tolist()), dtype=np.int32),
+        "spawn_cells": np.array(city_map.spawn_cells(), dtype=np.int32).reshape(-1, 2),
+        "destinations": city_map.positions(DESTINATION).astype(np.int32),
+    }
+
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=parent)
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary, f"{name}.npy"), array)
+    with open(os.path.join(temporary, "meta.json"), "w") as meta_file:
+        json.dump(
+            {
+                "version": CACHE_VERSION,
+                "map_file": os.path.abspath(map_file),
+                "dictionary_file": os.path.abspath(dictionary_file),
+                "width": city_map.width,
+                "height": city_map.height,
+                "node_count": graph.node_count,
+            },
+            meta_file,
+            indent=2,
+        )
+    try:
+        os.rename(temporary, directory)
+    except OSError:
+        # Another process wrote the entry first
+        shutil.rmtree(temporary, ignore_errors=True)
+
+
+def load_compiled_map(map_file, dictionary_file, cache_directory=DEFAULT_CACHE):
+    """
+    Gets the compiled map of a map file, compiling it first if the cache has no entry for
+    the current contents of the map and dictionary files.
+    """
+    directory = os.path.join(cache_directory, map_key(map_file, dictionary_file))
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        compile_map(map_file, dictionary_file, directory)
+    return CompiledMap(directory)
@@ -0,0 +1,340 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Generator of synthetic city maps in the format of the files on city_files.
+Grid cities are made of two lane one way roads with alternating directions, signalized
+intersections and destinations on the blocks. Bundled maps can also be tiled into bigger cities.
+Usage:
+    python map_generator.py grid --width 200 --height 200 --output city_files/grid_200.txt
+    python map_generator.py tile --columns 4 --rows 4 --output city_files/tiled_4x4.txt
+    python map_generator.py validate city_files/grid_200.txt
+The bundled maps pass validate except "2022_base og.txt", the original 2022 map, where no road
+leads to the destination at (21, 22). 2022_base.txt is the map the model uses.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from collections import deque
+import argparse
+import json
+import random
+import sys
+import numpy as np
+
+DIRECTION_CHARACTERS = {
+    "Right": ">",
+    "Left": "<",
+    "Up": "^",
+    "Down": "v",
+}  # Road character of each direction, see mapDictionary.json
+HORIZONTAL_LIGHT = "s"  # Lights of the horizontal roads start green
+VERTICAL_LIGHT = "S"  # Lights of the vertical roads start red
+OBSTACLE = "#"
+DESTINATION = "D"
+LANES = 2  # Lanes of every road
+MIN_BLOCK = 3  # Smallest block, leaves room for a light and the road that reaches it
+MAX_DESTINATIONS = 128  # Each one takes a routing field, see routing.py
+
+
+############################
+#### Grid city functions ###
+############################
+
+
+def road_starts(size, block):
+    """
+    Gets the first lane of each road along one axis of the map.
+    There is an odd number of blocks between the first and the last road, so the roads on the
+    border of the map go around it in a single direction.
+    """
+    blocks = max(1, round((size - LANES) / (block + LANES)))
+    if blocks % 2 == 0:
+        # Prefer smaller blocks if they are still big enough
+        small_block = (size - LANES) // (blocks + 1) - LANES
+        blocks += 1 if small_block >= MIN_BLOCK else -1
+    if (size - LANES) // blocks - LANES < MIN_BLOCK:
+        raise ValueError(f"A map of size {size} is too small for blocks of {block}")
+    return [round(k * (size - LANES) / blocks) for k in range(blocks + 1)]
+
+
+def crossing_directions(horizontal, vertical, x, y, width, height, on_border_row):
+    """
+    Gets the directions of the 2x2 cells where a horizontal and a vertical road cross.
+    Rows are the cells of a crossing on the same y and columns the ones on the same x.
+    A crossing whose horizontal exit is out of the map only turns to the vertical road and
+    the other way around. Otherwise the row next to the vertical exit follows the vertical
+    road and the other row the horizontal one, so cars can keep going or turn from both roads
+    (going straight uses the diagonal moves). On the top and bottom roads the crossing is
+    split by columns instead, so the vertical roads also get spawn cells on the border.
+    Returns a dictionary (dx, dy) -> direction.
+    """
+    cells = [(dx, dy) for dx in range(LANES) for dy in range(LANES)]
+    horizontal_exit = x + LANES < width if horizontal == "Right" else x > 0
+    vertical_exit = y + LANES < height if vertical == "Up" else y > 0
+    if not horizontal_exit:
+        return {cell: vertical for cell in cells}
+    if not vertical_exit:
+        return {cell: horizontal for cell in cells}
+    if on_border_row:
+        horizontal_column = LANES - 1 if horizontal == "Right" else 0
+        return {
+            (dx, dy): horizontal if dx == horizontal_column else vertical
+            for dx, dy in cells
+        }
+    vertical_row = LANES - 1 if vertical == "Up" else 0
+    return {
+        (dx, dy): vertical if dy == vertical_row else horizontal for dx, dy in cells
+    }
+
+
+def generate_grid_city(
+    width,
+    height,
+    block=6,
+    destination_rate=0.5,
+    seed=0,
+    max_destinations=MAX_DESTINATIONS,
+):
+    """
+    Generates a grid city of width x height cells.
+    Args:
+        width, height: Size of the map
+        block: Approximate size of the blocks between roads
+        destination_rate: Probability of a block to have a destination
+        seed: Seed of the placement of the destinations
+        max_destinations: Most destinations of the city, a random sample of them is kept
+            when the blocks give more
+    Returns the lines of the map, the first line is the top of the city.
+    """
+    rng = random.Random(seed)
+    columns = road_starts(width, block)  # x of the vertical roads
+    rows = road_starts(height, block)  # y of the horizontal roads
+    # Roads on the border go around the city counterclockwise, the rest alternate
+    vertical_directions = ["Down" if k % 2 == 0 else "Up" for k in range(len(columns))]
+    horizontal_directions = [
+        "Right" if k % 2 == 0 else "Left" for k in range(len(rows))
+    ]
+
+    # Cells indexed [y, x] with y = 0 at the bottom, like the grid of the model
+    cells = np.full((height, width), OBSTACLE, dtype="<U1")
+    for y, direction in zip(rows, horizontal_directions):
+        cells[y : y + LANES, :] = DIRECTION_CHARACTERS[direction]
+    for x, direction in zip(columns, vertical_directions):
+        cells[:, x : x + LANES] = DIRECTION_CHARACTERS[direction]
+
+    # Intersections and their traffic lights
+    for j, (y, horizontal) in enumerate(zip(rows, horizontal_directions)):
+        for x, vertical in zip(columns, vertical_directions):
+            directions = crossing_directions(
+                horizontal, vertical, x, y, width, height, j in (0, len(rows) - 1)
+            )
+            for (dx, dy), direction in directions.items():
+                cells[y + dy, x + dx] = DIRECTION_CHARACTERS[direction]
+            add_traffic_lights(cells, horizontal, vertical, x, y)
+
+    # Destinations on the side of the blocks
+    destinations = []
+    for left, right in zip(columns, columns[1:]):
+        for bottom, top in zip(rows, rows[1:]):
+            if rng.random() < destination_rate:
+                destinations.append(
+                    block_side_cell(
+                        rng, left + LANES, right - 1, bottom + LANES, top - 1
+                    )
+                )
+    if len(destinations) > max_destinations:
+        destinations = rng.sample(destinations, max_destinations)
+    for x, y in destinations:
+        cells[y, x] = DESTINATION
+
+    return ["".join(row) + "\n" for row in cells[::-1]]
+
+
+def add_traffic_lights(cells, horizontal, vertical, x, y):
+    """
+    Adds traffic lights on the cells before an intersection, only if both roads reach it.
+    """
+    height, width = cells.shape
+    horizontal_light = x - 1 if horizontal == "Right" else x + LANES
+    vertical_light = y - 1 if vertical == "Up" else y + LANES
+    if 0 <= horizontal_light < width and 0 <= vertical_light < height:
+        cells[y : y + LANES, horizontal_light] = HORIZONTAL_LIGHT
+        cells[vertical_light, x : x + LANES] = VERTICAL_LIGHT
+
+
+def block_side_cell(rng, left, right, bottom, top):
+    """
+    Gets a random cell on a side of a block, corners excluded so the cell is next to a road
+    and not to a traffic light.
+    """
+    side = rng.choice(["left", "right", "bottom", "top"])
+    if side in ("left", "right"):
+        return (left if side == "left" else right), rng.randint(bottom + 1, top - 1)
+    return rng.randint(left + 1, right - 1), (bottom if side == "bottom" else top)
+
+
+############################
+#### Tiling functions ######
+############################
+
+
+def tile_map(lines, columns, rows=None):
+    """
+    Makes a bigger map repeating the map lines columns times to the right and rows times down.
+    """
+    rows = columns if rows is None else rows
+    tiled = [line.rstrip("\n") * columns for line in lines]
+    return [row + "\n" for row in tiled * rows]
+
+
+def read_map(map_file):
+    """Reads the lines of a map file."""
+    with open(map_file) as base_file:
+        return base_file.readlines()
+
+
+def write_map(lines, map_file):
+    """Writes the lines of a map file."""
+    with open(map_file, "w") as output:
+        output.writelines(lines)
+
+
+############################
+#### Validation functions ##
+############################
+
+
+def reach(offsets, neighbors, starts, node_count):
+    """
+    Finds the nodes reached from the start node ids following CSR arrays.
+    Returns a boolean array indexed by node id.
+    """
+    reached = np.zeros(node_count, dtype=bool)
+    reached[starts] = True
+    queue = deque(starts)
+    offsets = offsets.tolist()
+    neighbors = neighbors.tolist()
+    while queue:
+        node = queue.popleft()
+        if node + 1 >= len(offsets):
+            continue
+        for neighbor in neighbors[offsets[node] : offsets[node + 1]]:
+            if not reached[neighbor]:
+                reached[neighbor] = True
+                queue.append(neighbor)
+    return reached
+
+
+def validate_map(map_file, dictionary_file="city_files/mapDictionary.json"):
+    """
+    Checks that a car spawned anywhere can reach every destination of a map.
+    Builds the model of the map, so big maps take a while.
+    Every road reached from the spawn cells must get to a hub node (a road next to the first
+    destination) and every destination must be reached from the hub, otherwise a car can enter
+    a road where it can't reach its destination and stay there.
+    Returns a dictionary with the counts of the map and the problems found.
+    """
+    from model import CityModel
+
+    model = CityModel(
+        routing="astar", map_file=map_file, dictionary_file=dictionary_file
+    )
+    graph = model.graph
+    node_total = len(graph.coords)
+    spawns = [graph.node_id(position) for position in model.spawn_cells]
+    destinations = [graph.node_id(position) for position in model.destinations]
+    reverse_offsets, reverse_neighbors = graph.reverse()
+
+    # Hub: first road that reaches a destination
+    hub = None
+    for destination in destinations:
+        if destination is not None:
+            start, end = reverse_offsets[destination], reverse_offsets[destination + 1]
+            if end > start:
+                hub = int(reverse_neighbors[start])
+                break
+
+    reached = reach(graph.offsets, graph.neighbors, spawns, node_total)
+    reached[[node for node in destinations if node is not None]] = False
+    roads = np.flatnonzero(reached)
+    hub_reached = np.zeros(node_total, dtype=bool)
+    hub_reaches = np.zeros(node_total, dtype=bool)
+    if hub is not None:
+        hub_reached = reach(reverse_offsets, reverse_neighbors, [hub], node_total)
+        hub_reaches = reach(graph.offsets, graph.neighbors, [hub], node_total)
+
+    problems = {
+        "unreachable_destinations": [
+            position
+            for position, node in zip(model.destinations, destinations)
+            if node is None or not hub_reaches[node]
+        ],
+        "dead_ends": [graph.positions[node] for node in roads if not hub_reached[node]],
+    }
+    return {
+        "width": model.width,
+        "height": model.height,
+        "spawn_cells": len(model.spawn_cells),
+        "destinations": len(model.destinations),
+        "traffic_lights": len(model.traffic_lights),
+        "road_nodes": len(roads),
+        "valid": bool(spawns and model.destinations) and not any(problems.values()),
+        **problems,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate city maps.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    grid = commands.add_parser("grid", help="Generate a grid city")
+    grid.add_argument("--width", type=int, default=200)
+    grid.add_argument("--height", type=int, default=200)
+    grid.add_argument("--block", type=int, default=6, help="Approximate block size")
+    grid.add_argument("--destination-rate", type=float, default=0.5)
+    grid.add_argument("--max-destinations", type=int, default=MAX_DESTINATIONS)
+    grid.add_argument("--seed", type=int, default=0)
+    grid.add_argument("--output", help="Map file, stdout by default")
+    grid.add_argument("--validate", action="store_true", help="Validate the map")
+
+    tile = commands.add_parser("tile", help="Tile a map into a bigger city")
+    tile.add_argument("--base", default="city_files/2023_base.txt")
+    tile.add_argument("--columns", type=int, default=2)
+    tile.add_argument("--rows", type=int, default=None)
+    tile.add_argument("--output", help="Map file, stdout by default")
+    tile.add_argument("--validate", action="store_true", help="Validate the map")
+
+    validate = commands.add_parser("validate", help="Validate a map file")
+    validate.add_argument("map_file")
+
+    args = parser.parse_args(argv)
+    if args.command != "validate" and args.validate and not args.output:
+        parser.error("--validate needs --output, the map is validated from its file")
+    if args.command == "validate":
+        report = validate_map(args.map_file)
+        json.dump(report, sys.stdout, indent=2)
+        sys.exit(0 if report["valid"] else 1)
+
+    if args.command == "grid":
+        lines = generate_grid_city(
+            args.width,
+            args.height,
+            args.block,
+            args.destination_rate,
+            args.seed,
+            args.max_destinations,
+        )
+    else:
+        lines = tile_map(read_map(args.base), args.columns, args.rows)
+
+    if not args.output:
+        sys.stdout.writelines(lines)
+        return
+    write_map(lines, args.output)
+    if args.validate:
+        report = validate_map(args.output)
+        print(json.dumps({k: v for k, v in report.items() if not isinstance(v, list)}))
+        if not report["valid"]:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
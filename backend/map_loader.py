@@ -0,0 +1,283 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Vectorized loader of the city maps. Parses the map text into NumPy arrays and builds the
+RoadGraph of the city with array operations, giving the same graph as the agent by agent
+construction of model.py.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+import json
+import numpy as np
+from road_graph import RoadGraph
+
+# Cell kinds
+EMPTY = 0
+ROAD = 1
+TRAFFIC_LIGHT = 2
+OBSTACLE = 3
+DESTINATION = 4
+
+DIRECTIONS = ("Right", "Left", "Up", "Down")  # A direction code is its index
+NO_DIRECTION = -1
+DIRECTION_STEPS = np.array([(1, 0), (-1, 0), (0, 1), (0, -1)])  # Move of each direction
+DIAGONAL_STEPS = np.array(
+    [
+        [(1, 1), (1, -1)],  # Right
+        [(-1, 1), (-1, -1)],  # Left
+        [(1, 1), (-1, 1)],  # Up
+        [(1, -1), (-1, -1)],  # Down
+    ]
+)  # Lane changes of each direction, in the order model.get_other_connected_node tries them
+NEIGHBORHOOD = [(-1, 0), (0, -1), (0, 1), (1, 0)]  # Order of grid.get_neighborhood
+ROAD_CHARACTERS = "v^><"
+TRAFFIC_LIGHT_CHARACTERS = "Ss"
+
+
+class CityMap:
+    """
+    Map of the city as arrays indexed [x, y], with y = 0 at the bottom like the grid of the model.
+    Attributes:
+        width, height: Size of the map
+        cells: Kind of each cell (EMPTY, ROAD, TRAFFIC_LIGHT, OBSTACLE or DESTINATION)
+        directions: Direction code of each road, NO_DIRECTION on the other cells
+        light_states: Initial state of each traffic light, True if it starts green
+    """
+
+    def __init__(self, width, height, cells, directions, light_states):
+        self.width = width
+        self.height = height
+        self.cells = cells
+        self.directions = directions
+        self.light_states = light_states
+
+    @classmethod
+    def from_file(cls, map_file, dictionary_file="city_files/mapDictionary.json"):
+        """Loads a map file."""
+        with open(dictionary_file) as dictionary:
+            data_dictionary = json.load(dictionary)
+        with open(map_file) as base_file:
+            return cls.from_lines(base_file.readlines(), data_dictionary)
+
+    @classmethod
+    def from_lines(cls, lines, data_dictionary):
+        """
+        Parses the lines of a map. The first line is the top of the map and, like model.py,
+        the width is the length of the first line without its line break.
+        """
+        width = len(lines[0]) - 1
+        height = len(lines)
+        rows = "".join(line.rstrip("\n")[:width].ljust(width) for line in lines)
+        # Code point of each character, rows from the bottom to the top, indexed [x, y]
+        characters = np.frombuffer(rows.encode("utf-32-le"), dtype=np.uint32)
+        characters = characters.reshape(height, width)[::-1].T
+
+        cells = np.full((width, height), EMPTY, dtype=np.int8)
+        directions = np.full((width, height), NO_DIRECTION, dtype=np.int8)
+        for character in ROAD_CHARACTERS:
+            mask = characters == ord(character)
+            cells[mask] = ROAD
+            directions[mask] = DIRECTIONS.index(data_dictionary[character])
+        for character in TRAFFIC_LIGHT_CHARACTERS:
+            cells[characters == ord(character)] = TRAFFIC_LIGHT
+        cells[characters == ord("#")] = OBSTACLE
+        cells[characters == ord("D")] = DESTINATION
+        light_states = characters == ord("s")
+        return cls(width, height, cells, directions, light_states)
+
+    ############################
+    #### Cell functions ########
+    ############################
+
+    def positions(self, kind):
+        """
+        Gets the (n, 2) array of the positions of a kind of cell, in the order of the map text
+        (top row first, left to right), which is the order model.py creates the agents in.
+        """
+        rows, columns = np.nonzero(self.cells.T[::-1] == kind)
+        return np.column_stack((columns, self.height - 1 - rows))
+
+    def spawn_cells(self):
+        """
+        Gets the roads on the border of the map that point into it, sorted like
+        model.find_spawn_cells.
+        """
+        roads = self.positions(ROAD)
+        directions = self.directions[roads[:, 0], roads[:, 1]]
+        x, y = roads[:, 0], roads[:, 1]
+        spawn = (
+            ((x == 0) & (directions == DIRECTIONS.index("Right")))
+            | ((x == self.width - 1) & (directions == DIRECTIONS.index("Left")))
+            | ((y == 0) & (directions == DIRECTIONS.index("Up")))
+            | ((y == self.height - 1) & (directions == DIRECTIONS.index("Down")))
+        )
+        return sorted(map(tuple, roads[spawn].tolist()))
+
+    def padded(self, array, fill):
+        """Gets a copy of an array with a border of one cell, indexed [x + 1, y + 1]."""
+        return np.pad(array, 1, constant_values=fill)
+
+    ############################
+    #### Graph functions #######
+    ############################
+
+    def build_graph(self):
+        """
+        Builds the graph of the city with the nodes and edges model.py makes:
+            - Roads point to the next cell on their direction, if it is on the grid
+            - Traffic lights take the direction of the road that points to them (the last
+              one on the neighborhood order) and point to the next cell on that direction
+            - Roads and traffic lights with an edge can change lanes diagonally to a road
+              whose next cell is a different one
+            - Roads next to a destination point to it
+        Nodes are numbered roads first, then traffic lights and destinations, each in the
+        order of the map text, and the edges of each node keep the order of model.py.
+        Returns the RoadGraph and the direction code of each traffic light, NO_DIRECTION on
+        the traffic lights no road reaches.
+        """
+        width, height = self.width, self.height
+        cells = self.padded(self.cells, EMPTY)
+        directions = self.padded(self.directions, NO_DIRECTION)
+
+        roads = self.positions(ROAD) + 1
+        road_directions = directions[roads[:, 0], roads[:, 1]]
+        road_targets = roads + DIRECTION_STEPS[road_directions]
+        road_has_target = self.on_grid(road_targets)
+
+        # Next cell of each road, as padded coordinates (0, 0) if it is out of the grid
+        targets = np.zeros((width + 2, height + 2, 2), dtype=np.int64)
+        targets[roads[:, 0], roads[:, 1]] = np.where(
+            road_has_target[:, None], road_targets, 0
+        )
+
+        # A traffic light takes the direction of the last road of its neighborhood pointing to it
+        lights = self.positions(TRAFFIC_LIGHT) + 1
+        light_directions = np.full(len(lights), NO_DIRECTION, dtype=np.int8)
+        for step in NEIGHBORHOOD:
+            neighbors = lights + step
+            reaches = (cells[neighbors[:, 0], neighbors[:, 1]] == ROAD) & np.all(
+                targets[neighbors[:, 0], neighbors[:, 1]] == lights, axis=1
+            )
+            light_directions[reaches] = directions[neighbors[:, 0], neighbors[:, 1]][
+                reaches
+            ]
+        linked = light_directions != NO_DIRECTION
+        linked_lights = lights[linked]
+        light_targets = linked_lights + DIRECTION_STEPS[light_directions[linked]]
+
+        # Destinations with a road on their neighborhood
+        destinations = self.positions(DESTINATION) + 1
+        has_road = np.zeros(len(destinations), dtype=bool)
+        for step in NEIGHBORHOOD:
+            neighbors = destinations + step
+            has_road |= cells[neighbors[:, 0], neighbors[:, 1]] == ROAD
+        linked_destinations = destinations[has_road]
+
+        # Edges of each node as padded coordinates, -1 where there is no edge. Columns:
+        # next cell, two lane changes, destinations above, left, right and below.
+        nodes = np.concatenate((roads, linked_lights, linked_destinations))
+        node_count = len(nodes)
+        edges = np.full((node_count, 7, 2), -1, dtype=np.int64)
+        road_ids = np.arange(len(roads))
+        light_ids = np.arange(len(roads), len(roads) + len(linked_lights))
+        edges[road_ids[road_has_target], 0] = road_targets[road_has_target]
+        edges[light_ids, 0] = light_targets
+
+        # Lane changes of the nodes with a next cell
+        movers = np.concatenate((road_ids[road_has_target], light_ids))
+        mover_directions = np.concatenate(
+            (road_directions[road_has_target], light_directions[linked])
+        )
+        mover_targets = edges[movers, 0]
+        for column, steps in ((1, DIAGONAL_STEPS[:, 0]), (2, DIAGONAL_STEPS[:, 1])):
+            lane = nodes[movers] + steps[mover_directions]
+            lane_target = targets[lane[:, 0], lane[:, 1]]
+            allowed = (cells[lane[:, 0], lane[:, 1]] == ROAD) & (
+                np.all(lane_target == 0, axis=1)
+                | np.any(lane_target != mover_targets, axis=1)
+            )
+            edges[movers[allowed], column] = lane[allowed]
+
+        # Roads next to each destination point to it
+        road_index = np.full((width + 2, height + 2), -1, dtype=np.int64)
+        road_index[roads[:, 0], roads[:, 1]] = road_ids
+        for column, step in zip(range(3, 7), [(0, -1), (1, 0), (-1, 0), (0, 1)]):
+            # The destination above a road is the road's neighbor (0, 1), etc.
+            neighbors = linked_destinations + step
+            roads_next = road_index[neighbors[:, 0], neighbors[:, 1]]
+            found = roads_next != -1
+            edges[roads_next[found], column] = linked_destinations[found]
+
+        return self.compact_graph(nodes, edges), light_directions
+
+    def on_grid(self, positions):
+        """Checks which padded positions are on the grid."""
+        return (
+            (positions[:, 0] >= 1)
+            & (positions[:, 0] <= self.width)
+            & (positions[:, 1] >= 1)
+            & (positions[:, 1] <= self.height)
+        )
+
+    def compact_graph(self, nodes, edges):
+        """
+        Makes the RoadGraph of the nodes and their edges, both as padded coordinates.
+        Cells pointed by an edge that are not nodes get ids after the nodes in the order they
+        are first pointed, like RoadGraph.from_dict.
+        """
+        width, height = self.width, self.height
+        node_count = len(nodes)
+        present = edges[:, :, 0] != -1
+        offsets = np.zeros(node_count + 1, dtype=np.int32)
+        np.cumsum(present.sum(axis=1), out=offsets[1:])
+        targets = edges[present]
+
+        # Keys of the padded cells, light edges can point one cell out of the grid
+        keys = targets[:, 0] * (height + 2) + targets[:, 1]
+        ids = np.full((width + 2) * (height + 2), -1, dtype=np.int64)
+        ids[nodes[:, 0] * (height + 2) + nodes[:, 1]] = np.arange(node_count)
+        dangling = ids[keys] == -1
+        dangling_keys, first = np.unique(keys[dangling], return_index=True)
+        dangling_keys = dangling_keys[np.argsort(first)]
+        ids[dangling_keys] = node_count + np.arange(len(dangling_keys))
+
+        coords = np.concatenate(
+            (
+                nodes,
+                np.column_stack(
+                    (dangling_keys // (height + 2), dangling_keys % (height + 2))
+                ),
+            )
+        )
+        return RoadGraph(
+            width,
+            height,
+            (coords - 1).astype(np.int32),
+            offsets,
+            ids[keys].astype(np.int32),
+            node_count,
+        )
+
+
+def group_adjacent(positions, neighborhood=NEIGHBORHOOD):
+    """
+    Groups the positions that touch each other on a neighborhood, by default the von Neumann
+    one, e.g. the traffic lights of the lanes of a road.
+    Returns the group number of each position, groups are numbered in order of first position.
+    """
+    index = {tuple(position): i for i, position in enumerate(positions)}
+    groups = [-1] * len(positions)
+    group_count = 0
+    for i, position in enumerate(positions):
+        if groups[i] != -1:
+            continue
+        groups[i] = group_count
+        pending = [tuple(position)]
+        while pending:
+            x, y = pending.pop()
+            for dx, dy in neighborhood:
+                j = index.get((x + dx, y + dy))
+                if j is not None and groups[j] == -1:
+                    groups[j] = group_count
+                    pending.append((x + dx, y + dy))
+        group_count += 1
+    return groups
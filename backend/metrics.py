@@ -0,0 +1,100 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Timers of the phases of a step of the model. The time of each phase is added up during a step
+and then stored on a histogram, so a slow run shows which phase of CityModel.step is responsible.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from time import perf_counter
+
+PHASES = (
+    "spawning",  # spawn_agents and find_spawn_postions
+    "routing",  # Route of the cars (a_star or the next hop fields)
+    "conflicts",  # check_next_move_is_not_car, avoid_collision and check_traffic_light
+    "lights",  # Traffic light updates
+    "moves",  # Grid moves of the cars
+    "recording",  # Frames written to the trajectory log (trajectory.py)
+    "step",  # Whole step of the model
+)  # Phases of a step
+BUCKETS_MS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)  # Histogram limits
+
+
+class PhaseTimers:
+    """
+    Switchable timers of the phases of a step.
+    When the timers are disabled clock and lap return right away, so the instrumented code
+    only pays for a method call.
+    Usage:
+        clock = timers.clock()
+        ...  # code of the phase
+        clock = timers.lap("routing", clock)
+    Attributes:
+        enabled: Whether the phases are timed
+        steps: Number of steps timed
+        current: Seconds spent on each phase on the current step
+        totals: Seconds spent on each phase on all the timed steps
+        maximums: Longest time of each phase on a step, in seconds
+        histograms: Number of steps whose phase time fell on each bucket of BUCKETS_MS
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        """Clears the timings."""
+        self.steps = 0
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.maximums = dict.fromkeys(PHASES, 0.0)
+        self.histograms = {phase: [0] * (len(BUCKETS_MS) + 1) for phase in PHASES}
+
+    def clock(self):
+        """Gets the current time if the timers are enabled."""
+        if self.enabled:
+            return perf_counter()
+        return 0.0
+
+    def lap(self, phase, start):
+        """Adds the time since start to a phase and gets the current time."""
+        if self.enabled:
+            now = perf_counter()
+            self.current[phase] += now - start
+            return now
+        return 0.0
+
+    def end_step(self, start):
+        """Stores the time of each phase of the step that started at start on the histograms."""
+        if not self.enabled:
+            return
+        self.current["step"] += perf_counter() - start
+        self.steps += 1
+        for phase, seconds in self.current.items():
+            self.totals[phase] += seconds
+            self.maximums[phase] = max(self.maximums[phase], seconds)
+            self.histograms[phase][self.bucket(1000 * seconds)] += 1
+            self.current[phase] = 0.0
+
+    def bucket(self, milliseconds):
+        """Gets the histogram bucket of a time."""
+        for i, limit in enumerate(BUCKETS_MS):
+            if milliseconds <= limit:
+                return i
+        return len(BUCKETS_MS)
+
+    def snapshot(self):
+        """Gets the timings of every phase as a dictionary."""
+        labels = [f"le_{limit}" for limit in BUCKETS_MS] + ["inf"]
+        return {
+            "enabled": self.enabled,
+            "steps": self.steps,
+            "phases": {
+                phase: {
+                    "total_ms": round(1000 * self.totals[phase], 4),
+                    "mean_ms": round(1000 * self.totals[phase] / max(self.steps, 1), 4),
+                    "max_ms": round(1000 * self.maximums[phase], 4),
+                    "histogram": dict(zip(labels, self.histograms[phase])),
+                }
+                for phase in PHASES
+            },
+        }
@@ -8,8 +8,29 @@ from mesa import Model
 from mesa.time import RandomActivation, BaseScheduler
 from mesa.space import MultiGrid
 from agent import *
+from a_star import a_star
+from road_graph import RoadGraph
+from map_loader import (
+    CityMap,
+    DIRECTIONS,
+    NO_DIRECTION,
+    ROAD,
+    TRAFFIC_LIGHT,
+    OBSTACLE,
+    DESTINATION,
+    group_adjacent,
+)
+from map_cache import load_compiled_map
+from routing import RouteFields, follow_next_hop_field
+from fleet import Fleet
+from partition import PartitionedFleet
+from traffic_control import LightController
+from congestion import CongestionRouter
+from events import EventScheduler
+from trajectory import TrajectoryRecorder
+from metrics import PhaseTimers
 import json
-import random
+import numpy as np
 
 
 class CityModel(Model):
@@ -17,65 +38,232 @@ class CityModel(Model):
     Creates a model based on a city map.
     """
 
-    def __init__(self):
-        # Load the map dictionary. The dictionary maps the characters in the map file to the corresponding agent.
-        data_dictionary = json.load(open("city_files/mapDictionary.json"))
-
+    def __init__(
+        self,
+        routing="field",
+        map_file="city_files/2023_base.txt",
+        dictionary_file="city_files/mapDictionary.json",
+        timers=False,
+        loader="arrays",
+        map_cache=None,
+        engine="agents",
+        lights="fixed",
+        regions=1,
+        seed=None,
+        record=None,
+        scheduler="base",
+    ):
+        """
+        Creates a new city model.
+        Args:
+            routing: "field" to use the precomputed next hop fields of each destination,
+                     "astar" to run a_star for every car on every step,
+                     "congestion" to route with the live costs of congestion.py, the routes
+                     are not cached since the costs change every step.
+            map_file: Map of the city
+            dictionary_file: Dictionary of the characters used on the map
+            timers: Whether to time the phases of each step, see metrics.py
+            loader: "arrays" to parse the map and build the graph with array operations
+                    (map_loader.py), "legacy" to build them agent by agent
+            map_cache: Directory of the compiled maps (map_cache.py), None to parse the map
+            engine: "agents" to step every car as a Car agent, "compact" to step them as the
+                    leaner CompactCar agents, "fleet" to keep the cars on arrays and move
+                    them all at once (fleet.py), needs the "field" routing
+            lights: "fixed" to switch every traffic light each 5 steps, "actuated" to give the
+                    green to the longest queue of each intersection (traffic_control.py)
+            regions: Vertical strips of the grid moved on parallel processes by the fleet
+                     engine (partition.py), 1 to move every car on this process
+            seed: Seed of the random generator of the model (self.random, set up by Mesa),
+                  the same seed spawns the same cars
+            record: Directory to record a frame of every step on (trajectory.py), None to
+                    not record
+            scheduler: "base" to step every agent on every step, "events" to skip the cars
+                       that wait on other cars or red lights until they can move (events.py),
+                       needs car agents and cached routes
+        """
+        if engine == "fleet" and routing != "field":
+            raise ValueError('The fleet engine needs the "field" routing')
+        if regions > 1 and engine != "fleet":
+            raise ValueError("The regions need the fleet engine")
+        if scheduler == "events" and (engine == "fleet" or routing == "congestion"):
+            raise ValueError(
+                'The "events" scheduler needs car agents and a routing other than "congestion"'
+            )
+        # Arguments of the model, to build it again from a checkpoint (checkpoint.py)
+        self.settings = {
+            "routing": routing,
+            "map_file": map_file,
+            "dictionary_file": dictionary_file,
+            "engine": engine,
+            "lights": lights,
+            "regions": regions,
+            "seed": seed,
+            "scheduler": scheduler,
+        }
         self.traffic_lights = []  # List of traffic lights
-        self.graph = {}  # Graph of the city
+        self.cars = {}  # Cars on the simulation by id
+        self.graph = {}  # Graph of the city, a RoadGraph once it is built
         self.step_count = 0  # Step count
         self.agent_count = 0  # Agent count
         self.destinations = []  # List of destinations
         self.destroyed = 0  # Number of destroyed cars
-
-        # For future implementation to make the traffic light intelligent
-        # self.traffic_lights_sets = {}
-        # self.traffic_lights_ids = {}
+        self.routing = routing  # Routing mode of the cars
+        self.route_fields = None  # RouteFields of the destinations on the field routing
+        self.route_cache_hits = 0  # Number of moves taken from a cached route
+        self.route_replans = 0  # Number of routes planned by the cars
+        self.timers = PhaseTimers(timers)  # Timers of the phases of each step
+        self.traffic_light_agents = {}  # Traffic light agent of each position
+        self.light_groups = (
+            []
+        )  # Group of each traffic light, lights that touch share one
 
         # Load the map file. The map file is a text file where each character represents an agent.
-        with open("city_files/2023_base.txt") as base_file:
-            lines = base_file.readlines()
-            self.width = len(lines[0]) - 1
-            self.height = len(lines)
-
-            self.grid = MultiGrid(self.width, self.height, torus=False)
-            self.schedule = BaseScheduler(self)
-
-            # Goes through each character in the map file and creates the corresponding agent.
-            for r, row in enumerate(lines):
-                for c, col in enumerate(row):
-                    # Add the Road agent to the grid and the schedule
-                    if col in ["v", "^", ">", "<"]:
-                        agent = Road(f"r_{r*self.width+c}", self, data_dictionary[col])
-                        self.grid.place_agent(agent, (c, self.height - r - 1))
-                        edge = self.get_first_connected_node(
-                            data_dictionary[col], (c, self.height - r - 1)
-                        )
-                        if edge:
-                            self.graph[(c, self.height - r - 1)] = [edge]
-                        else:
-                            self.graph[(c, self.height - r - 1)] = []
-                    # Add the Traffic Light agent to the grid and the schedule
-                    elif col in ["S", "s"]:
-                        agent = Traffic_Light(
-                            f"S_{r*self.width+c}", self, False if col == "S" else True
-                        )
-                        self.grid.place_agent(agent, (c, self.height - r - 1))
-                        self.schedule.add(agent)
-                        self.traffic_lights.append(agent)
+        # A compiled map from the cache already has the layers and the graph of the map.
+        compiled_map = None
+        if loader == "legacy":
+            with open(map_file) as base_file:
+                lines = base_file.readlines()
+            # Load the map dictionary. The dictionary maps the characters in the map file to the corresponding agent.
+            with open(dictionary_file) as dictionary:
+                data_dictionary = json.load(dictionary)
+            city_map = CityMap.from_lines(lines, data_dictionary)
+        elif map_cache is not None:
+            compiled_map = load_compiled_map(map_file, dictionary_file, map_cache)
+            city_map = compiled_map.city_map
+        else:
+            city_map = CityMap.from_file(map_file, dictionary_file)
+        self.width = city_map.width
+        self.height = city_map.height
+        # Static layers of the map: kind of each cell and direction code of each road.
+        # Roads, obstacles and destinations never act, so they are not agents.
+        self.city_map = city_map
+        self.static_agents = {
+            ROAD: StaticAgents(self, ROAD, Road),
+            OBSTACLE: StaticAgents(self, OBSTACLE, Obstacle),
+            DESTINATION: StaticAgents(self, DESTINATION, Destination),
+        }  # Adapters that show the static cells of each kind as agents
+        self.road_agents = self.static_agents[ROAD]  # Road agent of each road position
+
+        self.grid = MultiGrid(self.width, self.height, torus=False)
+        # Cars waiting on other cars or red lights sleep on the event scheduler
+        self.events = EventScheduler(self) if scheduler == "events" else None
+        self.schedule = self.events or BaseScheduler(self)
+        # Number of cars on each cell of the grid
+        self.car_occupancy = np.zeros((self.width, self.height), dtype=np.int16)
+
+        # Create the agents and the graph of the city
+        if loader == "legacy":
+            self.load_map_legacy(lines, data_dictionary)
+        elif compiled_map is not None:
+            self.load_map(city_map, compiled_map.graph, compiled_map.light_directions)
+        else:
+            self.load_map(city_map)
 
-                    # Add the Obstacle agent to the grid and the schedule
-                    elif col == "#":
-                        agent = Obstacle(f"ob_{r*self.width+c}", self)
-                        self.grid.place_agent(agent, (c, self.height - r - 1))
+        self.running = True
+        # Index of each destination, the goals of the compact cars
+        self.destination_index = {
+            destination: i for i, destination in enumerate(self.destinations)
+        }
+        # Class of the car agents
+        self.car_class = CompactCar if engine == "compact" else Car
+
+        # Direction of the lane on each road and traffic light position
+        self.lane_directions = self.find_lane_directions()
+        # Cells where the cars spawn and the ones without a car on them
+        if compiled_map is not None:
+            self.spawn_cells = compiled_map.spawn_cells
+            self.light_groups = compiled_map.light_groups.tolist()
+        else:
+            self.spawn_cells = self.find_spawn_cells()
+            self.light_groups = group_adjacent(
+                [traffic_light.pos for traffic_light in self.traffic_lights]
+            )
+        self.spawn_cell_set = set(self.spawn_cells)
+        self.free_spawn_cells = set(self.spawn_cells)
+        # Next hop fields of the destinations, built when a route needs them
+        if self.routing == "field":
+            store = compiled_map.field_store() if compiled_map is not None else None
+            self.route_fields = RouteFields(self.graph, self.destinations, store)
+        # Cars on arrays instead of agents
+        if regions > 1:
+            self.fleet = PartitionedFleet(self, regions)
+        else:
+            self.fleet = Fleet(self) if engine == "fleet" else None
+        # Live cost router, its costs follow the cars and the traffic lights
+        self.router = CongestionRouter(self) if routing == "congestion" else None
+        # Controller of the traffic lights, the fixed lights switch themselves
+        self.light_controller = LightController(self) if lights == "actuated" else None
+        # Log of every step, starting with the city before the first step
+        self.recorder = None
+        if record is not None:
+            self.recorder = TrajectoryRecorder(record, self)
+            self.recorder.record(self)
 
-                    # Add the Destination agent to the grid and the schedule
-                    elif col == "D":
-                        agent = Destination(f"d_{r*self.width+c}", self)
-                        self.grid.place_agent(agent, (c, self.height - r - 1))
-                        self.destinations.append(agent.pos)
+    # Step function. Called every step of the simulation.
 
-        self.running = True
+    ############################
+    #### Map functions #########
+    ############################
+
+    def load_map(self, city_map, graph=None, light_directions=None):
+        """
+        Creates the traffic lights of a CityMap and builds the graph with array operations,
+        unless the graph and the directions of the traffic lights are given.
+        """
+        # Agents are created in the order of the map text, like load_map_legacy
+        lights = city_map.positions(TRAFFIC_LIGHT)
+        light_states = city_map.light_states[lights[:, 0], lights[:, 1]].tolist()
+        for (x, y), state in zip(lights.tolist(), light_states):
+            agent = Traffic_Light(
+                f"S_{(self.height - y - 1)*self.width+x}", self, state
+            )
+            self.grid.place_agent(agent, (x, y))
+            self.schedule.add(agent)
+            self.traffic_lights.append(agent)
+            self.traffic_light_agents[agent.pos] = agent
+        self.destinations = [
+            tuple(position) for position in city_map.positions(DESTINATION).tolist()
+        ]
+
+        if graph is None:
+            graph, light_directions = city_map.build_graph()
+        self.graph = graph
+        for traffic_light, direction in zip(
+            self.traffic_lights, light_directions.tolist()
+        ):
+            if direction != NO_DIRECTION:
+                traffic_light.direction = DIRECTIONS[direction]
+
+    def load_map_legacy(self, lines, data_dictionary):
+        """
+        Creates the traffic lights of the map lines one by one and builds the graph from the
+        static layers, cell by cell.
+        """
+        # Goes through each character in the map file and creates the corresponding agent.
+        for r, row in enumerate(lines):
+            for c, col in enumerate(row):
+                # Roads are on the static layers, add their edge to the graph
+                if col in ["v", "^", ">", "<"]:
+                    edge = self.get_first_connected_node(
+                        data_dictionary[col], (c, self.height - r - 1)
+                    )
+                    if edge:
+                        self.graph[(c, self.height - r - 1)] = [edge]
+                    else:
+                        self.graph[(c, self.height - r - 1)] = []
+                # Add the Traffic Light agent to the grid and the schedule
+                elif col in ["S", "s"]:
+                    agent = Traffic_Light(
+                        f"S_{r*self.width+c}", self, False if col == "S" else True
+                    )
+                    self.grid.place_agent(agent, (c, self.height - r - 1))
+                    self.schedule.add(agent)
+                    self.traffic_lights.append(agent)
+                    self.traffic_light_agents[agent.pos] = agent
+
+                # Destinations are on the static layers, keep their positions
+                elif col == "D":
+                    self.destinations.append((c, self.height - r - 1))
 
         # Add the traffic light grid as edges to the graph
         self.fill_traffic_lights_edges()
@@ -83,11 +271,8 @@ class CityModel(Model):
         self.fill_other_edges()
         # Add all destiniy nodes and edges to the graph
         self.add_all_destinies_to_graph()
-
-        # For future implementation to make the traffic light intelligent
-        # self.()
-
-    # Step function. Called every step of the simulation.
+        # Store the graph with integer node ids and CSR arrays, self.graph keeps the dict interface
+        self.graph = RoadGraph.from_dict(self.graph, self.width, self.height)
 
     ############################
     #### Graph functions #######
@@ -271,8 +456,47 @@ class CityModel(Model):
             ):
                 self.graph[position].append((position[0] - 1, position[1] - 1))
 
+    def find_lane_directions(self):
+        """
+        Finds the direction of the lane on each position where a car can be.
+        Roads use their direction and traffic lights the direction of the road that reaches them.
+        """
+        roads = self.city_map.positions(ROAD)
+        directions = self.city_map.directions[roads[:, 0], roads[:, 1]]
+        lane_directions = dict(
+            zip(
+                zip(roads[:, 0].tolist(), roads[:, 1].tolist()),
+                np.array(DIRECTIONS)[directions].tolist(),
+            )
+        )
+        for position, traffic_light in self.traffic_light_agents.items():
+            lane_directions.setdefault(position, traffic_light.direction)
+        return lane_directions
+
+    def static_agent(self, position):
+        """
+        Gets the Road, Obstacle or Destination agent of a position, None if the cell is
+        empty, a traffic light or out of the grid.
+        """
+        x, y = position
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        agents = self.static_agents.get(int(self.city_map.cells[x, y]))
+        return None if agents is None else agents[position]
+
     def get_pos_agent(self, position, object=Road):
         """Gets the road agent on a a position."""
+        # Static cells come from the layers, traffic lights and cars from the occupancy index
+        if object is Road:
+            return self.road_agents.get(position, False)
+        if object in (Obstacle, Destination):
+            agent = self.static_agent(position)
+            return agent if isinstance(agent, object) else False
+        if object is Traffic_Light:
+            return self.traffic_light_agents.get(position, False)
+        if issubclass(object, BaseCar) and not self.has_car(position):
+            return False
+
         for agent in self.grid.get_cell_list_contents([position]):
             # Check if the agent is the given object
             if isinstance(agent, object):
@@ -280,36 +504,138 @@ class CityModel(Model):
 
         return False
 
+    ############################
+    #### Occupancy functions ###
+    ############################
+
+    def has_car(self, position):
+        """Checks if there is a car on a position."""
+        return self.car_occupancy[position[0], position[1]] > 0
+
+    def add_car(self, car, position):
+        """Adds a car to the grid, the schedule and the car registry."""
+        self.place_car(car, position)
+        self.schedule.add(car)
+        self.cars[car.unique_id] = car
+
+    def remove_car(self, car):
+        """Removes a car from the grid, the schedule and the car registry."""
+        self.take_car(car)
+        self.schedule.remove(car)
+        del self.cars[car.unique_id]
+
+    def place_car(self, car, position):
+        """Places a car on the grid and updates the occupancy."""
+        self.grid.place_agent(car, position)
+        self.car_occupancy[position[0], position[1]] += 1
+        self.update_free_spawn_cell(position)
+        if self.light_controller is not None:
+            self.light_controller.car_entered(position)
+        if self.router is not None:
+            self.router.cell_changed(position)
+        if self.events is not None:
+            self.events.cell_changed(position)
+
+    def move_car(self, car, position):
+        """Moves a car on the grid and updates the occupancy."""
+        previous = car.pos
+        self.car_occupancy[previous[0], previous[1]] -= 1
+        self.grid.move_agent(car, position)
+        self.car_occupancy[position[0], position[1]] += 1
+        self.update_free_spawn_cell(previous)
+        self.update_free_spawn_cell(position)
+        if self.light_controller is not None:
+            self.light_controller.car_left(previous)
+            self.light_controller.car_entered(position)
+        if self.router is not None:
+            self.router.cell_changed(previous)
+            self.router.cell_changed(position)
+        if self.events is not None and position != previous:
+            self.events.cell_changed(previous)
+            self.events.cell_changed(position)
+
+    def take_car(self, car):
+        """Takes a car out of the grid and updates the occupancy."""
+        previous = car.pos
+        self.car_occupancy[previous[0], previous[1]] -= 1
+        self.grid.remove_agent(car)
+        self.update_free_spawn_cell(previous)
+        if self.light_controller is not None:
+            self.light_controller.car_left(previous)
+        if self.router is not None:
+            self.router.cell_changed(previous)
+        if self.events is not None:
+            self.events.cell_changed(previous)
+
+    def car_time(self, car):
+        """Gets the time of a car, the event scheduler doesn't set it while the car sleeps."""
+        if self.events is not None:
+            return self.events.car_time(car)
+        return car.time
+
     def count_car_agents(self):
         """Counts the number of car agents in the simulation."""
-        count = 0
-        for agent in self.schedule.agents:
-            # Count the number of car agents
-            if isinstance(agent, Car):
-                count += 1
-        return count
+        if self.fleet is not None:
+            return len(self.fleet)
+        return len(self.cars)
+
+    def car_states(self):
+        """Gets (unique_id, position) of every car, in the order they were created."""
+        if self.fleet is not None:
+            return self.fleet.car_states()
+        return [(car.unique_id, car.pos) for car in self.cars.values()]
+
+    ############################
+    #### Routing functions #####
+    ############################
+
+    def find_path(self, position, goal):
+        """
+        Finds the path from the position to the goal, both included.
+        Returns None if the goal can't be reached from the position.
+        """
+        if self.routing == "astar":
+            return a_star(self.graph, position, goal)
+        if self.routing == "congestion":
+            return self.router.find_path(position, goal)
+
+        # Follow the next hop field of the goal
+        path = follow_next_hop_field(
+            self.route_fields.field(self.destination_index[goal]),
+            self.graph.node_id(position),
+            self.graph.node_id(goal),
+        )
+        if path is None:
+            return None
+        return [self.graph.positions[node] for node in path]
 
     ############################
     #### Spawn functions #######
     ############################
 
+    def find_spawn_cells(self):
+        """
+        Finds all the cells where a car can spawn. The map never changes, so this is only done once.
+        The cells keep the order of grid.coord_iter.
+        """
+        return sorted(
+            position
+            for position, direction in self.find_lane_directions().items()
+            if position in self.road_agents
+            and self.check_spawn_position(position, direction)
+        )
+
+    def update_free_spawn_cell(self, position):
+        """Updates whether a spawn cell is free after a car entered or left it."""
+        if position in self.spawn_cell_set:
+            if self.has_car(position):
+                self.free_spawn_cells.discard(position)
+            else:
+                self.free_spawn_cells.add(position)
+
     def find_spawn_postions(self):
-        """Finds a spawn location for a car agent."""
-        possibleSpawnLocations = []
-        for agent in self.grid.coord_iter():
-            if isinstance(agent[0][0], Road):
-                direction = agent[0][0].direction
-                position = agent[1]
-                if self.check_spawn_position(position, direction):
-                    possibleSpawnLocations.append(position)
-
-        # Return 4 unique random spawn locations
-        for spawn in possibleSpawnLocations:
-            # Check if car is already in the spawn location
-            if self.get_pos_agent(spawn, Car):
-                possibleSpawnLocations.remove(spawn)
-
-        return possibleSpawnLocations
+        """Finds the spawn locations without a car on them."""
+        return [spawn for spawn in self.spawn_cells if spawn in self.free_spawn_cells]
 
     def check_spawn_position(self, position, direction):
         """Checks if a spawn position is valid."""
@@ -319,24 +645,32 @@ class CityModel(Model):
             return True
         elif position[1] == 0 and direction == "Up":
             return True
-        elif position[1] == self.width - 1 and direction == "Down":
+        elif position[1] == self.height - 1 and direction == "Down":
             return True
         else:
             return False
 
-    def spawn_agents(self):
+    def spawn_agents(self, spawn_positions=None):
         """Spawns car agents."""
-        spawn_positions = self.find_spawn_postions()
+        if spawn_positions is None:
+            spawn_positions = self.find_spawn_postions()
         # From the possible spawn locations, choose 4 random spawn locations
         for spawn in spawn_positions:
             # Choose a random destiny
-            destiny = random.choice(self.destinations)
-            # Create the car agent
-            car = Car(self.agent_count, self, destiny)
+            destiny = self.random.choice(self.destinations)
+            self.spawn_car(spawn, destiny)
+
+    def spawn_car(self, position, goal):
+        """Creates a car on a position going to a goal, on the engine of the model."""
+        if self.fleet is not None:
+            self.fleet.add_car(self.agent_count, position, goal)
             self.agent_count += 1
-            # Add the car agent to the grid and the schedule
-            self.grid.place_agent(car, spawn)
-            self.schedule.add(car)
+            return
+        # Create the car agent
+        car = self.car_class(self.agent_count, self, goal)
+        self.agent_count += 1
+        # Add the car agent to the grid, the schedule and the registry
+        self.add_car(car, position)
 
     ############################
     #### Destiny functions #####
@@ -365,67 +699,29 @@ class CityModel(Model):
                     self.graph[neighbor].append(destiny)
                     self.graph[destiny] = []
 
-    ########################################################
-    #### Intellignet traffic light future implementation ###
-    ########################################################
-
-    """
-    def set_traffic_lights_sets(self):
-         #Sets the traffic lights sets.
-
-        cont = 0
-        done = []
-        for traffic_light in self.traffic_lights:
-            # Get traffic light neighborhood and get the
-            neighborhood = self.grid.get_neighborhood(
-                traffic_light.pos, moore=False, include_center=False
-            )
-            for neighbor in neighborhood:
-                if self.get_pos_agent(neighbor, Traffic_Light) and neighbor not in done:
-                    self.traffic_lights_sets[cont] = {
-                        "traffic_light": [
-                            traffic_light.pos,
-                            neighbor,
-                        ],
-                        "invocation": 0,
-                        "cooldown": False,
-                        "toGreen": False,
-                    }
-                    self.traffic_lights_ids[traffic_light.pos] = cont
-                    self.traffic_lights_ids[neighbor] = cont
-
-                    done.append(neighbor)
-                    done.append(traffic_light.pos)
-                    cont += 1
-
-        self.addTrafficLightsNeighborSets()
-
-    # Add traffc lights neighbor sets
-    def addTrafficLightsNeighborSets(self):
-        #Adds the traffic lights neighbor sets
-        for key1, value1 in self.traffic_lights_sets.items():
-            for key2, value2 in self.traffic_lights_sets.items():
-                if key1 != key2:
-                    # Check if any of the traffic lights in value1 are neighbors of those in value2
-                    for coord1 in value1["traffic_light"]:
-                        for coord2 in value2["traffic_light"]:
-                            if self.coordinate_difference_chec(coord1, coord2):
-                                self.traffic_lights_sets[key1]["neighbors"] = key2
-
-    def coordinate_difference_chec(self, coord1, coord2):
-        #Checks if the difference between two coordinates is 1.
-        if abs(coord1[0] - coord2[0]) == 1 and abs(coord1[1] - coord2[1]) == 1:
-            return True
-        else:
-            return False
-    """
-
     def step(self):
         """Advance the model by one step."""
+        start = self.timers.clock()
         if self.step_count % 3 == 0:
-            self.spawn_agents()
-        if len(self.find_spawn_postions()) == 0:
-            self.running = False
+            spawn_positions = self.find_spawn_postions()
+            # Stop the simulation when the cars block every spawn position
+            if len(spawn_positions) == 0:
+                self.running = False
+            self.spawn_agents(spawn_positions)
+        self.timers.lap("spawning", start)
 
         self.step_count += 1
+        if self.light_controller is not None:
+            clock = self.timers.clock()
+            self.light_controller.step()
+            self.timers.lap("lights", clock)
         self.schedule.step()
+        if self.fleet is not None:
+            clock = self.timers.clock()
+            self.fleet.step()
+            self.timers.lap("moves", clock)
+        if self.recorder is not None:
+            clock = self.timers.clock()
+            self.recorder.record(self)
+            self.timers.lap("recording", clock)
+        self.timers.end_step(start)
@@ -0,0 +1,174 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Spatially partitioned stepping of the fleet engine. The grid is split into vertical strips
+(regions) and every step the cars of each region are moved by a worker process.
+A car only reads and writes its node and the nodes its node points to, so the cars of different
+regions never touch each other unless one of them is on a border node, a node that points to
+another region. Border cars are moved first by the coordinator, then every region moves the rest
+of its cars in parallel, and a car that crosses a border belongs to the other region on the next
+step. The order of the moves only depends on the number of regions, never on the timing of the
+workers, so a seed gives the same result with any number of processes.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from multiprocessing import Pool, current_process
+from fleet import Fleet, NO_CAR
+import os
+import weakref
+import numpy as np
+
+STATIC_TABLES = (
+    "sink",
+    "coords",
+    "fields",
+    "neighbors",
+    "is_destination",
+    "cells",
+    "straight",
+    "light_index",
+)  # Arrays of the fleet the workers need to move the cars
+CAR_ARRAYS = ("nodes", "times", "last_x", "last_y", "first_move")  # Sent and returned
+
+region_fleet = None  # Fleet of the worker process, without model and with no cars
+
+
+def build_region_fleet(tables):
+    """Builds a fleet without model and with no cars from the static tables of a fleet."""
+    fleet = Fleet.__new__(Fleet)
+    fleet.__dict__.update(tables)
+    fleet.occupancy = np.zeros(len(tables["coords"]), dtype=np.int16)
+    fleet.car_at = np.full(len(tables["coords"]), NO_CAR, dtype=np.int64)
+    return fleet
+
+
+def init_region_worker(tables):
+    """Builds the fleet of a worker process from the static tables of the fleet."""
+    global region_fleet
+    region_fleet = build_region_fleet(tables)
+
+
+def step_region(task, fleet=None):
+    """
+    Moves the pending cars of a region. The task has the step count, the light states, the
+    arrays of every car on the region (in slot order, CAR_ARRAYS plus goals) and the indexes
+    of the pending ones on those arrays. fleet is the region fleet, the one of the worker
+    process by default.
+    Returns the CAR_ARRAYS of the region after the moves and whether each car is alive.
+    """
+    step_count, states, cars, pending = task
+    fleet = region_fleet if fleet is None else fleet
+    for name, array in cars.items():
+        setattr(fleet, name, array)
+    np.add.at(fleet.occupancy, fleet.nodes, 1)
+    fleet.car_at[fleet.nodes] = np.arange(len(fleet.nodes))
+
+    alive = np.ones(len(fleet.nodes), dtype=bool)
+    distances = fleet.fields.distances(fleet.goals[pending], fleet.nodes[pending])
+    fleet.resolve(pending, distances, states, step_count, alive)
+
+    # Only the nodes of the region were touched, clear them for the next task
+    fleet.occupancy[fleet.nodes] = 0
+    fleet.car_at[fleet.nodes] = NO_CAR
+    return {name: getattr(fleet, name) for name in CAR_ARRAYS}, alive
+
+
+class PartitionedFleet(Fleet):
+    """
+    Fleet whose steps are split into regions moved by a pool of processes.
+    With one region there are no border cars and it moves the cars like Fleet.
+    Attributes:
+        regions: Number of vertical strips of the grid
+        workers: Processes of the pool, 0 to move the regions on the current process
+        node_regions: Region of each node, by the column of the node
+        border: Whether each node points to a node of another region
+        pool: Pool of the worker processes, created on the first step
+        region_fleet: Region fleet of the current process when workers is 0
+    """
+
+    def __init__(self, model, regions, workers=None):
+        super().__init__(model)
+        self.regions = regions
+        if workers is None:
+            workers = min(regions, os.cpu_count() or 1)
+        if current_process().daemon:
+            workers = 0  # Pool workers can't have children, like on batch_runner.py
+        self.workers = workers
+        self.pool = None
+        self.region_fleet = None
+
+        columns = np.clip(self.coords[:, 0], 0, model.width - 1)
+        self.node_regions = columns * regions // model.width
+        cell_regions = self.node_regions[self.cells]
+        self.border = (
+            (cell_regions != self.node_regions[:, None]) & (self.cells != self.sink)
+        ).any(axis=1)
+
+    def tables(self):
+        """Gets the static tables the workers need, see init_region_worker."""
+        return {name: getattr(self, name) for name in STATIC_TABLES}
+
+    def close(self):
+        """Stops the worker processes."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    ############################
+    #### Step functions ########
+    ############################
+
+    def step(self):
+        """
+        Moves the border cars on this process and then the cars of each region on the
+        workers, every region gets the arrays of the cars on its nodes.
+        """
+        self.flush()
+        step_count = self.model.step_count
+        states = self.light_states()
+        sources = self.nodes.copy()
+        alive = np.ones(len(self.ids), dtype=bool)
+
+        # Border cars first, the workers never read the nodes they point to
+        distances = self.fields.distances(self.goals, self.nodes)
+        movable = distances != -1
+        on_border = movable & self.border[self.nodes]
+        pending = np.flatnonzero(on_border)
+        self.resolve(pending, distances[pending], states, step_count, alive)
+
+        # Then each region, the border cars are obstacles of the region they ended on
+        inner = movable & ~on_border & alive
+        car_regions = self.node_regions[self.nodes]
+        region_slots = [
+            np.flatnonzero((car_regions == region) & alive)
+            for region in range(self.regions)
+        ]
+        tasks = [
+            (
+                step_count,
+                states,
+                {name: getattr(self, name)[slots] for name in CAR_ARRAYS + ("goals",)},
+                np.flatnonzero(inner[slots]),
+            )
+            for slots in region_slots
+        ]
+        for slots, (cars, region_alive) in zip(region_slots, self.map_regions(tasks)):
+            for name, array in cars.items():
+                getattr(self, name)[slots] = array
+            alive[slots] &= region_alive
+
+        self.occupancy[:] = 0
+        np.add.at(self.occupancy, self.nodes[alive], 1)
+        self.car_at[:] = NO_CAR
+        self.car_at[self.nodes[alive]] = np.flatnonzero(alive)
+        self.finish_step(sources, alive)
+
+    def map_regions(self, tasks):
+        """Runs step_region for every task, on the pool unless workers is 0."""
+        if self.workers == 0:
+            if self.region_fleet is None:
+                self.region_fleet = build_region_fleet(self.tables())
+            return [step_region(task, self.region_fleet) for task in tasks]
+        if self.pool is None:
+            self.pool = Pool(self.workers, init_region_worker, (self.tables(),))
+            weakref.finalize(self, self.pool.terminate)
+        return self.pool.map(step_region, tasks, chunksize=1)
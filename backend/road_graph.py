@@ -0,0 +1,148 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Compact representation of the graph made on model.py.
+Nodes are integer ids and edges are stored as NumPy offset/neighbor arrays (CSR).
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+import numpy as np
+
+
+class RoadGraph:
+    """
+    Graph of the city stored as compressed sparse rows.
+    Attributes:
+        width, height: Size of the grid
+        node_count: Number of nodes with edges information (the keys of the original graph)
+        coords: (n, 2) array with the position of each node id
+        offsets: (node_count + 1,) array, the neighbors of node i are neighbors[offsets[i]:offsets[i + 1]]
+        neighbors: Array with the neighbor node ids of every node
+        node_index: (width, height) array with the node id of each cell, -1 if the cell is not a node
+        node_ids: Dictionary position -> node id
+
+    Nodes pointed by an edge but without edges of their own (e.g. a road pointing to an obstacle)
+    get an id after node_count, so every edge can be stored as an integer.
+
+    For the callers that expect the dict of lists graph, graph[position] returns the list of
+    neighbor positions and iterating the graph goes through the positions of the nodes.
+    """
+
+    def __init__(self, width, height, coords, offsets, neighbors, node_count):
+        self.width = width
+        self.height = height
+        self.coords = coords
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.node_count = node_count
+
+        # Position lookups
+        self.positions = [tuple(coord) for coord in coords.tolist()]
+        self.node_ids = {position: node for node, position in enumerate(self.positions)}
+        self.node_index = np.full((width, height), -1, dtype=np.int32)
+        self.node_index[coords[:, 0], coords[:, 1]] = np.arange(
+            len(coords), dtype=np.int32
+        )
+
+        self._reverse = None
+
+    @classmethod
+    def from_dict(cls, graph, width, height):
+        """
+        Builds the compact graph from the dict of lists graph.
+        The node ids follow the insertion order of the dictionary.
+        """
+        positions = list(graph)
+        node_ids = {position: node for node, position in enumerate(positions)}
+        node_count = len(positions)
+
+        offsets = np.zeros(node_count + 1, dtype=np.int32)
+        neighbors = []
+        for node, position in enumerate(positions):
+            for neighbor in graph[position]:
+                if neighbor not in node_ids:
+                    # Node without edges of its own
+                    node_ids[neighbor] = len(positions)
+                    positions.append(neighbor)
+                neighbors.append(node_ids[neighbor])
+            offsets[node + 1] = len(neighbors)
+
+        return cls(
+            width,
+            height,
+            np.array(positions, dtype=np.int32).reshape(-1, 2),
+            offsets,
+            np.array(neighbors, dtype=np.int32),
+            node_count,
+        )
+
+    ############################
+    #### Integer id access #####
+    ############################
+
+    def node_id(self, position):
+        """Gets the node id of a position, None if the position is not a node."""
+        return self.node_ids.get(position)
+
+    def neighbor_ids(self, node):
+        """Gets the neighbor node ids of a node."""
+        if node >= self.node_count:
+            return self.neighbors[:0]
+        return self.neighbors[self.offsets[node] : self.offsets[node + 1]]
+
+    def reverse(self):
+        """
+        Gets the reverse graph as (offsets, neighbors) arrays, where the neighbors of a node
+        are the nodes that reach it.
+        """
+        if self._reverse is None:
+            sources = np.repeat(
+                np.arange(self.node_count, dtype=np.int32), np.diff(self.offsets)
+            )
+            # Stable sort keeps the edges in the order of the original graph
+            order = np.argsort(self.neighbors, kind="stable")
+            counts = np.bincount(self.neighbors, minlength=len(self.coords))
+            offsets = np.zeros(len(self.coords) + 1, dtype=np.int32)
+            np.cumsum(counts, out=offsets[1:])
+            self._reverse = (offsets, sources[order])
+        return self._reverse
+
+    def nbytes(self):
+        """Gets the memory used by the arrays of the graph."""
+        return (
+            self.coords.nbytes
+            + self.offsets.nbytes
+            + self.neighbors.nbytes
+            + self.node_index.nbytes
+        )
+
+    ############################
+    #### Dict compatibility ####
+    ############################
+
+    def __getitem__(self, position):
+        node = self.node_ids[position]
+        if node >= self.node_count:
+            raise KeyError(position)
+        positions = self.positions
+        return [
+            positions[neighbor]
+            for neighbor in self.neighbors[
+                self.offsets[node] : self.offsets[node + 1]
+            ].tolist()
+        ]
+
+    def __contains__(self, position):
+        node = self.node_ids.get(position)
+        return node is not None and node < self.node_count
+
+    def __iter__(self):
+        return iter(self.positions[: self.node_count])
+
+    def __len__(self):
+        return self.node_count
+
+    def keys(self):
+        return self.positions[: self.node_count]
+
+    def items(self):
+        return ((position, self[position]) for position in self)
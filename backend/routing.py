@@ -0,0 +1,139 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Routing fields for the graph made on model.py.
+Each destination gets a "next hop" field, so a car only needs a lookup to know its next move.
+The fields are built when a route first needs them and only the recently used ones are kept.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from collections import OrderedDict, deque
+import numpy as np
+
+ROUTE_CACHE_BYTES = 512 * 2**20  # Memory of the next hop fields kept by RouteFields
+
+
+def build_next_hop_field(graph, destination):
+    """
+    This function builds the next hop field of a destination node id on a RoadGraph.
+    Runs a breadth first search from the destination on the reverse graph,
+    all edge weights are 1 so the distances are the same ones a_star finds.
+    Returns two arrays indexed by node id:
+        next_hop: next node on a shortest path to the destination, -1 if there is none
+        distance: number of moves to the destination, -1 if it can't be reached
+    """
+    offsets, sources = graph.reverse()
+    offsets = offsets.tolist()
+    sources = sources.tolist()
+
+    next_hop = [-1] * len(graph.coords)
+    distance = [-1] * len(graph.coords)
+    distance[destination] = 0
+    queue = deque([destination])
+
+    while queue:
+        current_node = queue.popleft()
+        for previous in sources[offsets[current_node] : offsets[current_node + 1]]:
+            # Skip the nodes that already have a shorter path
+            if distance[previous] != -1:
+                continue
+            distance[previous] = distance[current_node] + 1
+            next_hop[previous] = current_node
+            queue.append(previous)
+
+    return np.array(next_hop, dtype=np.int32), np.array(distance, dtype=np.int32)
+
+
+class RouteFields:
+    """
+    Next hop fields of the destinations of a model, built the first time a route needs them.
+    A field takes two int32 per node, so a big city can't keep the fields of every
+    destination: the least recently used ones are dropped over ROUTE_CACHE_BYTES and built
+    again (or read from the store of the compiled map, see map_cache.py) when needed.
+    Attributes:
+        graph: RoadGraph of the city
+        destinations: Positions of the destinations, fields are indexed like them
+        capacity: Number of fields kept in memory
+        store: Store of the fields on disk with load(index) and save(index, field), or None
+        fields: Field of each destination index in memory, least recently used first
+        built: Number of fields built
+    """
+
+    def __init__(self, graph, destinations, store=None, cache_bytes=None):
+        self.graph = graph
+        self.destinations = destinations
+        field_bytes = 2 * 4 * max(len(graph.coords), 1)
+        cache_bytes = ROUTE_CACHE_BYTES if cache_bytes is None else cache_bytes
+        self.capacity = max(1, cache_bytes // field_bytes)
+        self.store = store
+        self.fields = OrderedDict()
+        self.built = 0
+
+    def __getstate__(self):
+        # Processes that get the fields (partition.py) build their own
+        state = dict(self.__dict__)
+        state["fields"] = OrderedDict()
+        return state
+
+    def field(self, index):
+        """Gets the (next_hop, distance) field of the destination of an index."""
+        field = self.fields.get(index)
+        if field is not None:
+            self.fields.move_to_end(index)
+            return field
+        field = self.store.load(index) if self.store is not None else None
+        if field is None:
+            field = self.build(index)
+            if self.store is not None:
+                self.store.save(index, field)
+        self.fields[index] = field
+        if len(self.fields) > self.capacity:
+            self.fields.popitem(last=False)
+        return field
+
+    def build(self, index):
+        """
+        Builds the field of the destination of an index. A destination without roads
+        around it gets a field of -1, no node can reach it.
+        """
+        self.built += 1
+        node = self.graph.node_id(self.destinations[index])
+        if node is None:
+            empty = np.full(len(self.graph.coords), -1, dtype=np.int32)
+            return empty, empty
+        return build_next_hop_field(self.graph, node)
+
+    def lookup(self, goals, nodes, part):
+        """
+        Gets part (0 for next_hop, 1 for distance) of the fields of the goal indexes at the
+        node ids, both arrays of the same length. Each field is read once.
+        """
+        values = np.empty(len(goals), dtype=np.int32)
+        order = np.argsort(goals, kind="stable")
+        bounds = np.flatnonzero(np.diff(goals[order])) + 1
+        for group in np.split(order, bounds):
+            if len(group):
+                field = self.field(int(goals[group[0]]))
+                values[group] = field[part][nodes[group]]
+        return values
+
+    def next_hops(self, goals, nodes):
+        """Gets the next node from each node id to each goal index, -1 if there is none."""
+        return self.lookup(goals, nodes, 0)
+
+    def distances(self, goals, nodes):
+        """Gets the moves from each node id to each goal index, -1 if it can't be reached."""
+        return self.lookup(goals, nodes, 1)
+
+
+def follow_next_hop_field(field, start, goal):
+    """
+    This function follows a next hop field from the start node id to the goal node id.
+    Returns the path as a list of node ids, None if the goal can't be reached.
+    """
+    next_hop, distance = field
+    if start is None or distance[start] == -1:
+        return None
+    path = [start]
+    while path[-1] != goal:
+        path.append(int(next_hop[path[-1]]))
+    return path
@@ -7,8 +7,11 @@ Date: 2023-11-30
 
 from agent import *
 from model import CityModel
+from map_loader import DIRECTIONS, ROAD, OBSTACLE, DESTINATION
 from mesa.visualization import CanvasGrid, BarChartModule
 from mesa.visualization import ModularServer
+from collections import defaultdict
+import numpy as np
 
 
 # Mesa visualization
@@ -38,7 +41,7 @@ def agent_portrayal(agent):
         portrayal["w"] = 0.8
         portrayal["h"] = 0.8
 
-    if isinstance(agent, Car):
+    if isinstance(agent, BaseCar):
         portrayal["Color"] = "blue"
         portrayal["Layer"] = 2
         portrayal["w"] = 0.8
@@ -47,6 +50,42 @@ def agent_portrayal(agent):
     return portrayal
 
 
+class CityCanvasGrid(CanvasGrid):
+    """
+    Canvas of the city. Roads, obstacles and destinations are on the static layers of the
+    model instead of the grid. Their portrayal only depends on the kind of the cell and the
+    direction of the road, so it is made once for each kind and direction from an agent that
+    is not on the model, and stamped on the cells of model.city_map.cells. Then the agents
+    of the grid (traffic lights and cars) are drawn.
+    """
+
+    def render(self, model):
+        grid_state = defaultdict(list)
+        city_map = model.city_map
+        for kind in (ROAD, OBSTACLE, DESTINATION):
+            agent_class = model.static_agents[kind].agent_class
+            positions = np.argwhere(city_map.cells == kind)
+            codes = city_map.directions[positions[:, 0], positions[:, 1]].tolist()
+            portrayals = {}
+            for (x, y), code in zip(positions.tolist(), codes):
+                if code not in portrayals:
+                    if kind == ROAD:
+                        agent = agent_class(None, model, DIRECTIONS[code])
+                    else:
+                        agent = agent_class(None, model)
+                    portrayals[code] = self.portrayal_method(agent)
+                if portrayals[code]:
+                    portrayal = dict(portrayals[code], x=x, y=y)
+                    grid_state[portrayal["Layer"]].append(portrayal)
+
+        for agent in model.traffic_lights + list(model.cars.values()):
+            portrayal = self.portrayal_method(agent)
+            if portrayal:
+                portrayal["x"], portrayal["y"] = agent.pos
+                grid_state[portrayal["Layer"]].append(portrayal)
+        return grid_state
+
+
 # Width and height of the grid
 width = 0
 height = 0
@@ -58,7 +97,7 @@ with open("city_files/2023_base.txt") as baseFile:
 
 model_params = {}
 
-grid = CanvasGrid(agent_portrayal, width, height, 500, 500)
+grid = CityCanvasGrid(agent_portrayal, width, height, 500, 500)
 
 server = ModularServer(CityModel, [grid], "Traffic Base", model_params)
 
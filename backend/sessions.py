@@ -0,0 +1,370 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Pool of simulation sessions used by the flask server.
+Each session is an independent CityModel. Sessions live on worker processes so several
+clients can run their simulations at the same time.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from multiprocessing import Pipe, Process
+from snapshots import (
+    DeltaTracker,
+    car_positions,
+    traffic_light_positions,
+    encode_binary,
+    map_layers,
+)
+from model import CityModel
+import threading
+import time
+import uuid
+
+STEP_LIMIT = 1000  # Steps a session can run, the limit of the competition
+EVICTION_INTERVAL = 30  # Seconds between the checks for idle sessions
+SESSION_COMMANDS = (
+    "close",
+    "update",
+    "step",
+    "agents",
+    "traffic_lights",
+    "map",
+    "summary",
+    "metrics",
+    "open_stream",
+    "next_frame",
+    "close_stream",
+)  # Commands that can be run on an existing session
+
+
+class SessionError(Exception):
+    """Error on a session request, e.g. an unknown session or the session limit."""
+
+
+class SessionStore:
+    """
+    Sessions of one process.
+    Attributes:
+        sessions: Session id -> session state (model, current step and open streams)
+    """
+
+    def __init__(self):
+        self.sessions = {}
+
+    def handle(self, command, session_id, **args):
+        """
+        Runs a command on a session and returns its result.
+        """
+        if command == "create":
+            return self.create(session_id, **args)
+        if command not in SESSION_COMMANDS:
+            raise SessionError(f"Unknown command {command}")
+        if session_id not in self.sessions:
+            raise SessionError(f"Unknown session {session_id}")
+        return getattr(self, command)(self.sessions[session_id], **args)
+
+    def create(self, session_id, **model_args):
+        """Creates (or resets) a session with a new model."""
+        self.sessions[session_id] = {
+            "id": session_id,
+            "model": CityModel(**model_args),
+            "currentStep": 0,
+            "streams": {},
+        }
+        return session_id
+
+    def close(self, session):
+        """Closes a session."""
+        del self.sessions[session["id"]]
+
+    ############################
+    #### Model commands ########
+    ############################
+
+    def update(self, session, steps=1):
+        """Advances the model of the session, returns the current step."""
+        for _ in range(steps):
+            if session["currentStep"] == STEP_LIMIT:
+                raise SessionError(f"Session reached the step limit of {STEP_LIMIT}")
+            session["model"].step()
+            session["currentStep"] += 1
+        return session["currentStep"]
+
+    def step(self, session, steps=1, format="json"):
+        """Advances the model of the session and gets its cars and traffic lights."""
+        self.update(session, steps)
+        model = session["model"]
+        if format == "binary":
+            return encode_binary(model)
+        return {
+            "currentStep": session["currentStep"],
+            "cars": car_positions(model),
+            "trafficLights": traffic_light_positions(model),
+        }
+
+    def agents(self, session):
+        """Gets the cars of the session."""
+        return car_positions(session["model"])
+
+    def traffic_lights(self, session):
+        """Gets the traffic lights of the session."""
+        return traffic_light_positions(session["model"])
+
+    def map(self, session):
+        """Gets the static layers of the map of the session."""
+        return map_layers(session["model"].city_map)
+
+    def summary(self, session):
+        """Gets the counters of the session."""
+        model = session["model"]
+        return {
+            "currentStep": session["currentStep"],
+            "cars": model.count_car_agents(),
+            "destroyed": model.destroyed,
+        }
+
+    def metrics(self, session, enabled=None, reset=False):
+        """
+        Gets the phase timings of the session, optionally switching the timers on or off
+        or clearing them first.
+        """
+        timers = session["model"].timers
+        if enabled is not None:
+            timers.enabled = enabled
+        if reset:
+            timers.reset()
+        return timers.snapshot()
+
+    ############################
+    #### Stream commands #######
+    ############################
+
+    def open_stream(self, session, keyframe_interval=50):
+        """Opens a delta stream on the session, returns its id."""
+        stream_id = uuid.uuid4().hex
+        session["streams"][stream_id] = DeltaTracker(keyframe_interval)
+        return stream_id
+
+    def next_frame(self, session, stream_id, advance=True):
+        """Optionally advances the model and gets the next frame of a stream."""
+        if advance:
+            self.update(session)
+        return session["streams"][stream_id].next_frame(session["model"])
+
+    def close_stream(self, session, stream_id):
+        """Closes a delta stream."""
+        session["streams"].pop(stream_id, None)
+
+
+def worker_loop(connection):
+    """
+    Loop of a worker process, runs the commands received on the connection.
+    """
+    store = SessionStore()
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        command, session_id, args = message
+        try:
+            connection.send((True, store.handle(command, session_id, **args)))
+        except Exception as error:
+            connection.send((False, error))
+
+
+class Worker:
+    """
+    Worker process that owns some sessions.
+    """
+
+    def __init__(self):
+        self.connection, worker_connection = Pipe()
+        self.process = Process(target=worker_loop, args=(worker_connection,))
+        self.process.daemon = True
+        self.process.start()
+        self.lock = threading.Lock()
+        self.session_count = 0
+
+    def call(self, command, session_id, args):
+        with self.lock:
+            self.connection.send((command, session_id, args))
+            ok, result = self.connection.recv()
+        if not ok:
+            raise result
+        return result
+
+    def stop(self):
+        with self.lock:
+            self.connection.send(None)
+        self.process.join()
+
+
+class LocalWorker:
+    """
+    Worker that keeps its sessions on the current process.
+    """
+
+    def __init__(self):
+        self.store = SessionStore()
+        self.lock = threading.Lock()
+        self.session_count = 0
+
+    def call(self, command, session_id, args):
+        with self.lock:
+            return self.store.handle(command, session_id, **args)
+
+    def stop(self):
+        pass
+
+
+class SessionPool:
+    """
+    Pool of simulation sessions spread across worker processes.
+    Attributes:
+        max_sessions: Maximum number of sessions alive at the same time
+        idle_timeout: Seconds without requests after which a session is closed
+        eviction: "lru" closes the least recently used session when the pool is full,
+                  "reject" refuses to create new sessions until one is closed
+        workers: Worker processes, a single local worker if the pool has no processes
+        sessions: Session id -> worker that owns it, with the sessions being created
+        building: Ids of the new sessions whose first model is being built
+        last_used: Session id -> time of its last request, only the built sessions
+        stopped: Event that stops the thread closing the idle sessions
+    """
+
+    def __init__(self, workers=0, max_sessions=16, idle_timeout=600, eviction="lru"):
+        if eviction not in ("lru", "reject"):
+            raise ValueError(f"Unknown eviction policy {eviction}")
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.eviction = eviction
+        self.workers = [Worker() for _ in range(workers)] or [LocalWorker()]
+        self.sessions = {}
+        self.building = set()
+        self.last_used = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        threading.Thread(target=self.eviction_loop, daemon=True).start()
+
+    def create(self, session_id=None, **model_args):
+        """
+        Creates a session on the least loaded worker and returns its id.
+        Creating a session with the id of an existing one resets it, the old model is kept
+        if the new one can't be built. A new session takes its place on the pool before its
+        model is built, so concurrent requests can't create it twice, and the least recently
+        used session is only closed once the model is built, so a bad request never closes
+        another session.
+        """
+        session_id = session_id or uuid.uuid4().hex[:12]
+        self.evict_idle()
+        with self.lock:
+            if session_id in self.building:
+                raise SessionError(f"Session {session_id} is being created")
+            worker = self.sessions.get(session_id)
+            new = worker is None
+            if new:
+                if self.eviction == "reject" and self.full():
+                    raise SessionError(f"Session limit of {self.max_sessions} reached")
+                worker = min(self.workers, key=lambda worker: worker.session_count)
+                worker.session_count += 1
+                self.sessions[session_id] = worker
+                self.building.add(session_id)
+
+        try:
+            worker.call("create", session_id, model_args)
+        except Exception:
+            if new:
+                with self.lock:
+                    self.building.discard(session_id)
+                    self.forget(session_id)
+            raise
+
+        closing = []
+        with self.lock:
+            self.building.discard(session_id)
+            closed = self.sessions.get(session_id) is not worker
+            if closed:
+                # Closed by another request while the model was built
+                closing.append((worker, session_id))
+            else:
+                self.last_used[session_id] = time.monotonic()
+                while len(self.sessions) > self.max_sessions:
+                    others = [other for other in self.last_used if other != session_id]
+                    if not others:
+                        break
+                    evicted = min(others, key=self.last_used.get)
+                    closing.append((self.forget(evicted), evicted))
+        self.close_on_workers(closing)
+        if closed:
+            raise SessionError(f"Session {session_id} was closed")
+        return session_id
+
+    def full(self):
+        """Checks if the pool has max_sessions sessions. Needs the pool lock."""
+        return len(self.sessions) >= self.max_sessions
+
+    def call(self, session_id, command, **args):
+        """
+        Runs a command on the session and returns its result.
+        """
+        with self.lock:
+            if session_id not in self.sessions or session_id in self.building:
+                raise SessionError(f"Unknown session {session_id}")
+            worker = self.sessions[session_id]
+            self.last_used[session_id] = time.monotonic()
+        return worker.call(command, session_id, args)
+
+    def close(self, session_id):
+        """Closes a session."""
+        with self.lock:
+            if session_id not in self.sessions or session_id in self.building:
+                raise SessionError(f"Unknown session {session_id}")
+            worker = self.forget(session_id)
+        self.close_on_workers([(worker, session_id)])
+
+    ############################
+    #### Eviction functions ####
+    ############################
+
+    def eviction_loop(self):
+        """Closes the idle sessions until the pool is stopped, runs on its own thread."""
+        while not self.stopped.wait(min(EVICTION_INTERVAL, self.idle_timeout)):
+            self.evict_idle()
+
+    def evict_idle(self):
+        """Closes the sessions idle for longer than idle_timeout."""
+        now = time.monotonic()
+        with self.lock:
+            closing = [
+                (self.forget(session_id), session_id)
+                for session_id, last_used in list(self.last_used.items())
+                if now - last_used > self.idle_timeout
+            ]
+        self.close_on_workers(closing)
+
+    def forget(self, session_id):
+        """
+        Removes a session from the pool bookkeeping and returns its worker.
+        Needs the pool lock.
+        """
+        worker = self.sessions.pop(session_id, None)
+        self.last_used.pop(session_id, None)
+        if worker is not None:
+            worker.session_count -= 1
+        return worker
+
+    def close_on_workers(self, sessions):
+        """
+        Closes (worker, session id) sessions already removed from the pool. It waits on the
+        workers, so it runs without the pool lock.
+        """
+        for worker, session_id in sessions:
+            try:
+                worker.call("close", session_id, {})
+            except SessionError:
+                pass  # Reset and closed again by other requests
+
+    def stop(self):
+        """Stops the eviction thread and the worker processes."""
+        self.stopped.set()
+        for worker in self.workers:
+            worker.stop()
@@ -0,0 +1,229 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Snapshots of the cars and traffic lights of the model, used by the flask server to answer Unity.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from map_loader import DIRECTIONS
+import struct
+import numpy as np
+
+# Direction codes used on the binary format
+DIRECTION_CODES = {"Right": 0, "Left": 1, "Up": 2, "Down": 3}
+NO_DIRECTION = 255
+DIRECTION_NAMES = {code: name for name, code in DIRECTION_CODES.items()}
+
+# Names of the cell kinds of map_loader.py, a kind code is its index
+CELL_KIND_NAMES = ("empty", "road", "trafficLight", "obstacle", "destination")
+
+# Binary snapshot layout, all little endian:
+#   header: magic b"CITY", step (uint32), car count (uint32), traffic light count (uint32)
+#   cars: car count records of CAR_DTYPE
+#   traffic lights: traffic light count records of TRAFFIC_LIGHT_DTYPE
+# Traffic lights are sent by their index on the /getTrafficLights list.
+SNAPSHOT_MAGIC = b"CITY"
+SNAPSHOT_HEADER = struct.Struct("<4sIII")
+CAR_DTYPE = np.dtype([("id", "<u4"), ("x", "<u2"), ("z", "<u2"), ("direction", "u1")])
+TRAFFIC_LIGHT_DTYPE = np.dtype(
+    [("index", "<u2"), ("x", "<u2"), ("z", "<u2"), ("state", "u1"), ("direction", "u1")]
+)
+
+
+def car_positions(model):
+    """
+    Gets the position and lane direction of every car of the model.
+    """
+    lane_directions = model.lane_directions
+    return [
+        {
+            "id": car_id,
+            "x": position[0],
+            "y": 0,
+            "z": position[1],
+            "direction": lane_directions.get(position),
+        }
+        for car_id, position in model.car_states()
+    ]
+
+
+def traffic_light_positions(model):
+    """
+    Gets the position, state and direction (to orient them on Unity) of every traffic light.
+    """
+    return [
+        {
+            "id": traffic_light.unique_id,
+            "state": 1 if traffic_light.state else 0,
+            "direction": traffic_light.direction,
+            "x": traffic_light.pos[0],
+            "y": 0,
+            "z": traffic_light.pos[1],
+        }
+        for traffic_light in model.traffic_lights
+    ]
+
+
+def map_layers(city_map):
+    """
+    Gets the static layers of a CityMap: the kind code of each cell and the direction code
+    of each road (-1 on the other cells), as rows of x values from z = 0 up.
+    """
+    return {
+        "width": city_map.width,
+        "height": city_map.height,
+        "kinds": city_map.cells.T.tolist(),
+        "directions": city_map.directions.T.tolist(),
+        "kindNames": list(CELL_KIND_NAMES),
+        "directionNames": list(DIRECTIONS),
+    }
+
+
+def car_records(model):
+    """
+    Gets the cars of the model as CAR_DTYPE records, in the order they were created.
+    """
+    lane_directions = model.lane_directions
+    return np.array(
+        [
+            (
+                car_id,
+                position[0],
+                position[1],
+                DIRECTION_CODES.get(lane_directions.get(position), NO_DIRECTION),
+            )
+            for car_id, position in model.car_states()
+        ],
+        dtype=CAR_DTYPE,
+    )
+
+
+def encode_binary(model):
+    """
+    Encodes the cars and traffic lights of the model on the packed binary snapshot format.
+    """
+    cars = car_records(model)
+    traffic_lights = np.empty(len(model.traffic_lights), dtype=TRAFFIC_LIGHT_DTYPE)
+    for i, traffic_light in enumerate(model.traffic_lights):
+        traffic_lights[i] = (
+            i,
+            traffic_light.pos[0],
+            traffic_light.pos[1],
+            1 if traffic_light.state else 0,
+            DIRECTION_CODES.get(traffic_light.direction, NO_DIRECTION),
+        )
+
+    header = SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, model.step_count, len(cars), len(traffic_lights)
+    )
+    return header + cars.tobytes() + traffic_lights.tobytes()
+
+
+def decode_binary(data):
+    """
+    Decodes a binary snapshot into (step, cars, traffic_lights) with the cars and
+    traffic lights as structured arrays.
+    """
+    magic, step, car_count, traffic_light_count = SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Not a city snapshot")
+    offset = SNAPSHOT_HEADER.size
+    cars = np.frombuffer(data, dtype=CAR_DTYPE, count=car_count, offset=offset)
+    offset += cars.nbytes
+    traffic_lights = np.frombuffer(
+        data, dtype=TRAFFIC_LIGHT_DTYPE, count=traffic_light_count, offset=offset
+    )
+    return step, cars, traffic_lights
+
+
+class DeltaTracker:
+    """
+    Keeps the state last sent to a client and builds the changes of each tick.
+    A full keyframe is built on the first frame and every keyframe_interval frames after that.
+    Attributes:
+        keyframe_interval: Frames between keyframes
+        cars: Last sent position of each car id
+        traffic_lights: Last sent state of each traffic light
+        frames: Number of frames built
+    """
+
+    def __init__(self, keyframe_interval=50):
+        if keyframe_interval < 1:
+            raise ValueError("The keyframe interval must be at least 1")
+        self.keyframe_interval = keyframe_interval
+        self.cars = {}
+        self.traffic_lights = []
+        self.frames = 0
+
+    def next_frame(self, model):
+        """
+        Builds the next frame for the client, a keyframe or a delta.
+        """
+        if self.frames % self.keyframe_interval == 0:
+            frame = self.keyframe(model)
+        else:
+            frame = self.delta(model)
+        self.frames += 1
+        return frame
+
+    def keyframe(self, model):
+        """
+        Builds a keyframe with every car and traffic light of the model.
+        """
+        self.cars = dict(model.car_states())
+        self.traffic_lights = [
+            traffic_light.state for traffic_light in model.traffic_lights
+        ]
+        return {
+            "type": "keyframe",
+            "step": model.step_count,
+            "cars": car_positions(model),
+            "trafficLights": traffic_light_positions(model),
+        }
+
+    def delta(self, model):
+        """
+        Builds a delta with the cars that spawned, moved or were removed, and the
+        traffic lights that changed state, since the last frame.
+        Moved cars are sent as id -> [x, z, direction].
+        Changed traffic lights are sent as index -> state.
+        """
+        lane_directions = model.lane_directions
+        spawned = []
+        moved = {}
+        cars = {}
+        for car_id, position in model.car_states():
+            cars[car_id] = position
+            previous = self.cars.get(car_id)
+            if previous is None:
+                spawned.append(
+                    {
+                        "id": car_id,
+                        "x": position[0],
+                        "y": 0,
+                        "z": position[1],
+                        "direction": lane_directions.get(position),
+                    }
+                )
+            elif previous != position:
+                moved[car_id] = [
+                    position[0],
+                    position[1],
+                    lane_directions.get(position),
+                ]
+        removed = [car_id for car_id in self.cars if car_id not in cars]
+        self.cars = cars
+
+        traffic_lights = {}
+        for i, traffic_light in enumerate(model.traffic_lights):
+            if traffic_light.state != self.traffic_lights[i]:
+                traffic_lights[i] = 1 if traffic_light.state else 0
+                self.traffic_lights[i] = traffic_light.state
+
+        return {
+            "type": "delta",
+            "step": model.step_count,
+            "spawned": spawned,
+            "moved": moved,
+            "removed": removed,
+            "trafficLights": traffic_lights,
+        }
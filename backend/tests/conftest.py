@@ -0,0 +1,21 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Configuration of the tests. The modules of the backend are scripts run from backend/, so it is
+put on the import path and the tests run from it, the map paths are relative to it.
+Usage:
+    python -m pytest backend/tests
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+import os
+import sys
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+
+@pytest.fixture(autouse=True)
+def backend_directory(monkeypatch):
+    """Runs every test from backend/."""
+    monkeypatch.chdir(BACKEND)
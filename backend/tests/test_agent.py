@@ -0,0 +1,68 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Tests of the car agents.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from agent import COMPACT_CAR_BYTES, CompactCar
+from benchmark import add_random_cars, measure_car_bytes
+from map_generator import generate_grid_city, write_map
+from model import CityModel
+import platform
+import random
+import sys
+import pytest
+
+BUDGET_CARS = 2000  # Cars measured, enough to spread the model overhead
+MEASURED_INTERPRETER = (
+    platform.python_implementation() == "CPython"
+    and sys.version_info[:2] == (3, 11)
+    and sys.maxsize > 2**32
+)  # Interpreter COMPACT_CAR_BYTES was measured on
+CAR_HEADER_BYTES = 32  # Object and garbage collector headers of a car
+SLOT_BYTES = 8  # Reference kept on each slot
+FIELD_BYTES = {
+    "unique_id": 32,
+    "cell": 32,
+    "goal_index": 32,
+    "time": 32,
+    "last_cell": 32,
+    "route_index": 32,
+}  # Objects of a car, model, first_move and route are shared (route is None)
+LAYOUT_CARS = 100  # Cars checked by the layout test
+LAYOUT_STEPS = 20  # Steps before the layout is checked
+
+
+@pytest.mark.skipif(
+    not MEASURED_INTERPRETER, reason="The budget was measured on CPython 3.11 64 bit"
+)
+def test_compact_car_budget(tmp_path):
+    """A CompactCar takes at most COMPACT_CAR_BYTES on a city full of cars."""
+    map_file = str(tmp_path / "grid.txt")
+    write_map(generate_grid_city(100, 100), map_file)
+    cars, car_bytes = measure_car_bytes(map_file, "compact", BUDGET_CARS)
+    assert cars >= BUDGET_CARS
+    assert car_bytes <= COMPACT_CAR_BYTES
+
+
+def test_compact_car_layout():
+    """
+    A CompactCar keeps its state on its slots, each one with a small object or a shared one,
+    on any interpreter.
+    """
+    model = CityModel(engine="compact", seed=0)
+    model.step()
+    add_random_cars(model, LAYOUT_CARS, random.Random(0))
+    for _ in range(LAYOUT_STEPS):
+        model.step()
+    assert model.cars
+    for car in model.cars.values():
+        assert not hasattr(car, "__dict__")
+        slots = len(CompactCar.__slots__)
+        assert sys.getsizeof(car) <= CAR_HEADER_BYTES + SLOT_BYTES * slots
+        for name in CompactCar.__slots__:
+            value = getattr(car, name)
+            if name in FIELD_BYTES:
+                assert sys.getsizeof(value) <= FIELD_BYTES[name], name
+            else:
+                assert value is model or value is None or isinstance(value, bool), name
@@ -0,0 +1,50 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Tests of the checkpoints. A restored model must continue exactly like the model that was
+saved, so any state missing from the checkpoint shows up as the two runs drifting apart.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from checkpoint import MODEL_COUNTERS, load_checkpoint, save_checkpoint
+from model import CityModel
+import pytest
+
+WARM_UP_STEPS = 120  # Steps before the save
+RESUMED_STEPS = 150  # Steps both models run after the restore
+
+
+def model_state(model):
+    """Gets the cars, traffic lights, counters and light controller state of a model."""
+    controller = model.light_controller
+    return (
+        model.car_states(),
+        [traffic_light.state for traffic_light in model.traffic_lights],
+        {name: getattr(model, name) for name in MODEL_COUNTERS},
+        None if controller is None else controller.queues.tolist(),
+        None if controller is None else controller.green.tolist(),
+    )
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        dict(routing="field", engine="agents", lights="fixed"),
+        dict(routing="astar", engine="agents", lights="actuated"),
+        dict(routing="congestion", engine="agents", lights="actuated"),
+        dict(routing="field", engine="compact", lights="fixed", scheduler="events"),
+        dict(routing="field", engine="fleet", lights="actuated"),
+    ],
+)
+def test_checkpoint_round_trip(tmp_path, settings):
+    """A restored model continues step for step like the saved one."""
+    model = CityModel(seed=3, **settings)
+    for _ in range(WARM_UP_STEPS):
+        model.step()
+    path = str(tmp_path / "checkpoint.npz")
+    save_checkpoint(model, path)
+    restored = load_checkpoint(path, map_cache=str(tmp_path / "cache"))
+    assert model_state(restored) == model_state(model)
+    for step in range(RESUMED_STEPS):
+        model.step()
+        restored.step()
+        assert model_state(restored) == model_state(model), f"step {step}"
@@ -0,0 +1,67 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Tests of the event scheduler. A model on the "events" scheduler must move its cars exactly like
+the same model on the "base" one, with the same times and route counters.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from benchmark import add_random_cars
+from model import CityModel
+import random
+import pytest
+
+
+def model_state(model):
+    """Gets the state of every car, the traffic lights and the counters of a model."""
+    return (
+        [
+            (
+                car.unique_id,
+                car.pos,
+                model.car_time(car),
+                car.last_move,
+                car.first_move,
+                car.route_index,
+            )
+            for car in model.cars.values()
+        ],
+        [traffic_light.state for traffic_light in model.traffic_lights],
+        model.destroyed,
+        model.route_cache_hits,
+        model.route_replans,
+    )
+
+
+def assert_lockstep(steps, cars=0, **settings):
+    """Steps a model on each scheduler and checks they have the same state every step."""
+    models = []
+    for scheduler in ("base", "events"):
+        model = CityModel(seed=7, scheduler=scheduler, **settings)
+        add_random_cars(model, cars, random.Random(0))
+        models.append(model)
+    base, events = models
+    for step in range(steps):
+        base.step()
+        events.step()
+        assert model_state(events) == model_state(base), f"step {step}"
+    assert events.events.skipped > 0  # Some cars slept
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        dict(),
+        dict(engine="compact"),
+        dict(routing="astar"),
+        dict(lights="actuated"),
+        dict(map_file="city_files/2021_base.txt"),
+    ],
+)
+def test_events_lockstep(settings):
+    assert_lockstep(300, **settings)
+
+
+@pytest.mark.parametrize("engine", ["agents", "compact"])
+def test_events_lockstep_congested(engine):
+    """A full city, where most cars wait on other cars."""
+    assert_lockstep(100, cars=800, engine=engine)
@@ -0,0 +1,45 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Tests of the fleet engine. A model on the "fleet" engine must move its cars exactly like the
+same model on the "agents" one.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from map_generator import generate_grid_city, write_map
+from model import CityModel
+import pytest
+
+GRID_SIZE = 60  # Side of the generated map
+
+
+def model_state(model):
+    """Gets the cars, the destroyed count and the traffic lights of a model."""
+    return (
+        model.car_states(),
+        model.destroyed,
+        [traffic_light.state for traffic_light in model.traffic_lights],
+    )
+
+
+def assert_lockstep(steps, **settings):
+    """Steps a model on each engine and checks they have the same state every step."""
+    agents = CityModel(seed=7, engine="agents", **settings)
+    fleet = CityModel(seed=7, engine="fleet", **settings)
+    for step in range(steps):
+        agents.step()
+        fleet.step()
+        assert model_state(fleet) == model_state(agents), f"step {step}"
+    assert agents.destroyed > 0  # Some cars arrived
+
+
+@pytest.mark.parametrize("lights", ["fixed", "actuated"])
+def test_fleet_lockstep(lights):
+    assert_lockstep(300, lights=lights)
+
+
+@pytest.mark.parametrize("lights", ["fixed", "actuated"])
+def test_fleet_lockstep_generated(tmp_path, lights):
+    """A generated grid city, with more lights and destinations than the base map."""
+    map_file = str(tmp_path / "grid.txt")
+    write_map(generate_grid_city(GRID_SIZE, GRID_SIZE), map_file)
+    assert_lockstep(300, map_file=map_file, lights=lights)
@@ -0,0 +1,31 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Tests of the map generator and validator.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from map_generator import generate_grid_city, main, validate_map, write_map
+from test_map_loader import BUNDLED_MAPS
+import pytest
+
+BROKEN_MAPS = {"city_files/2022_base og.txt"}  # A destination can't be reached
+
+
+@pytest.mark.parametrize("map_file", BUNDLED_MAPS)
+def test_bundled_maps(map_file):
+    assert validate_map(map_file)["valid"] == (map_file not in BROKEN_MAPS)
+
+
+def test_grid_city(tmp_path):
+    """A generated city is valid and keeps at most max_destinations destinations."""
+    map_file = str(tmp_path / "grid.txt")
+    write_map(generate_grid_city(120, 120, max_destinations=20), map_file)
+    report = validate_map(map_file)
+    assert report["valid"] and report["destinations"] == 20
+
+
+def test_validate_needs_output():
+    """A map written to stdout can't be validated."""
+    with pytest.raises(SystemExit) as exit_info:
+        main(["grid", "--width", "30", "--height", "30", "--validate"])
+    assert exit_info.value.code == 2
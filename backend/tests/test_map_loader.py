@@ -0,0 +1,45 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Tests of the array map loader. The graph built with array operations must be the graph the
+agent by agent loader builds, node and edge order included, or the routes of the cars change.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from model import CityModel
+from map_generator import generate_grid_city, write_map
+import glob
+import os
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_MAPS = sorted(
+    os.path.relpath(path, BACKEND)
+    for path in glob.glob(os.path.join(BACKEND, "city_files", "*.txt"))
+)  # Maps shipped with the project
+
+
+def city_layout(model):
+    """Gets the edges of every node, the traffic lights and the destinations of a model."""
+    return (
+        [(node, list(model.graph[node])) for node in model.graph],
+        [(light.pos, light.direction) for light in model.traffic_lights],
+        list(model.destinations),
+    )
+
+
+def assert_same_layout(map_file):
+    """Checks the array loader builds the same city as the legacy one."""
+    legacy = CityModel(map_file=map_file, loader="legacy")
+    arrays = CityModel(map_file=map_file, loader="arrays")
+    assert city_layout(arrays) == city_layout(legacy)
+
+
+@pytest.mark.parametrize("map_file", BUNDLED_MAPS)
+def test_arrays_graph_bundled_maps(map_file):
+    assert_same_layout(map_file)
+
+
+def test_arrays_graph_generated_grid(tmp_path):
+    map_file = str(tmp_path / "grid.txt")
+    write_map(generate_grid_city(60, 60), map_file)
+    assert_same_layout(map_file)
@@ -0,0 +1,78 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Tests of the partitioned fleet. One region moves the cars like Fleet, and with more regions the
+result only depends on the number of regions, never on the number of worker processes.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from map_generator import generate_grid_city, write_map
+from model import CityModel
+from partition import PartitionedFleet
+import pytest
+
+GRID_SIZE = 60  # Side of the generated map
+STEPS = 150  # Steps of each run
+REGIONS = 3  # Regions of the partitioned runs
+ARRIVAL_TOLERANCE = 0.1  # Difference of arrived cars allowed against one region
+
+
+@pytest.fixture
+def map_file(tmp_path):
+    map_file = str(tmp_path / "grid.txt")
+    write_map(generate_grid_city(GRID_SIZE, GRID_SIZE), map_file)
+    return map_file
+
+
+def fleet_model(map_file, regions=None, workers=0):
+    """Makes a fleet model, partitioned on regions if given."""
+    model = CityModel(map_file=map_file, engine="fleet", seed=7)
+    if regions is not None:
+        model.fleet = PartitionedFleet(model, regions, workers)
+    return model
+
+
+def model_state(model):
+    """Gets the cars, the destroyed count and the traffic lights of a model."""
+    return (
+        model.car_states(),
+        model.destroyed,
+        [traffic_light.state for traffic_light in model.traffic_lights],
+    )
+
+
+def assert_lockstep(first, second):
+    """Steps both models and checks they have the same state every step."""
+    for step in range(STEPS):
+        first.step()
+        second.step()
+        assert model_state(second) == model_state(first), f"step {step}"
+    assert first.destroyed > 0  # Some cars arrived
+
+
+def test_one_region(map_file):
+    assert_lockstep(fleet_model(map_file), fleet_model(map_file, regions=1))
+
+
+def test_region_workers(map_file):
+    pooled = fleet_model(map_file, REGIONS, workers=2)
+    try:
+        assert_lockstep(fleet_model(map_file, REGIONS), pooled)
+    finally:
+        pooled.fleet.close()
+
+
+def test_regions_keep_cars_apart(map_file):
+    """
+    More regions change the order of the moves, but cars never share a cell and about as
+    many arrive as with one region.
+    """
+    single = fleet_model(map_file, regions=1)
+    model = fleet_model(map_file, REGIONS)
+    for _ in range(STEPS):
+        single.step()
+        model.step()
+        positions = [position for _, position in model.car_states()]
+        assert len(positions) == len(set(positions))
+    assert (
+        abs(model.destroyed - single.destroyed) <= ARRIVAL_TOLERANCE * single.destroyed
+    )
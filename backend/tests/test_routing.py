@@ -0,0 +1,60 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Tests of the next hop fields of routing.py.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from map_cache import FieldStore
+from map_generator import generate_grid_city, write_map
+from model import CityModel
+from routing import RouteFields
+import os
+import numpy as np
+
+LARGE_MAP = 1000  # Side of the generated map, about 450000 road nodes
+CACHED_FIELDS = 3  # Fields kept by the small cache of the test
+
+
+def test_route_fields_large_map(tmp_path):
+    """A large city builds no field up front and keeps at most the capacity in memory."""
+    map_file = str(tmp_path / "grid.txt")
+    write_map(generate_grid_city(LARGE_MAP, LARGE_MAP), map_file)
+    model = CityModel(map_file=map_file, engine="fleet", seed=0)
+    assert model.route_fields.built == 0
+
+    graph = model.graph
+    field_bytes = 2 * 4 * len(graph.coords)
+    fields = RouteFields(
+        graph, model.destinations, cache_bytes=CACHED_FIELDS * field_bytes
+    )
+    for index in range(2 * CACHED_FIELDS):
+        next_hop, distance = fields.field(index)
+        node = graph.node_id(model.destinations[index])
+        if node is not None:
+            assert distance[node] == 0
+        assert len(fields.fields) <= CACHED_FIELDS
+    assert fields.built == 2 * CACHED_FIELDS
+
+    # The fields read on the lookups match the ones of each destination
+    goals = np.array([0, 5, 0, 4], dtype=np.int64)
+    nodes = np.arange(len(goals)) * 1000
+    expected = [fields.field(goal)[1][node] for goal, node in zip(goals, nodes)]
+    assert fields.distances(goals, nodes).tolist() == expected
+
+
+def test_field_store_cap(tmp_path):
+    """A compiled map saves the fields the models build and deletes the old ones over its cap."""
+    map_file = str(tmp_path / "grid.txt")
+    write_map(generate_grid_city(60, 60), map_file)
+    model = CityModel(map_file=map_file, map_cache=str(tmp_path / "compiled"), seed=0)
+    graph, destinations = model.graph, model.destinations
+    built = model.route_fields.field(0)
+    field_bytes = os.path.getsize(model.route_fields.store.path(0))
+
+    store = FieldStore(model.route_fields.store.directory, 2 * field_bytes)
+    fields = RouteFields(graph, destinations, store)
+    assert np.array_equal(fields.field(0)[1], built[1]) and fields.built == 0
+    for index in range(1, 4):
+        fields.field(index)
+    saved = [name for name in os.listdir(store.directory) if name.endswith(".npy")]
+    assert len(saved) <= 2 and os.path.exists(store.path(3))
@@ -0,0 +1,51 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Tests of the session pool of the flask server.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from sessions import SessionError, SessionPool
+import sessions
+import threading
+import time
+
+CREATES = 4  # Concurrent requests creating the same session
+
+
+def test_concurrent_create():
+    """Concurrent requests with the same new id create one session with one model."""
+    pool = SessionPool(workers=2, max_sessions=2, eviction="reject")
+    errors = []
+
+    def create():
+        try:
+            pool.create("same", seed=0)
+        except SessionError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=create) for _ in range(CREATES)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    models = 0
+    for worker in pool.workers:
+        try:
+            worker.call("summary", "same", {})
+            models += 1
+        except SessionError:
+            pass
+    pool.stop()
+    assert len(errors) < CREATES and list(pool.sessions) == ["same"]
+    assert models == 1
+    assert sum(worker.session_count for worker in pool.workers) == 1
+
+
+def test_idle_sessions_closed(monkeypatch):
+    """The idle sessions are closed without other requests reaching the pool."""
+    monkeypatch.setattr(sessions, "EVICTION_INTERVAL", 0.05)
+    pool = SessionPool(workers=0, idle_timeout=0.2)
+    pool.create("idle", seed=0)
+    time.sleep(1)
+    pool.stop()
+    assert not pool.sessions and not pool.workers[0].store.sessions
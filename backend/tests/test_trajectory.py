@@ -0,0 +1,34 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Tests of the trajectory log and its replay on the flask server.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from model import CityModel
+from snapshots import map_layers
+from trajectory import TrajectoryReader
+import os
+import shutil
+import flask_server
+
+STEPS = 20  # Steps recorded
+
+
+def test_replay_map_without_map_file(tmp_path, monkeypatch):
+    """A replay serves the map saved with the log, the map file is not read again."""
+    map_file = str(tmp_path / "city.txt")
+    shutil.copy("city_files/2023_base.txt", map_file)
+    log = str(tmp_path / "log")
+    model = CityModel(map_file=map_file, seed=0, record=log)
+    for _ in range(STEPS):
+        model.step()
+    model.recorder.close()
+    os.remove(map_file)
+
+    monkeypatch.setattr(flask_server, "replayLog", TrajectoryReader(log))
+    monkeypatch.setattr(flask_server, "replayFrames", {})
+    client = flask_server.app.test_client()
+    assert client.get("/init?session=replay").status_code == 200
+    response = client.get("/getMap?session=replay")
+    assert response.status_code == 200
+    assert response.get_json() == map_layers(model.city_map)
@@ -0,0 +1,184 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Queue actuated controller of the traffic lights. Lights are grouped into approaches (the lights
+of the lanes of a road) and approaches into intersections (lights that touch, diagonals included).
+The approaches of an intersection on the same axis form a phase, one phase is green at a time.
+The cars waiting on each approach are counted as they move, and every step each intersection
+gives the green to its longest queue once the current phase had its minimum green.
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from map_loader import group_adjacent
+import numpy as np
+
+DETECTOR_LENGTH = 3  # Cells of each lane counted on an approach, light included
+MIN_GREEN = 3  # Steps a phase stays green before it can change
+MAX_GREEN = 10  # Steps a phase stays green while other phases have cars waiting
+MOORE_NEIGHBORHOOD = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+AXES = {"Right": 0, "Left": 0, "Up": 1, "Down": 1}  # Phase of each light direction
+DIRECTION_STEPS = {"Right": (1, 0), "Left": (-1, 0), "Up": (0, 1), "Down": (0, -1)}
+
+
+class LightController:
+    """
+    Controller of every traffic light of a model.
+    Attributes:
+        model: CityModel of the lights
+        approach_cells: Approach of each cell of the grid, the last approach is a dummy one
+                        for the cells no approach counts
+        queues: Cars on the detector cells of each approach, dummy approach last
+        approach_phases: Phase of each approach
+        phase_intersections: Intersection of each phase, phases are sorted by intersection
+        phase_lights: Indexes on model.traffic_lights of the lights of each phase
+        green: Green phase of each intersection
+        elapsed: Steps since the green phase of each intersection changed
+        switches: Number of phase changes
+    """
+
+    def __init__(self, model):
+        self.model = model
+        lights = model.traffic_lights
+        approaches = model.light_groups
+        intersections = group_adjacent(
+            [light.pos for light in lights], MOORE_NEIGHBORHOOD
+        )
+
+        # Phases, numbered in order of intersection and then of first light
+        phase_ids = {}
+        light_phases = []
+        for light, intersection in zip(lights, intersections):
+            key = (intersection, AXES.get(light.direction, -1))
+            light_phases.append(phase_ids.setdefault(key, len(phase_ids)))
+        keys = sorted(phase_ids, key=lambda key: (key[0], phase_ids[key]))
+        order = {phase_ids[key]: i for i, key in enumerate(keys)}
+        light_phases = [order[phase] for phase in light_phases]
+        self.phase_intersections = np.array([key[0] for key in keys], dtype=np.int64)
+        self.phase_lights = [[] for _ in keys]
+        for i, phase in enumerate(light_phases):
+            self.phase_lights[phase].append(i)
+        approach_count = max(approaches, default=-1) + 1
+        self.approach_phases = np.zeros(approach_count, dtype=np.int64)
+        self.approach_phases[approaches] = light_phases
+
+        # Detector cells, the light and the cells of its lane before it
+        self.approach_cells = np.full(
+            (model.width, model.height), approach_count, dtype=np.int64
+        )
+        for light, approach in zip(lights, approaches):
+            for x, y in self.detector_cells(light):
+                if self.approach_cells[x, y] == approach_count:
+                    self.approach_cells[x, y] = approach
+        self.queues = np.zeros(approach_count + 1, dtype=np.int64)
+        occupied = np.argwhere(model.car_occupancy > 0)
+        np.add.at(
+            self.queues,
+            self.approach_cells[occupied[:, 0], occupied[:, 1]],
+            model.car_occupancy[occupied[:, 0], occupied[:, 1]],
+        )
+
+        # The first light that starts green gives the green phase of its intersection
+        intersection_count = max(intersections, default=-1) + 1
+        self.green = np.full(intersection_count, -1, dtype=np.int64)
+        for light, intersection, phase in zip(lights, intersections, light_phases):
+            if light.state and self.green[intersection] == -1:
+                self.green[intersection] = phase
+        first_phases = np.searchsorted(
+            self.phase_intersections, np.arange(intersection_count)
+        )
+        self.green = np.where(self.green == -1, first_phases, self.green)
+        self.elapsed = np.zeros(intersection_count, dtype=np.int64)
+        self.switches = 0
+        for phase, phase_lights in enumerate(self.phase_lights):
+            state = self.green[self.phase_intersections[phase]] == phase
+            for i in phase_lights:
+                lights[i].state = bool(state)
+
+    def detector_cells(self, light):
+        """
+        Gets the cells counted for a light, the light and up to DETECTOR_LENGTH - 1 cells of
+        the lane that reaches it.
+        """
+        cells = [light.pos]
+        if light.direction is None:
+            return cells
+        dx, dy = DIRECTION_STEPS[light.direction]
+        x, y = light.pos
+        lane_directions = self.model.lane_directions
+        while len(cells) < DETECTOR_LENGTH:
+            x, y = x - dx, y - dy
+            if lane_directions.get((x, y)) != light.direction:
+                break
+            if (x, y) in self.model.traffic_light_agents:
+                break  # Lane of the previous intersection
+            cells.append((x, y))
+        return cells
+
+    ############################
+    #### Queue functions #######
+    ############################
+
+    def car_entered(self, position):
+        """Counts a car that entered a cell."""
+        self.queues[self.approach_cells[position[0], position[1]]] += 1
+
+    def car_left(self, position):
+        """Stops counting a car that left a cell."""
+        self.queues[self.approach_cells[position[0], position[1]]] -= 1
+
+    def cars_moved(self, sources, targets):
+        """
+        Counts the moves of many cars at once, sources and targets are (n, 2) arrays of
+        cells, a None targets means the cars left the grid.
+        """
+        np.subtract.at(
+            self.queues, self.approach_cells[sources[:, 0], sources[:, 1]], 1
+        )
+        if targets is not None:
+            np.add.at(self.queues, self.approach_cells[targets[:, 0], targets[:, 1]], 1)
+
+    def queue_lengths(self):
+        """Gets the cars waiting on each approach, in the order of model.light_groups."""
+        return self.queues[:-1].tolist()
+
+    ############################
+    #### Phase functions #######
+    ############################
+
+    def step(self):
+        """
+        Gives the green to the longest queue of each intersection. The green phase changes
+        once it had MIN_GREEN steps if another phase has more cars waiting, or none are
+        waiting on it, and always after MAX_GREEN steps if another phase has cars waiting.
+        """
+        self.elapsed += 1
+        phase_queues = np.bincount(
+            self.approach_phases,
+            weights=self.queues[:-1],
+            minlength=len(self.phase_lights),
+        )
+        current = phase_queues[self.green]
+
+        # Longest queue of the other phases of each intersection
+        others = phase_queues.copy()
+        others[self.green] = -1
+        order = np.lexsort((-others, self.phase_intersections))
+        firsts = np.flatnonzero(
+            np.diff(self.phase_intersections[order], prepend=-1) != 0
+        )
+        best = order[firsts]
+        best_queues = others[best]
+
+        switch = (
+            (self.elapsed >= MIN_GREEN)
+            & (best_queues > 0)
+            & ((best_queues > current) | (current == 0) | (self.elapsed >= MAX_GREEN))
+        )
+        lights = self.model.traffic_lights
+        for intersection in np.flatnonzero(switch).tolist():
+            for i in self.phase_lights[self.green[intersection]]:
+                lights[i].state = False
+            for i in self.phase_lights[best[intersection]]:
+                lights[i].state = True
+            self.green[intersection] = best[intersection]
+        self.elapsed[switch] = 0
+        self.switches += int(switch.sum())
@@ -0,0 +1,222 @@
+"""
+TC2008B. Sistemas Multiagentes y Gráficas Computacionales Final Project
+Trajectory log of a run. The recorder appends a frame per step to a directory: the cars of the
+frame as CAR_DTYPE records (snapshots.py), the traffic light states as a bitset and an entry on
+the frame index with the step and the position of the frame cars. The reader memory maps the
+index and the records, so any frame is read without going through the previous ones, and the
+flask server replays a log without running the model (python flask_server.py --replay DIR).
+The static layers of the map are saved with the log, a replay doesn't need the map file.
+Usage:
+    python trajectory.py --map city_files/2023_base.txt --steps 1000 --seed 0 --output runs/demo
+Collaborators: Francisco Martinez Gallardo, Omar Rivera
+Date: 2023-11-30
+"""
+from snapshots import CAR_DTYPE, DIRECTION_CODES, DIRECTION_NAMES, NO_DIRECTION
+from snapshots import car_records, map_layers
+import argparse
+import json
+import os
+import numpy as np
+
+LOG_VERSION = 2  # Layout version, other versions are rejected
+FRAME_DTYPE = np.dtype(
+    [("step", "<u4"), ("car_offset", "<u8"), ("car_count", "<u4")]
+)  # Entry of each frame on frames.bin, car_offset counts records of cars.bin
+
+
+class TrajectoryRecorder:
+    """
+    Appends the frames of a model to a log directory. The files are only appended to, and the
+    index entry of a frame is written after its cars and lights, so a reader never sees half
+    of a frame.
+    Attributes:
+        directory: Directory of the log
+        car_records: Number of car records written
+        frames: Number of frames written
+    """
+
+    def __init__(self, directory, model):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "meta.json"), "w") as meta_file:
+            json.dump(
+                {
+                    "version": LOG_VERSION,
+                    "settings": model.settings,
+                    "traffic_lights": [
+                        [
+                            traffic_light.unique_id,
+                            traffic_light.pos[0],
+                            traffic_light.pos[1],
+                            DIRECTION_CODES.get(traffic_light.direction, NO_DIRECTION),
+                        ]
+                        for traffic_light in model.traffic_lights
+                    ],
+                },
+                meta_file,
+            )
+        with open(os.path.join(directory, "map.json"), "w") as map_file:
+            json.dump(map_layers(model.city_map), map_file)
+        self.cars_file = open(os.path.join(directory, "cars.bin"), "wb")
+        self.lights_file = open(os.path.join(directory, "lights.bin"), "wb")
+        self.frames_file = open(os.path.join(directory, "frames.bin"), "wb")
+        self.car_records = 0
+        self.frames = 0
+
+    def record(self, model):
+        """Appends the current cars and traffic light states of the model as a frame."""
+        cars = car_records(model)
+        states = np.array(
+            [traffic_light.state for traffic_light in model.traffic_lights], dtype=bool
+        )
+        self.cars_file.write(cars.tobytes())
+        self.lights_file.write(np.packbits(states, bitorder="little").tobytes())
+        self.cars_file.flush()
+        self.lights_file.flush()
+        frame = np.array(
+            [(model.step_count, self.car_records, len(cars))], dtype=FRAME_DTYPE
+        )
+        self.frames_file.write(frame.tobytes())
+        self.frames_file.flush()
+        self.car_records += len(cars)
+        self.frames += 1
+
+    def close(self):
+        """Closes the files of the log."""
+        for log_file in (self.cars_file, self.lights_file, self.frames_file):
+            log_file.close()
+
+
+class TrajectoryReader:
+    """
+    Random access to the frames of a log, the files are memory mapped. A log that is still
+    being recorded shows its new frames after refresh.
+    Attributes:
+        directory: Directory of the log
+        traffic_lights: (unique_id, x, z, direction code) of each traffic light
+        map_layers: Static layers of the map like snapshots.map_layers
+        frames: FRAME_DTYPE entry of each frame
+        cars: CAR_DTYPE records of every frame
+        light_states: Light state bitset of each frame, a row per frame
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        if meta["version"] != LOG_VERSION:
+            raise ValueError(f"Unknown trajectory log version {meta['version']}")
+        self.settings = meta["settings"]
+        self.traffic_lights = meta["traffic_lights"]
+        with open(os.path.join(directory, "map.json")) as map_file:
+            self.map_layers = json.load(map_file)
+        self.refresh()
+
+    def load(self, name, dtype):
+        """
+        Memory maps the complete records of a file of the log, a frame being written may
+        have half a record at the end. np.memmap can't map empty files.
+        """
+        path = os.path.join(self.directory, name)
+        count = os.path.getsize(path) // dtype.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+    def refresh(self):
+        """Maps the files again to see the frames recorded since the last refresh."""
+        self.frames = self.load("frames.bin", FRAME_DTYPE)
+        self.cars = self.load("cars.bin", CAR_DTYPE)
+        light_bytes = (len(self.traffic_lights) + 7) // 8
+        if light_bytes:
+            self.light_states = self.load(
+                "lights.bin", np.dtype((np.uint8, light_bytes))
+            )
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame_cars(self, frame):
+        """Gets the CAR_DTYPE records of a frame."""
+        entry = self.frames[frame]
+        start = int(entry["car_offset"])
+        return self.cars[start : start + int(entry["car_count"])]
+
+    def frame_states(self, frame):
+        """Gets whether each traffic light is green on a frame."""
+        if not self.traffic_lights:
+            return np.zeros(0, dtype=bool)
+        bits = np.unpackbits(self.light_states[frame], bitorder="little")
+        return bits[: len(self.traffic_lights)].astype(bool)
+
+    def step(self, frame):
+        """Gets the step of the model on a frame."""
+        return int(self.frames[frame]["step"])
+
+    ############################
+    #### Payload functions #####
+    ############################
+
+    def car_positions(self, frame):
+        """Gets the cars of a frame like snapshots.car_positions."""
+        return [
+            {
+                "id": car_id,
+                "x": x,
+                "y": 0,
+                "z": z,
+                "direction": DIRECTION_NAMES.get(direction),
+            }
+            for car_id, x, z, direction in self.frame_cars(frame).tolist()
+        ]
+
+    def traffic_light_positions(self, frame):
+        """Gets the traffic lights of a frame like snapshots.traffic_light_positions."""
+        return [
+            {
+                "id": unique_id,
+                "state": 1 if state else 0,
+                "direction": DIRECTION_NAMES.get(direction),
+                "x": x,
+                "y": 0,
+                "z": z,
+            }
+            for (unique_id, x, z, direction), state in zip(
+                self.traffic_lights, self.frame_states(frame).tolist()
+            )
+        ]
+
+
+def main(argv=None):
+    # Imported here, model.py imports this module for the recorder
+    from model import CityModel
+
+    parser = argparse.ArgumentParser(description="Record the trajectory of a run.")
+    parser.add_argument("--map", default="city_files/2023_base.txt")
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--routing", choices=["field", "astar", "congestion"], default="field"
+    )
+    parser.add_argument(
+        "--engine", choices=["agents", "compact", "fleet"], default="agents"
+    )
+    parser.add_argument("--lights", choices=["fixed", "actuated"], default="fixed")
+    parser.add_argument("--output", required=True, help="Directory of the log")
+    args = parser.parse_args(argv)
+
+    model = CityModel(
+        routing=args.routing,
+        map_file=args.map,
+        engine=args.engine,
+        lights=args.lights,
+        seed=args.seed,
+        record=args.output,
+    )
+    for _ in range(args.steps):
+        model.step()
+    model.recorder.close()
+
+
+if __name__ == "__main__":
+    main()